@@ -12,13 +12,24 @@ from PIL import Image
 import json
 
 # Importar funções dos outros módulos - usando os nomes de arquivo corretos
-from processar_planilha_otimizado_melhorado import processar_planilha_otimizado, atualizar_margem_sem_reprocessamento
-from personalizar_tabela_melhorado import personalizar_tabela_por_marketplace, atualizar_tabela_com_nova_margem
+from processar_planilha_otimizado_melhorado import executar_ingestao, coletar_avisos, versao_dataset, atualizar_margem_sem_reprocessamento, formatar_margem_para_exibicao_final, relatorio_memoria_categorias, verificar_paridade_motores, CALAMINE_DISPONIVEL
+from personalizar_tabela_melhorado import personalizar_tabela_por_marketplace, atualizar_tabela_com_nova_margem, estilizar_margens
 from mapa_brasil_aprimorado import criar_mapa_brasil_interativo, exibir_detalhes_estado
+from cache_planilhas import listar_cache, tamanho_total_cache, limpar_cache, calcular_hash_conteudo, LIMITE_CACHE_BYTES
+from historico_vendas import versao_historico, resumo_historico, limpar_historico
+from banco_vendas import salvar_vendas_no_banco, consultar_metricas, consultar_vendas_por_dia, consultar_por_dimensao, consultar_produtos, consultar_alertas, consultar_opcoes_filtros, listar_versoes_banco, versao_no_banco, VersaoBancoRemovida, MOTOR_BANCO, LIMITE_LINHAS_ALERTAS
+from registro_datasets import publicar_dataset, listar_datasets
+from indice_filtros import obter_indice_filtros, obter_recorte, VALORES_SEM_FILTRO
+from cubo_vendas import obter_cubo, DIMENSOES_CUBO
+from regras_derivacao import carregar_regras_derivacao, versao_regras, ErroRegrasDerivacao
+from cache_agregados import obter_agregado, estatisticas_cache_agregados, listar_cache_agregados, limpar_cache_agregados, ORCAMENTO_CACHE_AGREGADOS_BYTES
+from tarefas_ingestao import iniciar_tarefa, obter_tarefa, listar_tarefas, ESTADO_CONCLUIDA, ESTADO_FALHOU, TAREFAS_SIMULTANEAS
+from metricas_ingestao import medir_carga, registrar_etapa, listar_cargas, detalhar_carga, estatisticas_etapas, exportar_eventos, limpar_metricas, MAX_CARGAS_METRICAS
 
 # --- CONFIGURAÇÕES GLOBAIS ---
 pd.set_option("styler.render.max_elements", 1500000)
-HISTORICO_PATH = "historico.csv"; LOGO_PATH = "logo.png"; USUARIOS_PATH = "usuarios.json"
+# Histórico de vendas acumulado: diretório com uma partição por mês (ver historico_vendas.py)
+HISTORICO_PATH = os.environ.get("VIAFLIX_HISTORICO_DIR", "historico"); LOGO_PATH = "logo.png"; USUARIOS_PATH = "usuarios.json"
 COL_SKU_CUSTOS = 'SKU PRODUTOS'; COL_DATA_CUSTOS = 'DIA DE VENDA'; COL_CONTA_CUSTOS_ORIGINAL = 'CONTAS'
 COL_PLATAFORMA_CUSTOS = 'PLATAFORMA'; COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS = 'MARGEM ESTRATÉGICA'
 COL_MARGEM_REAL_PLANILHA_CUSTOS = 'MARGEM REAL'; COL_VALOR_PRODUTO_PLANILHA_CUSTOS = 'PREÇO UND'
@@ -26,6 +37,16 @@ COL_ID_PRODUTO_CUSTOS = 'ID DO PRODUTO'; COL_QUANTIDADE_CUSTOS_ABA_CUSTOS = 'QUA
 COL_VALOR_PEDIDO_CUSTOS = 'VALOR DO PEDIDO'
 COL_TIPO_ANUNCIO_ML_CUSTOS = 'TIPO ANUNCIO ML'
 COL_TIPO_VENDA = 'TIPO DE VENDA'  # Nova coluna para identificar Marketplace, Atacado ou Showroom
+# Modo de leitura da planilha: "padrao" (pd.read_excel, com o calamine quando instalado), "streaming" (openpyxl somente
+# leitura, memória limitada e progresso) ou "paralelo" (abas e fatias de linhas em processos; compensa em planilhas grandes
+# e com várias CPUs, mas paga a criação dos processos e a cópia do arquivo para cada um)
+MODO_LEITURA_PLANILHA = os.environ.get("VIAFLIX_MODO_LEITURA", "padrao")
+MOTOR_LEITURA_PLANILHA = os.environ.get("VIAFLIX_MOTOR_LEITURA") or None  # "calamine", "openpyxl" ou automático
+# Onde ficam as vendas processadas: "memoria" (DataFrame na sessão) ou "sql" (banco embutido DuckDB/SQLite, ver banco_vendas.py)
+BACKEND_DADOS = os.environ.get("VIAFLIX_BACKEND_DADOS", "memoria")
+ETAPAS_CARGA = ["validação", "leitura", "conversão", "margens", "estoque", "derivação"]
+ETAPAS_CARGA_HISTORICO = ["validação", "leitura", "histórico", "leitura do histórico", "conversão", "margens", "estoque", "derivação"]
+INTERVALO_PROGRESSO_S = 0.5  # Atualização do painel de progresso da carga em segundo plano
 
 # Cores modernas para o novo design (Tema Claro)
 primary_color = "#1E3A8A"  # Azul profissional
@@ -258,6 +279,9 @@ st.markdown(f"""<style>
 # --- INICIALIZAÇÃO DOS ESTADOS DA SESSÃO ---
 default_states = {
     'authenticated': False, 'app_state': "login", 'df_result': None,
+    'versao_banco': None, 'info_leitura': None, # Backend SQL: versão do dataset no banco; motor e tempo da última leitura
+    'versao_banco_removida': False, # A versão da sessão saiu do banco (novas versões gravadas por outras sessões)
+    'tarefa_ingestao': None, 'assinatura_carga': None, # Chave da carga em segundo plano acompanhada pela sessão; arquivos que a iniciaram
     # Definir datas padrão para um período que provavelmente terá dados ou um default seguro
     'data_inicio_analise_state': datetime.now().date() - timedelta(days=29), # Para 30 dias, o início é D-29
     'data_fim_analise_state': datetime.now().date(),
@@ -289,6 +313,23 @@ def get_margin_color(margin_value_numeric):
         else: return success_color
     except: return primary_color
 
+def mascara_busca_texto(df, termo_busca):
+    """
+    Retorna a máscara das linhas em que alguma coluna de texto contém o termo (case-insensitive).
+    Em colunas categóricas a busca é feita só no dicionário de categorias e mapeada pelos códigos.
+    """
+    busca_lower = termo_busca.lower()
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            categorias_ok = serie.cat.categories.astype(str).str.lower().str.contains(busca_lower, na=False)
+            codigos = serie.cat.codes.to_numpy()
+            mask |= (codigos >= 0) & np.asarray(categorias_ok)[codigos]
+        elif serie.dtype == object or pd.api.types.is_string_dtype(serie.dtype):  # Apenas colunas de texto
+            mask |= serie.astype(str).str.lower().str.contains(busca_lower, na=False).to_numpy()
+    return pd.Series(mask, index=df.index)
+
 def carregar_usuarios():
     if os.path.exists(USUARIOS_PATH):
         try:
@@ -330,36 +371,46 @@ def display_welcome_screen():
         try: logo = Image.open(LOGO_PATH); st.image(logo, width=300, use_container_width=False)
         except: pass
         st.markdown("<h2 style='text-align: center;'>Dashboard de Performance ViaFlix</h2>", unsafe_allow_html=True)
-        st.markdown("<p style='text-align: center; font-size: 1.1rem;'>Faça o upload da sua planilha de custos para começar a análise.</p>", unsafe_allow_html=True)
-        uploaded_file = st.file_uploader(" ", type=["xlsx"], label_visibility="collapsed", key="welcome_uploader_final_v10")
-        st.markdown("<p style='text-align: center; font-size: 0.9rem; color: grey;'>Arraste e solte o arquivo ou clique para procurar.</p>", unsafe_allow_html=True)
-    return uploaded_file
+        st.markdown("<p style='text-align: center; font-size: 1.1rem;'>Faça o upload da sua planilha de custos (ou uma por conta) para começar a análise.</p>", unsafe_allow_html=True)
+        uploaded_files = st.file_uploader(" ", type=["xlsx"], accept_multiple_files=True, label_visibility="collapsed", key="welcome_uploader_final_v12")
+        st.markdown("<p style='text-align: center; font-size: 0.9rem; color: grey;'>Arraste e solte os arquivos ou clique para procurar.</p>", unsafe_allow_html=True)
+        st.checkbox("Adicionar ao histórico salvo (apenas os dias novos ou alterados são gravados)", key="incorporar_historico_v10")
+        if versao_historico(HISTORICO_PATH) is not None:
+            st.button("📂 Abrir histórico salvo", key="btn_abrir_historico_v10", use_container_width=True)
+    return uploaded_files
 
-def display_metrics(df, tipo_margem_selecionada_ui_metrics, categoria=None):
+def display_metrics(df, tipo_margem_selecionada_ui_metrics, categoria=None, metricas=None):
     """
-    Exibe métricas gerais ou específicas por categoria (Marketplace, Atacado, Showroom)
+    Exibe métricas gerais ou específicas por categoria (Marketplace, Atacado, Showroom).
+    df chega já filtrado pelo main() (categoria inclusive); `categoria` define só o título.
+    `metricas` chega já agregada pelo cubo diário (dataset em memória) ou pelo banco (ver consultar_metricas);
+    nesse caso df não é usado.
     """
     st.subheader("Visão Geral" if categoria == "Todos" or categoria is None else f"Visão Geral - {categoria}")
     
-    # Filtrar por categoria se necessário
-    if categoria and categoria != "Todos" and COL_TIPO_VENDA in df.columns:
-        df_filtered = df[df[COL_TIPO_VENDA] == categoria].copy()
-    else:
-        df_filtered = df.copy()
-    
     col_m1, col_m2, col_m3, col_m4 = st.columns(4)
-    
-    total_vendas_met = df_filtered[COL_VALOR_PEDIDO_CUSTOS].sum() if COL_VALOR_PEDIDO_CUSTOS in df_filtered.columns else 0.0
-    
     margem_media_fmt_met = "0,00%"
-    if 'Margem_Num' in df_filtered.columns and not df_filtered['Margem_Num'].empty:
-        margem_media_calc_met = df_filtered['Margem_Num'].mean() 
-        if not pd.isna(margem_media_calc_met): 
-            margem_media_fmt_met = f"{margem_media_calc_met:.2f}".replace(".", ",") + "%"
-    
     letra_margem_met = tipo_margem_selecionada_ui_metrics.split('(')[-1].split(')')[0] if '(' in tipo_margem_selecionada_ui_metrics else 'N/A'
-    total_skus_met = df_filtered[COL_SKU_CUSTOS].nunique() if COL_SKU_CUSTOS in df_filtered.columns else 0
-    total_pedidos_met = len(df_filtered) if not df_filtered.empty else 0
+    
+    if metricas is not None:
+        total_vendas_met = metricas["faturamento"]
+        if metricas["margem_media"] is not None:
+            margem_media_fmt_met = f"{metricas['margem_media']:.2f}".replace(".", ",") + "%"
+        total_skus_met = metricas["skus_unicos"]
+        total_pedidos_met = metricas["pedidos"]
+    else:
+        # O recorte já vem filtrado (índice de filtros no main): as métricas leem as colunas sem refiltrar nem copiar
+        df_filtered = df
+        
+        total_vendas_met = df_filtered[COL_VALOR_PEDIDO_CUSTOS].sum() if COL_VALOR_PEDIDO_CUSTOS in df_filtered.columns else 0.0
+        
+        if 'Margem_Num' in df_filtered.columns and not df_filtered['Margem_Num'].empty:
+            margem_media_calc_met = df_filtered['Margem_Num'].mean() 
+            if not pd.isna(margem_media_calc_met): 
+                margem_media_fmt_met = f"{margem_media_calc_met:.2f}".replace(".", ",") + "%"
+        
+        total_skus_met = df_filtered[COL_SKU_CUSTOS].nunique() if COL_SKU_CUSTOS in df_filtered.columns else 0
+        total_pedidos_met = len(df_filtered) if not df_filtered.empty else 0
     
     # Ícones para cada métrica
     with col_m1: 
@@ -398,9 +449,38 @@ def display_metrics(df, tipo_margem_selecionada_ui_metrics, categoria=None):
         </div>
         """, unsafe_allow_html=True)
 
-def display_category_specific_metrics(df, categoria):
+def agregar_por_dimensao(df, dimensao, medida="pedidos", cubo=None, filtros=None):
     """
-    Exibe métricas específicas para cada categoria (Marketplace, Atacado, Showroom)
+    Pedidos, faturamento ou valor médio por pedido para cada valor de uma dimensão do cubo
+    (conta, plataforma, tipo_venda, tipo_anuncio, estado). Com o cubo (dataset em memória) soma as
+    células do recorte `filtros`; com o backend SQL agrega no banco (consultar_por_dimensao); sem
+    nenhum dos dois agrega as linhas de df. Com filtros, o resultado vem do cache de consultas
+    compartilhado entre as sessões.
+
+    Returns:
+        pd.Series indexada pelos valores presentes no recorte (pedidos: do maior para o menor, como value_counts)
+    """
+    versao_banco = st.session_state.get("versao_banco") if BACKEND_DADOS == "sql" and filtros is not None else None
+    def calcular():
+        if cubo is not None:
+            serie = cubo.por_dimensao(dimensao, filtros, medida)
+        elif versao_banco:
+            serie = consultar_por_dimensao(versao_banco, DIMENSOES_CUBO[dimensao], filtros, medida)
+        elif medida == "pedidos":
+            serie = df[DIMENSOES_CUBO[dimensao]].value_counts().loc[lambda c: c > 0]
+        else:
+            agrupado = df.groupby(DIMENSOES_CUBO[dimensao], observed=True)[COL_VALOR_PEDIDO_CUSTOS]
+            serie = agrupado.mean() if medida == "valor_medio" else agrupado.sum()
+        return serie.sort_values(ascending=False, kind="stable") if medida == "pedidos" else serie
+    versao = None
+    if filtros is not None:
+        versao = cubo.versao if cubo is not None else versao_banco
+    return obter_agregado(versao, ("dimensao", dimensao, medida), filtros, calcular)
+
+def display_category_specific_metrics(df, categoria, cubo=None, filtros=None):
+    """
+    Exibe métricas específicas para cada categoria (Marketplace, Atacado, Showroom).
+    Com o cubo diário (dataset em memória), as distribuições saem das células do recorte `filtros`.
     """
     if categoria == "Marketplaces":
         # Métricas específicas para Marketplaces
@@ -409,7 +489,7 @@ def display_category_specific_metrics(df, categoria):
         with col1:
             # Distribuição por marketplace
             if COL_PLATAFORMA_CUSTOS in df.columns:
-                marketplace_counts = df[COL_PLATAFORMA_CUSTOS].value_counts().reset_index()
+                marketplace_counts = agregar_por_dimensao(df, "plataforma", cubo=cubo, filtros=filtros).reset_index()
                 marketplace_counts.columns = ['Marketplace', 'Contagem']
                 
                 fig = px.pie(
@@ -431,9 +511,17 @@ def display_category_specific_metrics(df, categoria):
         with col2:
             # Tipo de anúncio (para Mercado Livre)
             if 'Tipo de Anúncio' in df.columns:
-                ml_df = df[df[COL_PLATAFORMA_CUSTOS] == 'Mercado Livre']
-                if not ml_df.empty:
-                    anuncio_counts = ml_df['Tipo de Anúncio'].value_counts().reset_index()
+                # Só o Mercado Livre, dentro do recorte: com outro marketplace selecionado não há anúncios a contar
+                plataforma_filtro = (filtros or {}).get("plataforma")
+                if plataforma_filtro in VALORES_SEM_FILTRO or plataforma_filtro == "Mercado Livre":
+                    # O cubo e o banco restringem pelo filtro; só a agregação sobre linhas precisa do recorte do Mercado Livre
+                    agregado_por_filtro = cubo is not None or (BACKEND_DADOS == "sql" and filtros is not None)
+                    anuncio_counts = agregar_por_dimensao(df if agregado_por_filtro else df[df[COL_PLATAFORMA_CUSTOS] == 'Mercado Livre'], "tipo_anuncio",
+                                                          cubo=cubo, filtros=None if filtros is None else {**filtros, "plataforma": "Mercado Livre"})
+                else:
+                    anuncio_counts = pd.Series(dtype="float64")
+                if not anuncio_counts.empty:
+                    anuncio_counts = anuncio_counts.reset_index()
                     anuncio_counts.columns = ['Tipo de Anúncio', 'Contagem']
                     
                     fig = px.bar(
@@ -463,7 +551,7 @@ def display_category_specific_metrics(df, categoria):
         with col1:
             # Valor médio de pedido por região
             if 'Estado' in df.columns and COL_VALOR_PEDIDO_CUSTOS in df.columns:
-                region_avg = df.groupby('Estado')[COL_VALOR_PEDIDO_CUSTOS].mean().reset_index()
+                region_avg = agregar_por_dimensao(df, "estado", "valor_medio", cubo, filtros).reset_index()
                 region_avg.columns = ['Estado', 'Valor Médio']
                 region_avg = region_avg.sort_values('Valor Médio', ascending=False)
                 
@@ -602,21 +690,18 @@ def display_category_specific_metrics(df, categoria):
             
             st.plotly_chart(fig, use_container_width=True)
 
-def display_time_series_chart(df, categoria=None):
+def display_time_series_chart(df, categoria=None, vendas_por_dia=None):
     """
-    Exibe gráfico de série temporal de vendas, filtrado por categoria se especificado
+    Exibe gráfico de série temporal de vendas. df chega já filtrado pelo main() (categoria inclusive).
+    `vendas_por_dia` chega já somada por dia pelo cubo diário ou pelo banco (ver consultar_vendas_por_dia).
     """
-    # Filtrar por categoria se necessário
-    if categoria and categoria != "Todos" and COL_TIPO_VENDA in df.columns:
-        df_filtered = df[df[COL_TIPO_VENDA] == categoria].copy()
-    else:
-        df_filtered = df.copy()
+    if vendas_por_dia is None:
+        if COL_DATA_CUSTOS in df.columns and COL_VALOR_PEDIDO_CUSTOS in df.columns:
+            # Agrupar por dia (datetime64[D], sem um objeto date por linha; a chave é uma série à parte: nenhuma coluna é criada no recorte)
+            dias = pd.Series(pd.to_datetime(df[COL_DATA_CUSTOS]).to_numpy().astype('datetime64[D]'), index=df.index, name='Data')
+            vendas_por_dia = df[COL_VALOR_PEDIDO_CUSTOS].groupby(dias).sum().reset_index()
     
-    if COL_DATA_CUSTOS in df_filtered.columns and COL_VALOR_PEDIDO_CUSTOS in df_filtered.columns:
-        # Agrupar por data
-        df_filtered['Data'] = pd.to_datetime(df_filtered[COL_DATA_CUSTOS]).dt.date
-        vendas_por_dia = df_filtered.groupby('Data')[COL_VALOR_PEDIDO_CUSTOS].sum().reset_index()
-        
+    if vendas_por_dia is not None:
         # Criar gráfico
         fig = px.line(
             vendas_por_dia,
@@ -662,11 +747,10 @@ def handle_map_click(chart_data):
             st.session_state.selected_state = {'estado': point['customdata'][0], 'detalhes_json': point['customdata'][3]}; return True
     return False
 
-def display_alerts_tab(df_alert_src_main, categoria=None):
-    # Filtrar por categoria se necessário
-    if categoria and categoria != "Todos" and COL_TIPO_VENDA in df_alert_src_main.columns:
-        df_alert_src_main = df_alert_src_main[df_alert_src_main[COL_TIPO_VENDA] == categoria].copy()
-    
+def display_alerts_tab(df_alert_src_main, categoria=None, consultar_banco=None):
+    # df_alert_src_main chega já filtrado pelo main() (categoria inclusive). Com o backend SQL, consultar_banco
+    # recebe (tipo de alerta, marketplace, conta, busca, ordenação, crescente) e devolve as linhas já filtradas,
+    # ordenadas e limitadas no banco; df_alert_src_main então só alimenta as opções de marketplace e conta
     col1_alert_final, col2_alert_final = st.columns([1, 3])
     with col1_alert_final:
         with st.container(border=False, key="alert_filter_container"):
@@ -687,15 +771,25 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
             idx_sort_order_alert_final = ["Crescente", "Decrescente"].index(st.session_state.alert_sort_order) if st.session_state.alert_sort_order in ["Crescente", "Decrescente"] else 0
             st.session_state.alert_sort_order = st.radio("Ordem", ["Crescente", "Decrescente"], index=idx_sort_order_alert_final, horizontal=True, key="alert_sort_order_radio_final_v14")
     with col2_alert_final:
-        df_alertas_build_final = df_alert_src_main.copy()
-        if tipo_alerta_final == "Margens Críticas" and "Margem_Critica" in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final["Margem_Critica"] == True]
-        elif tipo_alerta_final == "Estoque Parado" and "Estoque_Parado_Alerta" in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final["Estoque_Parado_Alerta"] == True]
-        elif tipo_alerta_final == "Concorrência de Vendedores" and "Status_Vendedores_ML" in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final["Status_Vendedores_ML"] == "🔴"] 
-        elif tipo_alerta_final == "Alta Performance" and "Margem_Num" in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final["Margem_Num"] > 20]
-        if mp_filtro_alert_final != "Todos" and COL_PLATAFORMA_CUSTOS in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final[COL_PLATAFORMA_CUSTOS] == mp_filtro_alert_final]
-        if conta_filtro_alert_final != "Todos" and COL_CONTA_CUSTOS_ORIGINAL in df_alertas_build_final.columns: df_alertas_build_final = df_alertas_build_final[df_alertas_build_final[COL_CONTA_CUSTOS_ORIGINAL] == conta_filtro_alert_final]
+        alertas_truncados = False
+        if consultar_banco is not None:
+            # Filtros, busca, ordenação e limite no banco: só a página exibida chega à sessão
+            df_alertas_build_final = consultar_banco(tipo_alerta_final, mp_filtro_alert_final, conta_filtro_alert_final, busca_produto_alerta,
+                                                     st.session_state.alert_sort_by, st.session_state.alert_sort_order == "Crescente")
+            alertas_truncados = len(df_alertas_build_final) > LIMITE_LINHAS_ALERTAS
+            df_alertas_build_final = df_alertas_build_final.iloc[:LIMITE_LINHAS_ALERTAS]
+        else:
+            # Tipo de alerta, marketplace e conta: uma única máscara e uma única seleção (sem cópia prévia do recorte)
+            mask_alerta_final = np.ones(len(df_alert_src_main), dtype=bool)
+            if tipo_alerta_final == "Margens Críticas" and "Margem_Critica" in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main["Margem_Critica"] == True).to_numpy()
+            elif tipo_alerta_final == "Estoque Parado" and "Estoque_Parado_Alerta" in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main["Estoque_Parado_Alerta"] == True).to_numpy()
+            elif tipo_alerta_final == "Concorrência de Vendedores" and "Status_Vendedores_ML" in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main["Status_Vendedores_ML"] == "🔴").to_numpy()
+            elif tipo_alerta_final == "Alta Performance" and "Margem_Num" in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main["Margem_Num"] > 20).to_numpy()
+            if mp_filtro_alert_final != "Todos" and COL_PLATAFORMA_CUSTOS in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main[COL_PLATAFORMA_CUSTOS] == mp_filtro_alert_final).to_numpy()
+            if conta_filtro_alert_final != "Todos" and COL_CONTA_CUSTOS_ORIGINAL in df_alert_src_main.columns: mask_alerta_final &= (df_alert_src_main[COL_CONTA_CUSTOS_ORIGINAL] == conta_filtro_alert_final).to_numpy()
+            df_alertas_build_final = df_alert_src_main if mask_alerta_final.all() else df_alert_src_main[mask_alerta_final]
         
-        cols_alert_final_show = [COL_SKU_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS, "Margem_Original", "Estoque Tiny", "Estoque Total Full", "Status_Vendedores_ML"]
+        cols_alert_final_show = [COL_SKU_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS, "Margem_Num", "Estoque Tiny", "Estoque Total Full", "Status_Vendedores_ML"]
         cols_exist_alert_final = [c for c in cols_alert_final_show if c in df_alertas_build_final.columns]
         df_show_alert_final = pd.DataFrame()
         if cols_exist_alert_final and not df_alertas_build_final.empty: df_show_alert_final = df_alertas_build_final[cols_exist_alert_final].drop_duplicates()
@@ -710,7 +804,7 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
                     COL_ID_PRODUTO_CUSTOS: "ID do Produto", 
                     COL_CONTA_CUSTOS_ORIGINAL: "Conta", 
                     COL_PLATAFORMA_CUSTOS: "Marketplace", 
-                    "Margem_Original": "Margem", 
+                    "Margem_Num": "Margem", 
                     "Estoque Total Full": "Estoque Total Full ML", 
                     "Status_Vendedores_ML": "Vendedores Ativos"
                 }
@@ -727,14 +821,8 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
                 # Aplicar filtro de busca se houver texto
                 busca_aplicada = False
                 if busca_produto_alerta:
-                    busca_lower = busca_produto_alerta.lower()
-                    mask = pd.Series(False, index=df_show_alert_final.index)
-                    
-                    # Buscar em todas as colunas de texto
-                    for col in df_show_alert_final.columns:
-                        # Converter para string e aplicar busca case-insensitive
-                        if df_show_alert_final[col].dtype == object:  # Apenas colunas de texto
-                            mask = mask | df_show_alert_final[col].astype(str).str.lower().str.contains(busca_lower, na=False)
+                    # Buscar em todas as colunas de texto (case-insensitive)
+                    mask = mascara_busca_texto(df_show_alert_final, busca_produto_alerta)
                     
                     df_show_alert_final_filtrado = df_show_alert_final[mask]
                     
@@ -747,6 +835,8 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
                 
                 # Exibir título com contagem de itens
                 st.markdown(f"### Tabela de Alertas ({len(df_show_alert_final)} itens)")
+                if alertas_truncados:
+                    st.caption(f"Exibindo os primeiros {LIMITE_LINHAS_ALERTAS} alertas na ordem selecionada; use a busca ou os filtros para refinar.")
                 
                 # Ordenação
                 sort_map_final_alert = {
@@ -763,24 +853,19 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
                     actual_sort_final_alert = sort_map_final_alert[sort_col_final_alert]
                     asc_final_alert = st.session_state.alert_sort_order == "Crescente" 
                     
-                    if actual_sort_final_alert == "Margem":
-                        try: 
-                            df_show_alert_final["_MSort_"] = df_show_alert_final["Margem"].astype(str).str.rstrip('%').str.replace(',', '.', regex=False).astype(float)
-                            df_show_alert_final = df_show_alert_final.sort_values("_MSort_", ascending=asc_final_alert, na_position='last').drop("_MSort_", axis=1)
-                        except: 
-                            df_show_alert_final = df_show_alert_final.sort_values(actual_sort_final_alert, ascending=asc_final_alert, na_position='last')
-                    else: 
-                        df_show_alert_final = df_show_alert_final.sort_values(actual_sort_final_alert, ascending=asc_final_alert, na_position='last')
+                    # Margem já é numérica: ordenação direta, sem converter texto de volta para float
+                    df_show_alert_final = df_show_alert_final.sort_values(actual_sort_final_alert, ascending=asc_final_alert, na_position='last')
                 elif 'SKU' in df_show_alert_final.columns: 
                     df_show_alert_final = df_show_alert_final.sort_values('SKU', ascending=True, na_position='last')
                 
                 # Formatação
                 fmt_dict_final_alert_show = {c: "{:.0f}" for c in df_show_alert_final.columns if "Estoque" in c} 
+                if 'Margem' in df_show_alert_final.columns: fmt_dict_final_alert_show['Margem'] = formatar_margem_para_exibicao_final
                 style_final_alert_show = df_show_alert_final.style 
                 
                 if 'Margem' in df_show_alert_final.columns: 
                     style_final_alert_show = style_final_alert_show.apply(
-                        lambda s: [f'color: {get_margin_color(float(str(v).replace("%","").replace(",",".")) if isinstance(v,str) and "%" in v else 0)}; font-weight: bold' for v in s], 
+                        lambda s: [f'color: {get_margin_color(v if pd.notna(v) else 0)}; font-weight: bold' for v in s], 
                         subset=['Margem']
                     )
                 
@@ -789,7 +874,7 @@ def display_alerts_tab(df_alert_src_main, categoria=None):
 def display_admin_panel():
     st.title("🔧 Painel de Administração")
     usuarios_admin_panel_fn_v9 = carregar_usuarios()
-    tab_u_fn_v9, tab_c_fn_v9, tab_l_fn_v9 = st.tabs(["👥 Gerenciar Usuários", "⚙️ Configurações", "📊 Logs"])
+    tab_u_fn_v9, tab_c_fn_v9, tab_l_fn_v9, tab_cache_fn_v9, tab_hist_fn_v9 = st.tabs(["👥 Gerenciar Usuários", "⚙️ Configurações", "📊 Logs", "💾 Cache", "🗂️ Histórico de Vendas"])
     with tab_u_fn_v9:
         st.subheader("Gerenciar Usuários"); st.markdown("### Usuários Cadastrados")
         if usuarios_admin_panel_fn_v9:
@@ -846,28 +931,163 @@ def display_admin_panel():
         
         if st.button("Salvar Configurações", key="btn_save_config_admin_v9"):
             st.success("Configurações salvas com sucesso!")
+        
+        with st.expander("Memória do Dataset Carregado", expanded=False):
+            df_memoria_fn_v9 = st.session_state.df_result
+            if st.session_state.versao_banco is not None:
+                st.info(f"Backend SQL ({MOTOR_BANCO}): as vendas ficam no banco embutido e a sessão guarda apenas o recorte consultado.")
+                st.dataframe(listar_versoes_banco(), use_container_width=True)
+            elif df_memoria_fn_v9 is None or df_memoria_fn_v9.empty:
+                st.info("Nenhuma planilha carregada.")
+            else:
+                relatorio_memoria_fn_v9 = relatorio_memoria_categorias(df_memoria_fn_v9)
+                total_memoria_mb_fn_v9 = df_memoria_fn_v9.memory_usage(deep=True).sum() / (1024 * 1024)
+                st.metric("Memória total do dataset", f"{total_memoria_mb_fn_v9:.1f} MB".replace(".", ","))
+                st.markdown("Colunas categóricas (texto × categoria):")
+                st.dataframe(relatorio_memoria_fn_v9, use_container_width=True)
+            datasets_fn_v9 = listar_datasets()
+            if not datasets_fn_v9.empty:
+                st.markdown("Datasets compartilhados entre as sessões (Arrow mapeado em memória):")
+                st.dataframe(datasets_fn_v9, use_container_width=True)
+        
+        with st.expander("Leitura da Planilha", expanded=False):
+            info_leitura_fn_v9 = st.session_state.info_leitura
+            if info_leitura_fn_v9:
+                col1_leitura_fn_v9, col2_leitura_fn_v9, col3_leitura_fn_v9 = st.columns(3)
+                with col1_leitura_fn_v9: st.metric("Motor de leitura", info_leitura_fn_v9["motor"])
+                with col2_leitura_fn_v9: st.metric("Tempo de leitura", f"{info_leitura_fn_v9['tempo_s']:.2f} s".replace(".", ","))
+                with col3_leitura_fn_v9: st.metric("Linhas CUSTOS", f"{info_leitura_fn_v9['linhas_custos']:,}".replace(",", "."))
+                if info_leitura_fn_v9.get("tempo_validacao_s") is not None:
+                    st.caption(f"Validação do cabeçalho: {info_leitura_fn_v9['tempo_validacao_s'] * 1000:.0f} ms".replace(".", ",")
+                               + (f" · colunas renomeadas: {', '.join(f'{a} → {b}' for a, b in info_leitura_fn_v9['colunas_renomeadas'].items())}" if info_leitura_fn_v9.get("colunas_renomeadas") else ""))
+                if info_leitura_fn_v9.get("arquivos"): st.caption(f"Lote de {info_leitura_fn_v9['arquivos']} planilhas processadas em paralelo ({info_leitura_fn_v9['modo']}); o tempo inclui o processamento.")
+            else: st.info("Nenhuma planilha carregada.")
+            
+            if CALAMINE_DISPONIVEL:
+                st.markdown("Verificar paridade entre os motores calamine e openpyxl:")
+                arquivo_paridade_fn_v9 = st.file_uploader("Planilha para comparação", type=["xlsx"], key="upload_paridade_motores_admin_v9")
+                if arquivo_paridade_fn_v9 is not None:
+                    colunas_paridade_fn_v9 = [COL_SKU_CUSTOS, COL_DATA_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS,
+                                              COL_VALOR_PRODUTO_PLANILHA_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_QUANTIDADE_CUSTOS_ABA_CUSTOS,
+                                              COL_VALOR_PEDIDO_CUSTOS, COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS, COL_MARGEM_REAL_PLANILHA_CUSTOS,
+                                              COL_TIPO_ANUNCIO_ML_CUSTOS]
+                    dtypes_paridade_fn_v9 = {col: str for col in [COL_SKU_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS,
+                                                                  COL_TIPO_ANUNCIO_ML_CUSTOS, COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS, COL_MARGEM_REAL_PLANILHA_CUSTOS]}
+                    paridade_df_fn_v9 = verificar_paridade_motores(arquivo_paridade_fn_v9.getvalue(), colunas_paridade_fn_v9, dtypes_paridade_fn_v9)
+                    st.dataframe(paridade_df_fn_v9, use_container_width=True)
+                    if paridade_df_fn_v9["Mesmo dtype"].all() and paridade_df_fn_v9["Mesmos valores"].all(): st.success("Os dois motores produzem os mesmos dados.")
+                    else: st.warning("Há diferenças entre os motores; defina VIAFLIX_MOTOR_LEITURA=openpyxl para manter o leitor anterior.")
+            else:
+                st.caption("python-calamine não instalado: a leitura usa o openpyxl.")
+        
+        with st.expander("Tarefas de Carga", expanded=False):
+            st.caption(f"Cargas em segundo plano: até {TAREFAS_SIMULTANEAS} simultâneas; uploads idênticos compartilham a mesma tarefa.")
+            tarefas_df_fn_v9 = listar_tarefas()
+            if tarefas_df_fn_v9.empty: st.info("Nenhuma tarefa de carga registrada.")
+            else: st.dataframe(tarefas_df_fn_v9, use_container_width=True)
     
     with tab_l_fn_v9:
-        st.subheader("Logs do Sistema")
-        st.info("Esta seção exibe logs e atividades do sistema.")
-        
-        # Exemplo de logs
-        log_data_fn_v9 = [
-            {"Data": "2023-05-28 14:30:22", "Usuário": "admin", "Ação": "Login no sistema", "Status": "Sucesso"},
-            {"Data": "2023-05-28 14:35:10", "Usuário": "admin", "Ação": "Upload de planilha", "Status": "Sucesso"},
-            {"Data": "2023-05-28 15:12:45", "Usuário": "user1", "Ação": "Exportação de relatório", "Status": "Sucesso"},
-            {"Data": "2023-05-28 16:05:33", "Usuário": "user2", "Ação": "Alteração de configurações", "Status": "Falha"},
-            {"Data": "2023-05-28 16:30:18", "Usuário": "admin", "Ação": "Adição de usuário", "Status": "Sucesso"}
-        ]
+        st.subheader("Logs de Carga")
+        st.info(f"Tempo e linhas de cada etapa das cargas de planilhas (últimas {MAX_CARGAS_METRICAS} cargas deste servidor). "
+                "Resultados recuperados de cache não geram registro.")
         
-        log_df_fn_v9 = pd.DataFrame(log_data_fn_v9)
-        st.dataframe(log_df_fn_v9, use_container_width=True)
+        cargas_df_fn_v9 = listar_cargas()
+        if cargas_df_fn_v9.empty:
+            st.info("Nenhuma carga registrada desde o início do servidor.")
+        else:
+            st.markdown("**Cargas recentes**")
+            st.dataframe(cargas_df_fn_v9, use_container_width=True, hide_index=True)
+            
+            ultimas_cargas_fn_v9 = st.slider("Cargas consideradas nos percentis", min_value=1, max_value=MAX_CARGAS_METRICAS,
+                                             value=min(20, MAX_CARGAS_METRICAS), key="slider_ultimas_cargas_admin_v19")
+            st.markdown(f"**Duração por etapa (p50/p95 das últimas {ultimas_cargas_fn_v9} cargas concluídas)**")
+            st.dataframe(estatisticas_etapas(ultimas_cargas_fn_v9), use_container_width=True, hide_index=True)
+            
+            descricoes_fn_v9 = dict(zip(cargas_df_fn_v9["Carga"], cargas_df_fn_v9["Início"] + " - " + cargas_df_fn_v9["Planilhas"]))
+            carga_sel_fn_v9 = st.selectbox("Detalhar carga", list(descricoes_fn_v9), format_func=lambda c: descricoes_fn_v9[c],
+                                           key="select_detalhe_carga_admin_v19")
+            detalhe_fn_v9 = detalhar_carga(carga_sel_fn_v9)
+            if not detalhe_fn_v9.empty:
+                st.dataframe(detalhe_fn_v9, use_container_width=True, hide_index=True)
+                fig_etapas_fn_v9 = px.bar(detalhe_fn_v9, x="Duração (s)", y="Etapa", orientation="h", text="% do total")
+                fig_etapas_fn_v9.update_layout(height=60 + 35 * len(detalhe_fn_v9), margin=dict(l=0, r=0, t=10, b=0),
+                                               yaxis=dict(autorange="reversed"))
+                st.plotly_chart(fig_etapas_fn_v9, use_container_width=True, key="chart_detalhe_carga_admin_v19")
         
         col1_log_fn_v9, col2_log_fn_v9 = st.columns(2)
         with col1_log_fn_v9:
-            st.download_button("Exportar Logs", log_df_fn_v9.to_csv(index=False), "logs_sistema.csv", "text/csv", key="btn_export_logs_admin_v9")
+            st.download_button("Exportar Logs", exportar_eventos().to_csv(index=False), "logs_cargas.csv", "text/csv", key="btn_export_logs_admin_v9")
         with col2_log_fn_v9:
-            st.button("Limpar Logs", key="btn_clear_logs_admin_v9")
+            if st.button("Limpar Logs", key="btn_clear_logs_admin_v9"):
+                limpar_metricas(); st.rerun()
+    
+    with tab_cache_fn_v9:
+        st.subheader("Cache de Planilhas Processadas")
+        st.info("Planilhas já lidas ficam salvas em disco (chave SHA-256 do arquivo) e são recarregadas sem reprocessar o Excel.")
+        
+        tamanho_cache_mb = tamanho_total_cache() / (1024 * 1024)
+        limite_cache_mb = LIMITE_CACHE_BYTES / (1024 * 1024)
+        col1_cache_fn_v9, col2_cache_fn_v9 = st.columns(2)
+        with col1_cache_fn_v9: st.metric("Uso do Cache", f"{tamanho_cache_mb:.1f} MB", f"limite {limite_cache_mb:.0f} MB", delta_color="off")
+        with col2_cache_fn_v9: st.progress(min(tamanho_cache_mb / limite_cache_mb, 1.0) if limite_cache_mb else 0.0)
+        
+        cache_df_fn_v9 = listar_cache()
+        if cache_df_fn_v9.empty: st.info("Nenhuma planilha em cache.")
+        else: st.dataframe(cache_df_fn_v9, use_container_width=True)
+        
+        if st.button("Limpar Cache", key="btn_clear_cache_admin_v9"):
+            limpar_cache()
+            st.success("Cache de planilhas removido.")
+            st.rerun()
+        
+        st.markdown("---")
+        st.subheader("Cache de Consultas do Painel")
+        st.info("Métricas, séries, mapa e gráficos por categoria ficam em memória, compartilhados entre as sessões, "
+                "por versão do dataset e filtros. Acima do orçamento, saem as consultas usadas há mais tempo.")
+        estatisticas_agregados = estatisticas_cache_agregados()
+        uso_agregados_mb = estatisticas_agregados["bytes"] / (1024 * 1024)
+        orcamento_agregados_mb = ORCAMENTO_CACHE_AGREGADOS_BYTES / (1024 * 1024)
+        taxa_acerto_agregados = estatisticas_agregados["taxa_acerto"]
+        col1_agregados, col2_agregados, col3_agregados, col4_agregados = st.columns(4)
+        with col1_agregados: st.metric("Uso", f"{uso_agregados_mb:.1f} MB", f"orçamento {orcamento_agregados_mb:.0f} MB", delta_color="off")
+        with col2_agregados: st.metric("Acertos", estatisticas_agregados["acertos"],
+                                       f"{taxa_acerto_agregados:.0%} das consultas" if taxa_acerto_agregados is not None else None, delta_color="off")
+        with col3_agregados: st.metric("Faltas", estatisticas_agregados["faltas"])
+        with col4_agregados: st.metric("Despejos", estatisticas_agregados["despejos"])
+        st.progress(min(uso_agregados_mb / orcamento_agregados_mb, 1.0) if orcamento_agregados_mb else 0.0)
+        
+        cache_agregados_df = listar_cache_agregados()
+        if cache_agregados_df.empty: st.info("Nenhuma consulta em cache.")
+        else: st.dataframe(cache_agregados_df, use_container_width=True)
+        
+        if st.button("Limpar Cache de Consultas", key="btn_clear_cache_agregados_admin_v25"):
+            limpar_cache_agregados(); st.rerun()
+    
+    with tab_hist_fn_v9:
+        st.subheader("Histórico de Vendas")
+        st.info("Uploads com \"Adicionar ao histórico salvo\" gravam apenas os dias de venda novos ou alterados de cada conta, em uma partição por mês: "
+                "a planilha de uma conta não apaga as vendas das outras.")
+        
+        resumo_incorporacao_fn_v9 = st.session_state.get("resumo_ultima_incorporacao")
+        if resumo_incorporacao_fn_v9:
+            st.markdown("Última incorporação:")
+            col1_hist_fn_v9, col2_hist_fn_v9, col3_hist_fn_v9, col4_hist_fn_v9 = st.columns(4)
+            with col1_hist_fn_v9: st.metric("Dias novos", len(resumo_incorporacao_fn_v9["dias_novos"]))
+            with col2_hist_fn_v9: st.metric("Dias alterados", len(resumo_incorporacao_fn_v9["dias_alterados"]))
+            with col3_hist_fn_v9: st.metric("Dias inalterados", resumo_incorporacao_fn_v9["dias_inalterados"])
+            with col4_hist_fn_v9: st.metric("Linhas gravadas", f"{resumo_incorporacao_fn_v9['linhas_gravadas']:,}".replace(",", "."))
+            if resumo_incorporacao_fn_v9["meses_gravados"]: st.caption("Meses regravados: " + ", ".join(resumo_incorporacao_fn_v9["meses_gravados"]))
+        
+        historico_df_fn_v9 = resumo_historico(HISTORICO_PATH)
+        if historico_df_fn_v9.empty: st.info("Nenhuma venda salva no histórico.")
+        else:
+            st.metric("Linhas no histórico", f"{int(historico_df_fn_v9['Linhas'].sum()):,}".replace(",", "."))
+            st.dataframe(historico_df_fn_v9, use_container_width=True)
+        
+        if st.button("Limpar Histórico", key="btn_clear_historico_admin_v9"):
+            limpar_historico(HISTORICO_PATH)
+            st.success("Histórico de vendas removido.")
+            st.rerun()
 
 def display_sidebar_filters(df):
     """
@@ -889,8 +1109,7 @@ def display_sidebar_filters(df):
             elif periodo_selecionado == "30 dias": st.session_state.data_inicio_analise_state = hoje - timedelta(days=29)
             elif periodo_selecionado == "90 dias": st.session_state.data_inicio_analise_state = hoje - timedelta(days=89)
             st.session_state.data_fim_analise_state = hoje
-            # Forçar reprocessamento quando o período mudar
-            # st.session_state.dummy_rerun_counter += 1 # Não é mais necessário aqui
+            # O período é apenas um recorte do dataset já processado, sem reprocessar a planilha
             st.rerun() # Garantir rerun explícito
         
         if periodo_selecionado == "Personalizado":
@@ -904,8 +1123,6 @@ def display_sidebar_filters(df):
                     if data_inicio != st.session_state.data_inicio_analise_state or data_fim != st.session_state.data_fim_analise_state:
                         st.session_state.data_inicio_analise_state = data_inicio
                         st.session_state.data_fim_analise_state = data_fim
-                        # Forçar reprocessamento quando as datas personalizadas mudarem
-                        # st.session_state.dummy_rerun_counter += 1 # Não é mais necessário aqui
                         st.rerun() # Garantir rerun explícito
         
         # Filtros específicos por categoria
@@ -915,7 +1132,7 @@ def display_sidebar_filters(df):
             # Filtro de marketplace
             marketplace_options = ["Todos"]
             if df is not None and COL_PLATAFORMA_CUSTOS in df.columns:
-                marketplace_options.extend(sorted(df[COL_PLATAFORMA_CUSTOS].unique()))
+                marketplace_options.extend(sorted(obter_indice_filtros(df).valores("plataforma")))
             
             marketplace_selecionado = st.selectbox(
                 "Marketplace", 
@@ -934,9 +1151,8 @@ def display_sidebar_filters(df):
                 
                 ml_tipo_anuncio_options = ["Todos"]
                 if df is not None and 'Tipo de Anúncio' in df.columns:
-                    ml_df = df[df[COL_PLATAFORMA_CUSTOS] == "Mercado Livre"]
-                    if not ml_df.empty:
-                        ml_tipo_anuncio_options.extend(sorted(ml_df['Tipo de Anúncio'].unique()))
+                    # Só os tipos com vendas no Mercado Livre (AND dos bitmaps, sem filtrar o DataFrame)
+                    ml_tipo_anuncio_options.extend(sorted(obter_indice_filtros(df).valores("tipo_anuncio", {"plataforma": "Mercado Livre"})))
                 
                 ml_tipo_anuncio = st.selectbox(
                     "Tipo de Anúncio", 
@@ -983,7 +1199,7 @@ def display_sidebar_filters(df):
         # Filtro de conta
         conta_options = ["Todas"]
         if df is not None and COL_CONTA_CUSTOS_ORIGINAL in df.columns:
-            conta_options.extend(sorted(df[COL_CONTA_CUSTOS_ORIGINAL].unique()))
+            conta_options.extend(sorted(obter_indice_filtros(df).valores("conta")))
         
         conta_selecionada = st.selectbox(
             "Conta", 
@@ -1047,41 +1263,251 @@ def display_custom_menu():
         
         st.markdown("<hr>", unsafe_allow_html=True)
 
+def montar_filtros_painel(categoria):
+    """
+    Traduz os filtros da sessão para o filtro do painel, usado tanto pelo banco quanto pelo índice de
+    filtros em memória (o Dashboard consolidado usa só o período).
+    """
+    filtros = {"data_inicio": st.session_state.data_inicio_analise_state, "data_fim": st.session_state.data_fim_analise_state}
+    if categoria == "Dashboard":
+        return filtros
+    filtros["conta"] = st.session_state.conta_mae_selecionada_ui_state
+    filtros["tipo_venda"] = categoria
+    if categoria == "Marketplaces":
+        filtros["plataforma"] = st.session_state.marketplace_selecionado_state
+        if st.session_state.marketplace_selecionado_state == "Mercado Livre":
+            filtros["tipo_anuncio"] = st.session_state.ml_tipo_anuncio_selecionado
+    return filtros
+
+def iniciar_carga(arquivos, usar_historico):
+    """
+    Enfileira a carga das planilhas (ou do histórico) em segundo plano e guarda a chave da tarefa na sessão.
+    A chave junta o hash de cada planilha, os parâmetros do processamento e a versão das regras de derivação:
+    sessões que enviam os mesmos arquivos acompanham a mesma tarefa.
+    """
+    nomes = [arquivo.name for arquivo in arquivos]
+    conteudos = [arquivo.getvalue() for arquivo in arquivos]
+    tipo_margem = st.session_state.tipo_margem_selecionada_state
+    partes_chave = sorted(calcular_hash_conteudo(conteudo) for conteudo in conteudos)
+    try: versao_regras_derivacao = versao_regras(carregar_regras_derivacao())
+    except ErroRegrasDerivacao as e_regras:
+        st.error(f"Regras de derivação: {e_regras}"); return
+    partes_chave += [tipo_margem, MODO_LEITURA_PLANILHA, str(MOTOR_LEITURA_PLANILHA), BACKEND_DADOS, versao_regras_derivacao]
+    if usar_historico: partes_chave += ["historico", str(versao_historico(HISTORICO_PATH))]
+    chave = calcular_hash_conteudo("|".join(partes_chave).encode())
+    
+    if usar_historico: descricao = "Histórico" + (f" + {', '.join(nomes)}" if nomes else "")
+    else: descricao = ", ".join(nomes)
+    
+    def executar(tarefa):
+        # A medição cobre também a gravação no banco/publicação; as etapas aparecem na aba de Logs do Admin
+        with coletar_avisos(tarefa.avisos), medir_carga(descricao, MODO_LEITURA_PLANILHA, len(conteudos)):
+            df_carregado, resumo_incorporacao = executar_ingestao(
+                conteudos, nomes, tipo_margem,
+                COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS,
+                COL_MARGEM_REAL_PLANILHA_CUSTOS,
+                COL_TIPO_ANUNCIO_ML_CUSTOS,
+                usar_historico=usar_historico,
+                diretorio_historico=HISTORICO_PATH,
+                modo_leitura=MODO_LEITURA_PLANILHA,
+                motor_leitura=MOTOR_LEITURA_PLANILHA,
+                callback_progresso=tarefa.registrar_linhas,
+                callback_etapa=tarefa.registrar_etapa,
+                callback_arquivo=tarefa.registrar_arquivos
+            )
+            versao_banco = None
+            if BACKEND_DADOS == "sql" and df_carregado is not None and not df_carregado.empty:
+                # Backend SQL: o dataset vai para o banco embutido e não fica na sessão. A tabela guarda as duas margens,
+                # então a versão no banco combina a planilha e as colunas lidas, sem o tipo de margem
+                chave_leitura = df_carregado.attrs.get('leitura', {}).get('chave')
+                if chave_leitura:
+                    versao_banco = versao_dataset(chave_leitura, COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS, COL_MARGEM_REAL_PLANILHA_CUSTOS,
+                                                  COL_TIPO_ANUNCIO_ML_CUSTOS)
+                    tarefa.registrar_etapa("banco"); registrar_etapa("banco", len(df_carregado))
+                    salvar_vendas_no_banco(df_carregado, versao_banco)
+            elif df_carregado is not None:
+                # Memória: todas as sessões com o mesmo dataset (e tipo de margem) usam uma única cópia mapeada do disco
+                if df_carregado.attrs.get('versao'):
+                    # O cubo diário sai na carga: a primeira sessão a abrir o painel já o encontra pronto
+                    tarefa.registrar_etapa("cubo"); registrar_etapa("cubo", len(df_carregado))
+                    obter_cubo(df_carregado)
+                    tarefa.registrar_etapa("publicação"); registrar_etapa("publicação", len(df_carregado))
+                    df_carregado = publicar_dataset(df_carregado, df_carregado.attrs['versao'])
+        return {"df": df_carregado, "resumo_incorporacao": resumo_incorporacao, "versao_banco": versao_banco}
+    
+    etapas = ETAPAS_CARGA_HISTORICO if usar_historico else (["leitura"] if len(arquivos) > 1 else ETAPAS_CARGA)
+    etapas = etapas + (["banco"] if BACKEND_DADOS == "sql" else ["cubo", "publicação"])
+    st.session_state.tarefa_ingestao = iniciar_tarefa(chave, executar, descricao, etapas).chave
+
+def aplicar_carga_concluida():
+    """
+    Leva o resultado da carga acompanhada pela sessão para o painel quando a tarefa termina.
+    Até lá o painel continua com o dataset anterior.
+
+    Returns:
+        bool: True se um novo dataset foi carregado
+    """
+    tarefa = obter_tarefa(st.session_state.tarefa_ingestao) if st.session_state.tarefa_ingestao else None
+    if tarefa is None or not tarefa.encerrada:
+        return False
+    st.session_state.tarefa_ingestao = None
+    for aviso in tarefa.avisos: st.warning(aviso)
+    if tarefa.estado == ESTADO_FALHOU:
+        st.error(f"Erro ao carregar '{tarefa.descricao}': {tarefa.erro}"); return False
+    if tarefa.estado != ESTADO_CONCLUIDA:
+        st.info("Carga cancelada."); return False
+    df_carregado = tarefa.resultado["df"]
+    if df_carregado is None:
+        st.error(f"Nenhuma venda carregada de '{tarefa.descricao}'."); return False
+    if tarefa.resultado["resumo_incorporacao"] is not None:
+        st.session_state.resumo_ultima_incorporacao = tarefa.resultado["resumo_incorporacao"]
+    st.session_state.info_leitura = df_carregado.attrs.get('leitura')
+    st.session_state.versao_banco = tarefa.resultado["versao_banco"]
+    st.session_state.df_result = None if st.session_state.versao_banco else df_carregado
+    return True
+
+@st.fragment(run_every=INTERVALO_PROGRESSO_S)
+def display_progresso_carga():
+    """
+    Barra de progresso da carga em segundo plano, atualizada pelos eventos de etapa da tarefa.
+    Quando a tarefa termina, o script inteiro é executado de novo para aplicar o resultado.
+    """
+    tarefa = obter_tarefa(st.session_state.tarefa_ingestao) if st.session_state.tarefa_ingestao else None
+    if tarefa is None:
+        return
+    if tarefa.encerrada:
+        st.rerun(scope="app")
+    fracao, texto = tarefa.progresso
+    st.progress(fracao, text=f"{tarefa.descricao}: {texto}")
+    if st.button("Cancelar carga", key="btn_cancelar_carga_v15", use_container_width=True):
+        tarefa.cancelar()
+        st.session_state.tarefa_ingestao = None
+        st.rerun(scope="app")
+
+def verificar_novo_upload(arquivos, usar_historico):
+    # Inicia a carga apenas quando o conjunto de arquivos (ou a opção de histórico) muda
+    assinatura = (tuple(arquivo.file_id for arquivo in arquivos), usar_historico)
+    if arquivos and assinatura != st.session_state.assinatura_carga:
+        st.session_state.assinatura_carga = assinatura
+        iniciar_carga(arquivos, usar_historico)
+
+def display_upload_sidebar():
+    """
+    Carrega uma nova planilha sem sair do painel: a carga roda em segundo plano e o dataset atual
+    continua disponível até ela terminar.
+    """
+    with st.sidebar:
+        with st.expander("📤 Carregar nova planilha", expanded=st.session_state.tarefa_ingestao is not None):
+            arquivos = st.file_uploader("Planilhas", type=["xlsx"], accept_multiple_files=True, label_visibility="collapsed", key="sidebar_uploader_v15") or []
+            usar_historico = st.checkbox("Adicionar ao histórico salvo", key="incorporar_historico_sidebar_v15")
+            verificar_novo_upload(arquivos, usar_historico)
+            display_progresso_carga()
+
+def produtos_banco(filtros):
+    """
+    Linhas por produto do recorte `filtros` no banco (consultar_produtos), pelo cache de consultas do processo.
+    Substituem as linhas de pedido no backend SQL: a tabela de produtos e as verificações de colunas usam este frame.
+    """
+    versao, tipo_margem = st.session_state.versao_banco, st.session_state.tipo_margem_selecionada_state
+    return obter_agregado(versao, "produtos", filtros, lambda: consultar_produtos(versao, filtros, tipo_margem), tipo_margem)
+
+def alertas_banco(filtros):
+    """
+    Consulta da aba de alertas no banco para o recorte `filtros` (ver display_alerts_tab), ou None fora do backend SQL.
+    Busca uma linha além do limite para a aba saber que o resultado foi cortado.
+    """
+    if BACKEND_DADOS != "sql" or not st.session_state.get("versao_banco"):
+        return None
+    versao, tipo_margem = st.session_state.versao_banco, st.session_state.tipo_margem_selecionada_state
+    def consultar(tipo_alerta, marketplace, conta, busca, ordenar_por, crescente):
+        parametros = (tipo_alerta, marketplace, conta, busca or None, ordenar_por, crescente)
+        return obter_agregado(versao, "alertas", filtros,
+                              lambda: consultar_alertas(versao, filtros, tipo_margem, *parametros, limite=LIMITE_LINHAS_ALERTAS + 1),
+                              tipo_margem, *parametros)
+    return consultar
+
+def tabela_produtos(recorte, df, marketplace):
+    """
+    Tabela de produtos do recorte exibido, já com o tipo de margem selecionado. Com o recorte em memória,
+    é montada uma vez por recorte e reaproveitada nas execuções seguintes (ex.: digitação na busca).
+    """
+    def montar():
+        df_tabela = personalizar_tabela_por_marketplace(df, marketplace, st.session_state.tipo_margem_selecionada_state)
+        return atualizar_tabela_com_nova_margem(df_tabela, st.session_state.tipo_margem_selecionada_state, versao_recorte("tabela"))
+    return montar() if recorte is None else recorte.derivado(("tabela", marketplace), montar)
+
+def versao_recorte(*partes):
+    """
+    Token do recorte exibido: versão do dataset + filtros da sessão (+ partes extras, ex.: qual tabela).
+    Serve de chave de cache no lugar do DataFrame filtrado.
+
+    Returns:
+        str ou None se o dataset carregado não tiver versão
+    """
+    versao_base = st.session_state.versao_banco
+    if versao_base is None and st.session_state.df_result is not None:
+        versao_base = st.session_state.df_result.attrs.get('versao')
+    if versao_base is None:
+        return None
+    return versao_dataset(
+        versao_base, st.session_state.data_inicio_analise_state, st.session_state.data_fim_analise_state,
+        st.session_state.conta_mae_selecionada_ui_state, st.session_state.categoria_selecionada,
+        st.session_state.marketplace_selecionado_state, st.session_state.ml_tipo_anuncio_selecionado, *partes
+    )
+
+def descartar_versao_banco():
+    """
+    Volta para a tela de upload quando a versão da sessão não está mais no banco: as consultas
+    levantariam VersaoBancoRemovida em todas as execuções seguintes.
+    """
+    st.session_state.versao_banco = None; st.session_state.df_result = None
+    st.session_state.assinatura_carga = None
+    st.session_state.app_state = "upload"; st.session_state.versao_banco_removida = True
+
 def main():
     # Verificar autenticação
     if not st.session_state.authenticated:
         display_login_screen()
         return
     
+    # Resultado de uma carga em segundo plano que terminou desde a última execução
+    if aplicar_carga_concluida():
+        st.session_state.app_state = "dashboard"
+    
+    # Backend SQL: a versão da sessão pode ter saído do banco enquanto ela estava parada (ver MAX_VERSOES_BANCO)
+    if st.session_state.versao_banco is not None and not versao_no_banco(st.session_state.versao_banco):
+        descartar_versao_banco()
+    
     # Verificar estado da aplicação
     if st.session_state.app_state == "upload":
-        uploaded_file = display_welcome_screen()
-        if uploaded_file:
-            st.session_state.app_state = "dashboard"
-            
-            # Adicionar indicador de loading durante o processamento da planilha
-            with st.spinner("Processando planilha... Por favor, aguarde."):
-                st.session_state.df_result = processar_planilha_otimizado(
-                    uploaded_file, 
-                    st.session_state.tipo_margem_selecionada_state,
-                    st.session_state.data_inicio_analise_state,
-                    st.session_state.data_fim_analise_state,
-                    COL_MARGEM_ESTRATEGICA_PLANILHA_CUSTOS,
-                    COL_MARGEM_REAL_PLANILHA_CUSTOS,
-                    COL_TIPO_ANUNCIO_ML_CUSTOS,
-                    st.session_state.dummy_rerun_counter
-                )
-            st.rerun()
+        if st.session_state.versao_banco_removida:
+            st.warning("Os dados desta sessão foram removidos do banco para dar lugar a planilhas carregadas depois. Recarregue a planilha.")
+            st.session_state.versao_banco_removida = False
+        # Uma planilha segue o fluxo normal; várias (uma por conta) são processadas em paralelo e concatenadas
+        uploaded_files = display_welcome_screen() or []
+        usar_historico = st.session_state.get("incorporar_historico_v10", False)
+        if st.session_state.get("btn_abrir_historico_v10", False):
+            st.session_state.assinatura_carga = None
+            iniciar_carga([], True)
+        else:
+            verificar_novo_upload(uploaded_files, usar_historico)
+        
+        # Progresso da carga (processada em segundo plano, com opção de cancelar)
+        col1, col2, col3 = st.columns([0.5, 2, 0.5])
+        with col2: display_progresso_carga()
         return
     
     # Dashboard principal
-    if st.session_state.app_state == "dashboard" and st.session_state.df_result is not None:
+    usar_banco = st.session_state.versao_banco is not None
+    if st.session_state.app_state == "dashboard" and (st.session_state.df_result is not None or usar_banco):
         # Barra lateral com menu de navegação personalizado
         display_custom_menu()
+        display_upload_sidebar()
         
         # Mostrar filtros apenas se não estiver no painel de administração
         if st.session_state.categoria_selecionada != "Admin":
-            display_sidebar_filters(st.session_state.df_result)
+            # Com o banco, a barra lateral recebe só as combinações distintas de conta/plataforma/tipo de anúncio
+            display_sidebar_filters(consultar_opcoes_filtros(st.session_state.versao_banco) if usar_banco else st.session_state.df_result)
         
         # Conteúdo principal
         if st.session_state.categoria_selecionada == "Admin":
@@ -1091,71 +1517,51 @@ def main():
             else:
                 st.error("Você não tem permissão para acessar o painel de administração.")
         else:
-            # Aplicar filtro de período ANTES de qualquer exibição
-            df_completo = st.session_state.df_result.copy()
-            if COL_DATA_CUSTOS in df_completo.columns:
-                df_completo[COL_DATA_CUSTOS] = pd.to_datetime(df_completo[COL_DATA_CUSTOS], errors='coerce')
-                df_completo.dropna(subset=[COL_DATA_CUSTOS], inplace=True)
-                
-                data_inicio_filtro = st.session_state.data_inicio_analise_state
-                data_fim_filtro = st.session_state.data_fim_analise_state
-                
-                # Garantir que sejam objetos date
-                if isinstance(data_inicio_filtro, datetime):
-                    data_inicio_filtro = data_inicio_filtro.date()
-                if isinstance(data_fim_filtro, datetime):
-                    data_fim_filtro = data_fim_filtro.date()
-                
-                # Aplicar filtro de data
-                df_filtered_by_date = df_completo[
-                    (df_completo[COL_DATA_CUSTOS].dt.date >= data_inicio_filtro) & 
-                    (df_completo[COL_DATA_CUSTOS].dt.date <= data_fim_filtro)
-                ].copy()
+            metricas_agregadas = vendas_por_dia_agregadas = recorte = cubo = None
+            filtros_painel = montar_filtros_painel(st.session_state.categoria_selecionada)
+            filtros_periodo = montar_filtros_painel("Dashboard")
+            if usar_banco:
+                # Backend SQL: filtros e agregações rodam no banco; à sessão chegam só agregados e as linhas por produto
+                # da tabela de produtos (uma por SKU/conta/marketplace), nunca as linhas de pedido do período.
+                # Como no recorte em memória, "por data" usa só o período (Dashboard) e "filtrado" todos os filtros;
+                # no Dashboard os dois filtros coincidem e a consulta é uma só (mesma entrada do cache)
+                df_filtered_by_date = produtos_banco(filtros_periodo)
+                df_filtered = produtos_banco(filtros_painel)
+                # Agregados: cache de consultas do processo (outras sessões com a mesma visão já pagaram a consulta)
+                metricas_agregadas = obter_agregado(st.session_state.versao_banco, "metricas", filtros_painel,
+                                                    lambda: consultar_metricas(st.session_state.versao_banco, filtros_painel, st.session_state.tipo_margem_selecionada_state),
+                                                    st.session_state.tipo_margem_selecionada_state)
+                vendas_por_dia_agregadas = obter_agregado(st.session_state.versao_banco, "por_dia", filtros_painel,
+                                                          lambda: consultar_vendas_por_dia(st.session_state.versao_banco, filtros_painel))
+                if df_filtered_by_date.empty:
+                    st.warning(f"Sem dados para o período ({st.session_state.data_inicio_analise_state:%d/%m/%Y} a {st.session_state.data_fim_analise_state:%d/%m/%Y}).")
             else:
-                df_filtered_by_date = df_completo # Sem coluna de data, usar completo
-            
-            # Filtrar dados conforme a categoria selecionada (usando df_filtered_by_date)
-            df_filtered = df_filtered_by_date.copy()
-            
-            # Aplicar filtros comuns
-            if st.session_state.conta_mae_selecionada_ui_state != "Todas" and COL_CONTA_CUSTOS_ORIGINAL in df_filtered.columns:
-                df_filtered = df_filtered[df_filtered[COL_CONTA_CUSTOS_ORIGINAL] == st.session_state.conta_mae_selecionada_ui_state]
-            
-            # Aplicar filtros específicos para Marketplaces
-            if st.session_state.categoria_selecionada == "Marketplaces":
-                # Filtrar apenas dados de Marketplaces
-                if COL_TIPO_VENDA in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered[COL_TIPO_VENDA] == "Marketplaces"]
-                
-                # Aplicar filtro de marketplace
-                if st.session_state.marketplace_selecionado_state != "Todos" and COL_PLATAFORMA_CUSTOS in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered[COL_PLATAFORMA_CUSTOS] == st.session_state.marketplace_selecionado_state]
-                
-                # Aplicar filtro de tipo de anúncio para Mercado Livre
-                if st.session_state.marketplace_selecionado_state == "Mercado Livre" and st.session_state.ml_tipo_anuncio_selecionado != "Todos" and 'Tipo de Anúncio' in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered['Tipo de Anúncio'] == st.session_state.ml_tipo_anuncio_selecionado]
-            
-            # Aplicar filtros específicos para Atacado
-            elif st.session_state.categoria_selecionada == "Atacado":
-                # Filtrar apenas dados de Atacado
-                if COL_TIPO_VENDA in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered[COL_TIPO_VENDA] == "Atacado"]
-            
-            # Aplicar filtros específicos para Showroom
-            elif st.session_state.categoria_selecionada == "Showroom":
-                # Filtrar apenas dados de Showroom
-                if COL_TIPO_VENDA in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered[COL_TIPO_VENDA] == "Showroom"]
+                # Aplicar filtro de período ANTES de qualquer exibição (recorte por busca binária no dataset ordenado)
+                # Conta, tipo de venda, marketplace e tipo de anúncio: AND dos bitmaps do índice da versão do dataset,
+                # restrito ao período, e um único take (as mesmas regras de montar_filtros_painel usadas pelo banco).
+                # O recorte fica em um LRU por (versão, filtros) como posições de linhas: execuções com os mesmos filtros só refazem o take
+                recorte = obter_recorte(st.session_state.df_result, filtros_painel)
+                df_filtered_by_date, df_filtered = recorte.por_data, recorte.filtrado
+                # Cards e gráficos agregados saem do cubo diário da versão (células, não linhas de pedido),
+                # inclusive os SKUs únicos (OR dos conjuntos de SKUs das células)
+                cubo = obter_cubo(st.session_state.df_result)
+                # e passam pelo cache de consultas do processo, compartilhado entre as sessões
+                metricas_agregadas = obter_agregado(cubo.versao, "metricas", filtros_painel,
+                                                    lambda: cubo.metricas(filtros_painel, st.session_state.tipo_margem_selecionada_state),
+                                                    st.session_state.tipo_margem_selecionada_state)
+                vendas_por_dia_agregadas = obter_agregado(cubo.versao, "por_dia", filtros_painel, lambda: cubo.por_dia(filtros_painel))
+                if df_filtered_by_date.empty:
+                    st.warning(f"Sem dados para o período ({st.session_state.data_inicio_analise_state:%d/%m/%Y} a {st.session_state.data_fim_analise_state:%d/%m/%Y}).")
                    # Dashboard principal (consolidado)
             if st.session_state.categoria_selecionada == "Dashboard":
                 st.title("Dashboard de Performance ViaFlix")
                 
                 # Métricas gerais (usando dados filtrados por data)
-                display_metrics(df_filtered_by_date, st.session_state.tipo_margem_selecionada_state)
+                display_metrics(df_filtered_by_date, st.session_state.tipo_margem_selecionada_state, metricas=metricas_agregadas)
                 
                 # Gráfico de evolução temporal (usando dados filtrados por data)
                 st.markdown("### Evolução de Vendas")
-                display_time_series_chart(df_filtered_by_date)
+                display_time_series_chart(df_filtered_by_date, vendas_por_dia=vendas_por_dia_agregadas)
                 
                 # Distribuição por tipo de venda (usando dados filtrados por data)
                 if COL_TIPO_VENDA in df_filtered_by_date.columns:
@@ -1164,7 +1570,7 @@ def main():
                     
                     with col1:
                         # Gráfico de pizza por tipo de venda
-                        tipo_venda_counts = df_filtered_by_date[COL_TIPO_VENDA].value_counts().reset_index()
+                        tipo_venda_counts = agregar_por_dimensao(df_filtered_by_date, "tipo_venda", cubo=cubo, filtros=filtros_painel).reset_index()
                         tipo_venda_counts.columns = ['Tipo de Venda', 'Contagem']
                         fig = px.pie(
                             tipo_venda_counts, 
@@ -1184,7 +1590,7 @@ def main():
                     with col2:
                         # Valor total por tipo de venda
                         if COL_VALOR_PEDIDO_CUSTOS in df_filtered_by_date.columns:
-                            tipo_venda_valor = df_filtered_by_date.groupby(COL_TIPO_VENDA)[COL_VALOR_PEDIDO_CUSTOS].sum().reset_index()
+                            tipo_venda_valor = agregar_por_dimensao(df_filtered_by_date, "tipo_venda", "faturamento", cubo, filtros_painel).reset_index()
                             tipo_venda_valor.columns = ["Tipo de Venda", "Valor Total"]                         
                             fig = px.bar(
                                 tipo_venda_valor,
@@ -1219,11 +1625,8 @@ def main():
                     # Campo de busca para produtos
                     busca_produto = st.text_input("🔍 Buscar produto (SKU, ID ou nome)", placeholder="Digite para buscar...")
                     
-                    # Tabela personalizada (usando dados filtrados por data)
-                    df_tabela = personalizar_tabela_por_marketplace(df_filtered_by_date, "Todos", st.session_state.tipo_margem_selecionada_state)
-                    
-                    # Atualizar tabela com o tipo de margem selecionado
-                    df_tabela = atualizar_tabela_com_nova_margem(df_tabela, st.session_state.tipo_margem_selecionada_state)
+                    # Tabela personalizada (usando dados filtrados por data), com o tipo de margem selecionado (montada uma vez por recorte)
+                    df_tabela = tabela_produtos(recorte, df_filtered_by_date, "Todos")
                     
                     if not df_tabela.empty:
                         # Verificar e remover colunas duplicadas
@@ -1232,31 +1635,25 @@ def main():
                         
                         # Aplicar filtro de busca se houver texto
                         if busca_produto:
-                            busca_lower = busca_produto.lower()
-                            mask = pd.Series(False, index=df_tabela.index)
-                            
-                            # Buscar em todas as colunas de texto
-                            for col in df_tabela.columns:
-                                # Converter para string e aplicar busca case-insensitive
-                                if df_tabela[col].dtype == object:  # Apenas colunas de texto
-                                    mask = mask | df_tabela[col].astype(str).str.lower().str.contains(busca_lower, na=False)
+                            # Buscar em todas as colunas de texto (case-insensitive)
+                            mask = mascara_busca_texto(df_tabela, busca_produto)
                             
                             df_tabela_filtrada = df_tabela[mask]
                             
                             if df_tabela_filtrada.empty:
                                 st.warning(f"Nenhum produto encontrado com o termo \'{busca_produto}\'.")
-                                st.dataframe(df_tabela, use_container_width=True)
+                                st.dataframe(estilizar_margens(df_tabela), use_container_width=True)
                             else:
                                 st.success(f"Encontrado(s) {len(df_tabela_filtrada)} produto(s) com o termo \'{busca_produto}\'.")
-                                st.dataframe(df_tabela_filtrada, use_container_width=True)
+                                st.dataframe(estilizar_margens(df_tabela_filtrada), use_container_width=True)
                         else:
-                            st.dataframe(df_tabela, use_container_width=True)
+                            st.dataframe(estilizar_margens(df_tabela), use_container_width=True)
                     else:
                         st.info("Sem dados para exibir na tabela de produtos.")
                 
                 with tab2:
                     # Alertas (usando dados filtrados por data)
-                    display_alerts_tab(df_filtered_by_date)
+                    display_alerts_tab(df_filtered_by_date, consultar_banco=alertas_banco(filtros_periodo))
                 
                 with tab3:
                     st.markdown("### Tendências de Vendas")
@@ -1268,14 +1665,14 @@ def main():
                 st.title("Dashboard de Marketplaces")
                 
                 # Métricas específicas para Marketplaces
-                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Marketplaces")
+                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Marketplaces", metricas=metricas_agregadas)
                 
                 # Gráficos específicos para Marketplaces
-                display_category_specific_metrics(df_filtered, "Marketplaces")
+                display_category_specific_metrics(df_filtered, "Marketplaces", cubo, filtros_painel)
                 
                 # Evolução temporal para Marketplaces
                 st.markdown("### Evolução de Vendas em Marketplaces")
-                display_time_series_chart(df_filtered, "Marketplaces")
+                display_time_series_chart(df_filtered, "Marketplaces", vendas_por_dia=vendas_por_dia_agregadas)
                 
                 # Abas para diferentes visualizações
                 tab1, tab2, tab3 = st.tabs(["📊 Produtos", "⚠️ Alertas", "🔍 Concorrência"])
@@ -1283,23 +1680,20 @@ def main():
                 with tab1:
                     st.markdown("### Produtos em Marketplaces")
                     
-                    # Tabela personalizada
-                    df_tabela = personalizar_tabela_por_marketplace(df_filtered, st.session_state.marketplace_selecionado_state, st.session_state.tipo_margem_selecionada_state)
-                    
-                    # Atualizar tabela com o tipo de margem selecionado
-                    df_tabela = atualizar_tabela_com_nova_margem(df_tabela, st.session_state.tipo_margem_selecionada_state)
+                    # Tabela personalizada com o tipo de margem selecionado (montada uma vez por recorte)
+                    df_tabela = tabela_produtos(recorte, df_filtered, st.session_state.marketplace_selecionado_state)
                     
                     if not df_tabela.empty:
                         # Verificar e remover colunas duplicadas
                         if df_tabela.columns.duplicated().any():
                             df_tabela = df_tabela.loc[:, ~df_tabela.columns.duplicated()]
                         
-                        st.dataframe(df_tabela, use_container_width=True)
+                        st.dataframe(estilizar_margens(df_tabela), use_container_width=True)
                     else:
                         st.info("Sem dados para exibir na tabela de produtos.")
                 
                 with tab2:
-                    display_alerts_tab(df_filtered, "Marketplaces")
+                    display_alerts_tab(df_filtered, "Marketplaces", alertas_banco(filtros_painel))
                 
                 with tab3:
                     st.markdown("### Análise de Concorrência")
@@ -1341,18 +1735,20 @@ def main():
                 st.title("Dashboard de Atacado")
                 
                 # Métricas específicas para Atacado
-                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Atacado")
+                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Atacado", metricas=metricas_agregadas)
                 
                 # Gráficos específicos para Atacado
-                display_category_specific_metrics(df_filtered, "Atacado")
+                display_category_specific_metrics(df_filtered, "Atacado", cubo, filtros_painel)
                 
                 # Evolução temporal para Atacado
                 st.markdown("### Evolução de Vendas no Atacado")
-                display_time_series_chart(df_filtered, "Atacado")
+                display_time_series_chart(df_filtered, "Atacado", vendas_por_dia=vendas_por_dia_agregadas)
                 
                 # Mapa do Brasil específico para Atacado
                 st.markdown("### Mapa de Vendas por Estado - Atacado")
-                mapa_fig = criar_mapa_brasil_interativo(df_filtered)
+                vendas_por_estado = agregar_por_dimensao(df_filtered, "estado", "faturamento", cubo, filtros_painel) \
+                    if cubo is not None or 'Estado' in df_filtered.columns else None
+                mapa_fig = criar_mapa_brasil_interativo(df_filtered, vendas_por_estado)
                 if mapa_fig:
                     mapa_chart = st.plotly_chart(mapa_fig, use_container_width=True, key="mapa_brasil_atacado_chart")
                     if st.session_state.selected_state:
@@ -1367,37 +1763,34 @@ def main():
                 with tab1:
                     st.markdown("### Produtos no Atacado")
                     
-                    # Tabela personalizada
-                    df_tabela = personalizar_tabela_por_marketplace(df_filtered, "Todos", st.session_state.tipo_margem_selecionada_state)
-                    
-                    # Atualizar tabela com o tipo de margem selecionado
-                    df_tabela = atualizar_tabela_com_nova_margem(df_tabela, st.session_state.tipo_margem_selecionada_state)
+                    # Tabela personalizada com o tipo de margem selecionado (montada uma vez por recorte)
+                    df_tabela = tabela_produtos(recorte, df_filtered, "Todos")
                     
                     if not df_tabela.empty:
                         # Verificar e remover colunas duplicadas
                         if df_tabela.columns.duplicated().any():
                             df_tabela = df_tabela.loc[:, ~df_tabela.columns.duplicated()]
                         
-                        st.dataframe(df_tabela, use_container_width=True)
+                        st.dataframe(estilizar_margens(df_tabela), use_container_width=True)
                     else:
                         st.info("Sem dados para exibir na tabela de produtos.")
                 
                 with tab2:
-                    display_alerts_tab(df_filtered, "Atacado")
+                    display_alerts_tab(df_filtered, "Atacado", alertas_banco(filtros_painel))
             
             # Dashboard específico para Showroom
             elif st.session_state.categoria_selecionada == "Showroom":
                 st.title("Dashboard de Showroom")
                 
                 # Métricas específicas para Showroom
-                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Showroom")
+                display_metrics(df_filtered, st.session_state.tipo_margem_selecionada_state, "Showroom", metricas=metricas_agregadas)
                 
                 # Gráficos específicos para Showroom
-                display_category_specific_metrics(df_filtered, "Showroom")
+                display_category_specific_metrics(df_filtered, "Showroom", cubo, filtros_painel)
                 
                 # Evolução temporal para Showroom
                 st.markdown("### Evolução de Vendas no Showroom")
-                display_time_series_chart(df_filtered, "Showroom")
+                display_time_series_chart(df_filtered, "Showroom", vendas_por_dia=vendas_por_dia_agregadas)
                 
                 # Abas para diferentes visualizações
                 tab1, tab2, tab3 = st.tabs(["📊 Produtos", "⚠️ Alertas", "👥 Vendedores"])
@@ -1405,23 +1798,20 @@ def main():
                 with tab1:
                     st.markdown("### Produtos no Showroom")
                     
-                    # Tabela personalizada
-                    df_tabela = personalizar_tabela_por_marketplace(df_filtered, "Todos", st.session_state.tipo_margem_selecionada_state)
-                    
-                    # Atualizar tabela com o tipo de margem selecionado
-                    df_tabela = atualizar_tabela_com_nova_margem(df_tabela, st.session_state.tipo_margem_selecionada_state)
+                    # Tabela personalizada com o tipo de margem selecionado (montada uma vez por recorte)
+                    df_tabela = tabela_produtos(recorte, df_filtered, "Todos")
                     
                     if not df_tabela.empty:
                         # Verificar e remover colunas duplicadas
                         if df_tabela.columns.duplicated().any():
                             df_tabela = df_tabela.loc[:, ~df_tabela.columns.duplicated()]
                         
-                        st.dataframe(df_tabela, use_container_width=True)
+                        st.dataframe(estilizar_margens(df_tabela), use_container_width=True)
                     else:
                         st.info("Sem dados para exibir na tabela de produtos.")
                 
                 with tab2:
-                    display_alerts_tab(df_filtered, "Showroom")
+                    display_alerts_tab(df_filtered, "Showroom", alertas_banco(filtros_painel))
                 
                 with tab3:
                     st.markdown("### Desempenho de Vendedores")
@@ -1490,4 +1880,8 @@ def main():
                     st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except VersaoBancoRemovida:
+        # A versão saiu do banco no meio desta execução: a próxima mostra a tela de upload com o aviso
+        descartar_versao_banco(); st.rerun()
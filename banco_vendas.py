@@ -0,0 +1,376 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from processar_planilha_otimizado_melhorado import COLUNAS_FILTRO  # Filtro do painel -> coluna da tabela
+
+# --- CONFIGURAÇÕES DO BANCO DE VENDAS ---
+# Backend opcional: as vendas processadas ficam em um banco embutido (DuckDB quando instalado,
+# senão SQLite da biblioteca padrão) e o painel consulta apenas agregados (métricas, séries, distribuições
+# e as linhas por produto das tabelas), então a memória de cada sessão não cresce com o tamanho do histórico
+try:
+    import duckdb
+    MOTOR_BANCO = "duckdb"
+except ImportError:
+    duckdb = None
+    MOTOR_BANCO = "sqlite"
+
+CAMINHO_BANCO = os.environ.get("VIAFLIX_BANCO_PATH", "vendas.duckdb" if MOTOR_BANCO == "duckdb" else "vendas.sqlite")
+MAX_VERSOES_BANCO = int(os.environ.get("VIAFLIX_BANCO_MAX_VERSOES", "3"))  # Datasets mantidos (sessões diferentes podem usar versões diferentes)
+
+COL_DIA_NUM = "dia_num"  # Dias desde 1970-01-01: os filtros de período viram comparações de inteiros
+TABELA_VERSOES = "versoes_vendas"
+COLUNAS_BOOLEANAS = ['Margem_Critica', 'Estoque_Parado_Alerta']
+COLUNAS_DERIVADAS_MARGEM = ['Margem_Num', 'Margem_Critica']  # Calculadas na consulta conforme o tipo de margem
+COL_LINHA_BANCO = "linha_banco"  # rowid da tabela: a ordem das linhas do dataset (por data) na gravação
+# Colunas das linhas da aba de alertas (além da margem do tipo selecionado)
+COLUNAS_ALERTAS = ['SKU PRODUTOS', 'ID DO PRODUTO', 'CONTAS', 'PLATAFORMA', 'Estoque Tiny', 'Estoque Total Full',
+                   'Status_Vendedores_ML', 'Estoque_Parado_Alerta']
+COLUNAS_TEXTO_ALERTAS = ['SKU PRODUTOS', 'ID DO PRODUTO', 'CONTAS', 'PLATAFORMA', 'Status_Vendedores_ML']
+# Opção "Ordenar por" da aba de alertas -> coluna
+ORDEM_ALERTAS = {"Margem": "Margem_Num", "SKU": "SKU PRODUTOS", "Conta": "CONTAS", "Marketplace": "PLATAFORMA",
+                 "Estoque": "Estoque Tiny", "Vendedores Ativos": "Status_Vendedores_ML"}
+LIMITE_LINHAS_ALERTAS = int(os.environ.get("VIAFLIX_BANCO_LIMITE_ALERTAS", "2000"))  # Linhas da aba de alertas por consulta
+
+_trava_banco = threading.Lock()
+
+
+class VersaoBancoRemovida(LookupError):
+    """A tabela da versão não está mais no banco (removida para dar lugar a versões mais recentes, ver MAX_VERSOES_BANCO)."""
+
+
+def _conectar(caminho=None):
+    caminho = caminho or CAMINHO_BANCO
+    if MOTOR_BANCO == "duckdb":
+        return duckdb.connect(caminho)
+    return sqlite3.connect(caminho, check_same_thread=False)
+
+
+def _citar(nome):
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def _tabela(versao):
+    return "vendas_" + "".join(c for c in str(versao) if c.isalnum())[:32]
+
+
+def _consultar(con, sql, parametros=()):
+    if MOTOR_BANCO == "duckdb":
+        return con.execute(sql, list(parametros)).df()
+    return pd.read_sql_query(sql, con, params=list(parametros))
+
+
+def _tabela_existe(con, tabela):
+    if MOTOR_BANCO == "duckdb":
+        sql = "SELECT table_name FROM information_schema.tables WHERE table_name = ?"
+    else:
+        sql = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return not _consultar(con, sql, [tabela]).empty
+
+
+@contextmanager
+def _conexao_versao(versao, caminho=None):
+    # Conexão para consultar a tabela de uma versão: se a consulta falhar porque a tabela saiu do banco, levanta VersaoBancoRemovida
+    con = _conectar(caminho)
+    try:
+        yield con
+    except Exception as e:
+        if isinstance(e, VersaoBancoRemovida) or _tabela_existe(con, _tabela(versao)): raise
+        raise VersaoBancoRemovida(f"a versão {str(versao)[:16]} não está mais no banco") from e
+    finally:
+        con.close()
+
+
+def versao_no_banco(versao, caminho=None):
+    """
+    Indica se a tabela da versão ainda está no banco. Outras sessões gravando datasets novos removem
+    as versões acessadas há mais tempo, inclusive a de uma sessão parada.
+    """
+    caminho = caminho or CAMINHO_BANCO
+    if not versao or not os.path.exists(caminho):
+        return False
+    con = _conectar(caminho)
+    try: return _tabela_existe(con, _tabela(versao))
+    finally: con.close()
+
+
+def _garantir_tabela_versoes(con):
+    con.execute(f"CREATE TABLE IF NOT EXISTS {TABELA_VERSOES} (versao TEXT PRIMARY KEY, tabela TEXT, linhas INTEGER, colunas TEXT, criado_em DOUBLE, ultimo_acesso DOUBLE)")
+
+
+def _coluna_para_banco(serie):
+    # Categóricas e texto viram texto com NULL; colunas object (tipos mistos) viram texto
+    if serie.dtype == object:
+        return serie.map(lambda v: None if pd.isna(v) else str(v))
+    return serie.astype(object).where(serie.notna(), None)
+
+
+def _dia_num(data):
+    return int((pd.Timestamp(data).normalize() - pd.Timestamp("1970-01-01")).days)
+
+
+def salvar_vendas_no_banco(df, versao, caminho=None):
+    """
+    Grava o dataset processado no banco (uma tabela por versão) se ainda não estiver lá.
+    As colunas categóricas viram texto; Margem_Num e Margem_Critica não são gravadas, pois
+    dependem do tipo de margem e são calculadas nas consultas.
+
+    Args:
+        df: DataFrame processado (ordenado por data)
+        versao: Identificador do dataset (hash da planilha ou versão do histórico)
+        caminho: Arquivo do banco (None usa CAMINHO_BANCO)
+    """
+    tabela = _tabela(versao)
+    with _trava_banco:
+        con = _conectar(caminho)
+        try:
+            _garantir_tabela_versoes(con)
+            existente = _consultar(con, f"SELECT tabela FROM {TABELA_VERSOES} WHERE versao = ?", [versao])
+            agora = time.time()
+            if not existente.empty:
+                con.execute(f"UPDATE {TABELA_VERSOES} SET ultimo_acesso = ? WHERE versao = ?", [agora, versao])
+                if MOTOR_BANCO == "sqlite": con.commit()
+                return
+
+            df_banco = df.drop(columns=[c for c in COLUNAS_DERIVADAS_MARGEM if c in df.columns])
+            df_banco = df_banco.assign(**{col: _coluna_para_banco(df_banco[col]) for col in df_banco.columns
+                                          if df_banco[col].dtype == object or df_banco[col].dtype == 'str'
+                                          or isinstance(df_banco[col].dtype, pd.CategoricalDtype)})
+            dias = df_banco['DIA DE VENDA'].to_numpy().astype('datetime64[D]').astype('int64')
+            df_banco.insert(0, COL_DIA_NUM, dias)
+
+            con.execute(f"DROP TABLE IF EXISTS {tabela}")
+            if MOTOR_BANCO == "duckdb":
+                con.register("df_banco_tmp", df_banco)
+                con.execute(f"CREATE TABLE {tabela} AS SELECT * FROM df_banco_tmp")
+                con.unregister("df_banco_tmp")
+            else:
+                df_banco.to_sql(tabela, con, index=False, chunksize=50000)
+                con.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_dia ON {tabela} ({COL_DIA_NUM})")
+            con.execute(f"INSERT INTO {TABELA_VERSOES} VALUES (?, ?, ?, ?, ?, ?)",
+                        [versao, tabela, int(len(df_banco)), "|".join(map(str, df.columns)), agora, agora])
+
+            # Mantém apenas as versões mais recentes
+            versoes = _consultar(con, f"SELECT versao, tabela FROM {TABELA_VERSOES} ORDER BY ultimo_acesso DESC")
+            for _, antiga in versoes.iloc[MAX_VERSOES_BANCO:].iterrows():
+                con.execute(f"DROP TABLE IF EXISTS {antiga['tabela']}")
+                con.execute(f"DELETE FROM {TABELA_VERSOES} WHERE versao = ?", [antiga['versao']])
+            if MOTOR_BANCO == "sqlite": con.commit()
+        finally:
+            con.close()
+
+
+def _clausula_where(filtros):
+    """
+    Monta o WHERE parametrizado a partir do filtro do painel.
+
+    Args:
+        filtros: dict com data_inicio, data_fim e opcionalmente conta, tipo_venda, plataforma, tipo_anuncio
+            ("Todos"/"Todas"/None não filtram)
+    """
+    condicoes, parametros = [], []
+    if filtros.get("data_inicio") is not None:
+        condicoes.append(f"{COL_DIA_NUM} >= ?"); parametros.append(_dia_num(filtros["data_inicio"]))
+    if filtros.get("data_fim") is not None:
+        condicoes.append(f"{COL_DIA_NUM} <= ?"); parametros.append(_dia_num(filtros["data_fim"]))
+    for chave, coluna in COLUNAS_FILTRO.items():
+        valor = filtros.get(chave)
+        if valor is not None and valor not in ("Todos", "Todas"):
+            condicoes.append(f"{_citar(coluna)} = ?"); parametros.append(valor)
+    return (" WHERE " + " AND ".join(condicoes)) if condicoes else "", parametros
+
+
+def _expressao_margem(tipo_margem):
+    return _citar('Margem_Real_Num') if "Margem Real (M)" in (tipo_margem or "") else _citar('Margem_Estrategica_Num')
+
+
+def consultar_metricas(versao, filtros, tipo_margem, caminho=None):
+    """
+    Calcula no banco as métricas do cabeçalho (faturamento, margem média, SKUs únicos e pedidos).
+
+    Returns:
+        dict com faturamento, margem_media (None sem linhas), skus_unicos e pedidos
+    """
+    where, parametros = _clausula_where(filtros)
+    sql = (f"SELECT COALESCE(SUM({_citar('VALOR DO PEDIDO')}), 0) AS faturamento, AVG({_expressao_margem(tipo_margem)}) AS margem_media, "
+           f"COUNT(DISTINCT {_citar('SKU PRODUTOS')}) AS skus_unicos, COUNT(*) AS pedidos FROM {_tabela(versao)}{where}")
+    with _conexao_versao(versao, caminho) as con: linha = _consultar(con, sql, parametros).iloc[0]
+    margem_media = linha["margem_media"]
+    return {
+        "faturamento": float(linha["faturamento"]),
+        "margem_media": None if pd.isna(margem_media) else float(margem_media),
+        "skus_unicos": int(linha["skus_unicos"]),
+        "pedidos": int(linha["pedidos"]),
+    }
+
+
+def consultar_vendas_por_dia(versao, filtros, caminho=None):
+    """
+    Soma o valor dos pedidos por dia no banco.
+
+    Returns:
+        DataFrame com as colunas 'Data' (date) e 'VALOR DO PEDIDO', em ordem cronológica
+    """
+    where, parametros = _clausula_where(filtros)
+    sql = (f"SELECT {COL_DIA_NUM}, SUM({_citar('VALOR DO PEDIDO')}) AS valor FROM {_tabela(versao)}{where} "
+           f"GROUP BY {COL_DIA_NUM} ORDER BY {COL_DIA_NUM}")
+    with _conexao_versao(versao, caminho) as con: resultado = _consultar(con, sql, parametros)
+    datas = (np.datetime64('1970-01-01', 'D') + resultado[COL_DIA_NUM].to_numpy(dtype='int64')).astype(object)
+    return pd.DataFrame({'Data': datas, 'VALOR DO PEDIDO': resultado['valor'].to_numpy(dtype='float64')})
+
+
+def _restaurar_tipos(df, tipo_margem):
+    # Linhas lidas do banco voltam com os tipos do dataset processado e as colunas de margem do tipo selecionado
+    df = df.drop(columns=[c for c in (COL_DIA_NUM, COL_LINHA_BANCO) if c in df.columns])
+    if 'DIA DE VENDA' in df.columns: df['DIA DE VENDA'] = pd.to_datetime(df['DIA DE VENDA'])
+    for col in COLUNAS_BOOLEANAS:
+        if col in df.columns: df[col] = df[col].astype(bool)
+    for col in list(COLUNAS_FILTRO.values()) + ['SKU PRODUTOS', 'Estado']:
+        if col in df.columns: df[col] = df[col].astype('category')
+    margem = 'Margem_Real_Num' if "Margem Real (M)" in (tipo_margem or "") else 'Margem_Estrategica_Num'
+    if margem in df.columns:
+        df['Margem_Num'] = df[margem]
+    if 'Margem_Num' in df.columns:
+        df['Margem_Critica'] = df['Margem_Num'] < 10
+    return df
+
+
+def _colunas_tabela(con, tabela):
+    return list(_consultar(con, f"SELECT * FROM {tabela} LIMIT 0").columns)
+
+
+def consultar_vendas(versao, filtros, tipo_margem, caminho=None):
+    """
+    Retorna todas as linhas do recorte filtrado, com os mesmos tipos do dataset processado
+    (datas, categóricas, booleanos) e as colunas de margem do tipo selecionado.
+    O painel não usa esta consulta: tabelas e gráficos saem das consultas agregadas abaixo.
+    """
+    where, parametros = _clausula_where(filtros)
+    sql = f"SELECT * FROM {_tabela(versao)}{where} ORDER BY {COL_DIA_NUM}"
+    with _conexao_versao(versao, caminho) as con: df = _consultar(con, sql, parametros)
+    return _restaurar_tipos(df, tipo_margem)
+
+
+def consultar_por_dimensao(versao, coluna, filtros, medida="pedidos", caminho=None):
+    """
+    Pedidos, faturamento ou valor médio por pedido para cada valor de uma coluna, agregados no banco.
+
+    Args:
+        coluna: Coluna da tabela (ex.: 'PLATAFORMA', 'Estado')
+        medida: "pedidos", "faturamento" ou "valor_medio"
+
+    Returns:
+        pd.Series indexada pelos valores presentes no recorte (vazios não entram)
+    """
+    expressao = {"pedidos": "COUNT(*)", "faturamento": f"SUM({_citar('VALOR DO PEDIDO')})",
+                 "valor_medio": f"AVG({_citar('VALOR DO PEDIDO')})"}[medida]
+    where, parametros = _clausula_where(filtros)
+    where += (" AND " if where else " WHERE ") + f"{_citar(coluna)} IS NOT NULL"
+    sql = f"SELECT {_citar(coluna)} AS valor, {expressao} AS medida FROM {_tabela(versao)}{where} GROUP BY {_citar(coluna)}"
+    with _conexao_versao(versao, caminho) as con: resultado = _consultar(con, sql, parametros)
+    serie = pd.Series(resultado["medida"].to_numpy(dtype="int64" if medida == "pedidos" else "float64"),
+                      index=pd.Index(resultado["valor"].astype(str), name=coluna), name=medida)
+    return serie.sort_index()
+
+
+def consultar_produtos(versao, filtros, tipo_margem, caminho=None):
+    """
+    Linhas da tabela de produtos calculadas no banco: a primeira venda do recorte de cada
+    (SKU, conta, marketplace), como o drop_duplicates de personalizar_tabela_por_marketplace, com as
+    unidades vendidas do SKU no recorte em 'Unidades_Vendidas_Periodo'. O tamanho do resultado
+    acompanha o catálogo, não a quantidade de pedidos do período.
+
+    Returns:
+        DataFrame com as colunas da tabela de vendas (tipos do dataset processado) e 'Unidades_Vendidas_Periodo'
+    """
+    sku, quantidade = _citar('SKU PRODUTOS'), _citar('QUANTIDADE')
+    chave_produto = ", ".join(_citar(c) for c in ['SKU PRODUTOS', 'CONTAS', 'PLATAFORMA'])
+    where, parametros = _clausula_where(filtros)
+    sql = (f"SELECT * FROM (SELECT t.*, t.rowid AS {COL_LINHA_BANCO}, "
+           f"CASE WHEN {sku} IS NULL THEN 0 ELSE COALESCE(SUM({quantidade}) OVER (PARTITION BY {sku}), 0) END AS Unidades_Vendidas_Periodo, "
+           f"ROW_NUMBER() OVER (PARTITION BY {chave_produto} ORDER BY t.rowid) AS ordem_produto "
+           f"FROM {_tabela(versao)} t{where}) produtos WHERE ordem_produto = 1 ORDER BY {COL_LINHA_BANCO}")
+    with _conexao_versao(versao, caminho) as con: df = _consultar(con, sql, parametros)
+    df = _restaurar_tipos(df.drop(columns=['ordem_produto']), tipo_margem)
+    df['Unidades_Vendidas_Periodo'] = df['Unidades_Vendidas_Periodo'].astype('int64')
+    return df
+
+
+def consultar_alertas(versao, filtros, tipo_margem, tipo_alerta="Todos", marketplace="Todos", conta="Todos", busca=None,
+                      ordenar_por=None, crescente=True, limite=None, caminho=None):
+    """
+    Linhas da aba de alertas calculadas no banco: combinações distintas das colunas exibidas no recorte,
+    já filtradas pelo tipo de alerta, marketplace, conta e busca, ordenadas e limitadas, em vez das
+    linhas de pedido do período.
+
+    Args:
+        tipo_alerta: "Todos", "Margens Críticas", "Estoque Parado", "Concorrência de Vendedores" ou "Alta Performance"
+        busca: Termo procurado nas colunas de texto (sem diferenciar maiúsculas)
+        ordenar_por: Coluna de ORDEM_ALERTAS (None mantém a ordem da primeira venda)
+        limite: Máximo de linhas (None para todas)
+
+    Returns:
+        DataFrame com as colunas de alerta existentes na tabela, Margem_Num e Margem_Critica
+    """
+    tabela, margem = _tabela(versao), _expressao_margem(tipo_margem)
+    with _conexao_versao(versao, caminho) as con:
+        existentes = set(_colunas_tabela(con, tabela))
+        colunas = [_citar(c) for c in COLUNAS_ALERTAS if c in existentes]
+        where, parametros = _clausula_where(filtros)
+        condicoes = [where[len(" WHERE "):]] if where else []
+        if tipo_alerta == "Margens Críticas": condicoes.append(f"{margem} < 10")
+        elif tipo_alerta == "Alta Performance": condicoes.append(f"{margem} > 20")
+        elif tipo_alerta == "Estoque Parado" and 'Estoque_Parado_Alerta' in existentes:
+            condicoes.append(f"{_citar('Estoque_Parado_Alerta')} = ?"); parametros.append(True)
+        elif tipo_alerta == "Concorrência de Vendedores" and 'Status_Vendedores_ML' in existentes:
+            condicoes.append(f"{_citar('Status_Vendedores_ML')} = ?"); parametros.append("🔴")
+        for coluna, valor in (('PLATAFORMA', marketplace), ('CONTAS', conta)):
+            if valor not in (None, "Todos", "Todas"):
+                condicoes.append(f"{_citar(coluna)} = ?"); parametros.append(valor)
+        if busca:
+            texto = [_citar(c) for c in COLUNAS_TEXTO_ALERTAS if c in existentes]
+            condicoes.append("(" + " OR ".join(f"LOWER({c}) LIKE ?" for c in texto) + ")")
+            parametros += [f"%{busca.lower()}%"] * len(texto)
+        ordem = ORDEM_ALERTAS.get(ordenar_por)
+        ordem = "Margem_Num" if ordem == "Margem_Num" else (_citar(ordem) if ordem in existentes else None)
+        sql = (f"SELECT {', '.join(colunas + [f'{margem} AS Margem_Num'])} FROM {tabela}"
+               + (" WHERE " + " AND ".join(condicoes) if condicoes else "")
+               + f" GROUP BY {', '.join(colunas + [margem])} ORDER BY "
+               + (f"{ordem} {'ASC' if crescente else 'DESC'} NULLS LAST, " if ordem else "") + "MIN(rowid)"
+               + (f" LIMIT {int(limite)}" if limite is not None else ""))
+        df = _consultar(con, sql, parametros)
+    return _restaurar_tipos(df, tipo_margem)
+
+
+def consultar_opcoes_filtros(versao, caminho=None):
+    """
+    Combinações distintas de conta, plataforma e tipo de anúncio (alimentam os filtros da barra lateral).
+    """
+    colunas = ", ".join(_citar(c) for c in ["CONTAS", "PLATAFORMA", "Tipo de Anúncio"])
+    with _conexao_versao(versao, caminho) as con: return _consultar(con, f"SELECT DISTINCT {colunas} FROM {_tabela(versao)}")
+
+
+def listar_versoes_banco(caminho=None):
+    """
+    Lista os datasets gravados no banco para exibição no painel de administração.
+    """
+    caminho = caminho or CAMINHO_BANCO
+    colunas = ["Versão", "Linhas", "Criado em", "Último acesso"]
+    if not os.path.exists(caminho):
+        return pd.DataFrame(columns=colunas)
+    con = _conectar(caminho)
+    try:
+        _garantir_tabela_versoes(con)
+        versoes = _consultar(con, f"SELECT versao, linhas, criado_em, ultimo_acesso FROM {TABELA_VERSOES} ORDER BY ultimo_acesso DESC")
+    finally: con.close()
+    return pd.DataFrame([{
+        "Versão": v["versao"][:16], "Linhas": int(v["linhas"]),
+        "Criado em": datetime.fromtimestamp(v["criado_em"]).strftime("%Y-%m-%d %H:%M:%S"),
+        "Último acesso": datetime.fromtimestamp(v["ultimo_acesso"]).strftime("%Y-%m-%d %H:%M:%S"),
+    } for _, v in versoes.iterrows()], columns=colunas)
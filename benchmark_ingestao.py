@@ -0,0 +1,169 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from gerar_planilhas_sinteticas import gerar_conjunto, TAMANHOS_PADRAO, DATA_REFERENCIA_PADRAO
+
+# --- BENCHMARK DA CARGA DE PLANILHAS ---
+# Mede cada etapa do processamento (arquivo, validação/abertura, leitura, conversão de tipos, margens,
+# estoque e colunas derivadas) sobre as planilhas sintéticas, com o pico de memória (RSS) de cada medição.
+# Cada medição roda em um processo novo, com o cache de planilhas vazio, e o resultado vai para um JSON
+# que pode ser comparado com o de outro commit (--comparar)
+MODOS_PADRAO = ["padrao", "streaming", "paralelo", "parquet"]
+PARAMETROS_PROCESSAMENTO = ("Margem Estratégica (L)", "MARGEM ESTRATÉGICA", "MARGEM REAL", "TIPO ANUNCIO ML")
+
+
+def _pico_rss_mb(quem):
+    return round(resource.getrusage(quem).ru_maxrss / 1024, 1)  # ru_maxrss em KB no Linux
+
+
+def _duracao_etapas(marcas, fim):
+    # Cada etapa dura do seu início até o início da seguinte (a última, até o fim do processamento)
+    duracoes = {}
+    for (etapa, inicio), proximo in zip(marcas, [m[1] for m in marcas[1:]] + [fim]):
+        duracoes[etapa] = round(duracoes.get(etapa, 0.0) + proximo - inicio, 4)
+    return duracoes
+
+
+def _medir(caminhos, modo, fila):
+    # Executado em um processo novo: cache em disco vazio e pico de memória só desta medição
+    os.environ["VIAFLIX_CACHE_DIR"] = tempfile.mkdtemp(prefix="viaflix_benchmark_")
+    import pandas as pd
+    import processar_planilha_otimizado_melhorado as processamento
+
+    marcas = []
+    def marcar(etapa): marcas.append((etapa, time.perf_counter()))
+    try:
+        inicio = time.perf_counter()
+        marcar("arquivo")
+        if modo == "parquet":
+            custos_df = pd.read_parquet(caminhos["parquet"][0])
+            estoque_df = pd.read_parquet(caminhos["parquet"][1])
+            info_leitura = {"motor": "parquet", "modo": "parquet", "tempo_s": time.perf_counter() - inicio,
+                            "linhas_custos": int(len(custos_df)), "chave": "parquet"}
+            df = processamento._processar_abas(custos_df, estoque_df, None, info_leitura,
+                                               *PARAMETROS_PROCESSAMENTO, callback_etapa=marcar)
+        else:
+            conteudos = []
+            for caminho in caminhos["xlsx"]:
+                with open(caminho, 'rb') as f: conteudos.append(f.read())
+            df, _ = processamento.executar_ingestao(conteudos, [os.path.basename(c) for c in caminhos["xlsx"]],
+                                                    *PARAMETROS_PROCESSAMENTO, modo_leitura=modo, callback_etapa=marcar)
+        fim = time.perf_counter()
+        fila.put({
+            "total_s": round(fim - inicio, 4), "etapas": _duracao_etapas(marcas, fim),
+            "linhas_resultado": int(len(df)) if df is not None else 0,
+            "pico_rss_mb": _pico_rss_mb(resource.RUSAGE_SELF),
+            "pico_rss_filhos_mb": _pico_rss_mb(resource.RUSAGE_CHILDREN),  # Processos de leitura do modo paralelo/lote
+        })
+    except Exception as e_medicao:
+        fila.put({"erro": repr(e_medicao)})
+
+
+def medir(caminhos, modo):
+    """
+    Processa um conjunto de arquivos em um processo separado.
+
+    Returns:
+        dict com total_s, etapas (segundos por etapa), linhas_resultado e picos de RSS, ou com "erro"
+    """
+    contexto = multiprocessing.get_context("spawn")
+    fila = contexto.Queue()
+    processo = contexto.Process(target=_medir, args=(caminhos, modo, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar_resultados(atual, anterior):
+    """
+    Razão atual/anterior do tempo total e de cada etapa, para as medições presentes nos dois arquivos.
+
+    Returns:
+        lista de dicts (linhas, modo, etapa, anterior_s, atual_s, razao)
+    """
+    anteriores = {(r["linhas"], r["modo"]): r for r in anterior["resultados"] if "erro" not in r}
+    comparacoes = []
+    for resultado in atual["resultados"]:
+        base = anteriores.get((resultado["linhas"], resultado["modo"]))
+        if base is None or "erro" in resultado: continue
+        pares = [("total", base["total_s"], resultado["total_s"])]
+        pares += [(etapa, base["etapas"][etapa], tempo) for etapa, tempo in resultado["etapas"].items() if etapa in base["etapas"]]
+        for etapa, tempo_anterior, tempo_atual in pares:
+            comparacoes.append({"linhas": resultado["linhas"], "modo": resultado["modo"], "etapa": etapa,
+                                "anterior_s": tempo_anterior, "atual_s": tempo_atual,
+                                "razao": round(tempo_atual / tempo_anterior, 3) if tempo_anterior else None})
+    return comparacoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede cada etapa da carga de planilhas sobre dados sintéticos.")
+    parser.add_argument("--linhas", type=int, nargs="+", default=TAMANHOS_PADRAO)
+    parser.add_argument("--modos", nargs="+", default=MODOS_PADRAO, choices=MODOS_PADRAO)
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--dados", default="dados_benchmark", help="Diretório das planilhas geradas (reaproveitadas entre execuções)")
+    parser.add_argument("--saida", default=None, help="JSON de resultados (padrão: dados_benchmark/benchmark_<commit>.json)")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--skus", type=int, default=2000)
+    parser.add_argument("--contas", type=int, default=5)
+    parser.add_argument("--plataformas", type=int, default=6)
+    parser.add_argument("--margem-suja", type=float, default=0.2)
+    parser.add_argument("--data-referencia", default=DATA_REFERENCIA_PADRAO, help="Último dia de vendas das planilhas geradas")
+    args = parser.parse_args()
+
+    import pandas as pd
+    from processar_planilha_otimizado_melhorado import CALAMINE_DISPONIVEL
+    commit = _commit_atual()
+    relatorio = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"), "commit": commit,
+        "ambiente": {"python": platform.python_version(), "pandas": pd.__version__, "sistema": platform.platform(),
+                     "cpus": os.cpu_count(), "calamine": CALAMINE_DISPONIVEL},
+        "parametros": {"skus": args.skus, "contas": args.contas, "plataformas": args.plataformas,
+                       "margem_suja": args.margem_suja, "data_referencia": args.data_referencia, "repeticoes": args.repeticoes},
+        "resultados": [],
+    }
+    formatos = ["parquet"] if args.modos == ["parquet"] else ["xlsx", "parquet"]
+    for linhas in args.linhas:
+        print(f"Gerando/reaproveitando {linhas:,} linhas...".replace(",", "."), flush=True)
+        caminhos = gerar_conjunto(args.dados, linhas, n_skus=args.skus, n_contas=args.contas, n_plataformas=args.plataformas,
+                                  proporcao_margem_suja=args.margem_suja, formatos=formatos, data_referencia=args.data_referencia)
+        for modo in args.modos:
+            for repeticao in range(args.repeticoes):
+                resultado = {"linhas": linhas, "modo": modo, "repeticao": repeticao + 1, **medir(caminhos, modo)}
+                relatorio["resultados"].append(resultado)
+                if "erro" in resultado:
+                    print(f"  {modo:<10} erro: {resultado['erro']}", flush=True); continue
+                etapas = "  ".join(f"{etapa} {tempo:.2f}s" for etapa, tempo in resultado["etapas"].items())
+                print(f"  {modo:<10} {resultado['total_s']:8.2f}s  RSS {resultado['pico_rss_mb']:7.1f} MB  | {etapas}", flush=True)
+
+    saida = args.saida or os.path.join(args.dados, f"benchmark_{commit or datetime.now():%Y%m%d_%H%M%S}.json".replace(":", ""))
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as f: json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"Resultados gravados em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f: anterior = json.load(f)
+        for c in comparar_resultados(relatorio, anterior):
+            print(f"  {c['linhas']:>9} {c['modo']:<10} {c['etapa']:<12} {c['anterior_s']:8.2f}s -> {c['atual_s']:8.2f}s  ({c['razao']}x)")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
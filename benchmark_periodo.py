@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from gerar_planilhas_sinteticas import gerar_dados_sinteticos
+
+# --- BENCHMARK DO RECORTE DE PERÍODO ---
+# Compara, sobre o dataset ordenado por data, o filtro de período antigo (comparação de .dt.date linha
+# a linha, com um objeto date por linha, e cópia do resultado) com as buscas binárias atuais: direto sobre
+# a coluna de datas e sobre o índice de dias (indexar_dias), ambas devolvendo uma fatia contígua
+COL_DATA = 'DIA DE VENDA'
+
+
+def filtro_anterior(df, data_inicio, data_fim):
+    datas = df[COL_DATA].dt.date
+    return df[(datas >= data_inicio) & (datas <= data_fim)].copy()
+
+
+def _mediana_ms(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return round(1000 * float(np.median(tempos)), 3), resultado
+
+
+def medir_periodos(df, periodos, repeticoes=5):
+    """
+    Mede os três filtros para cada período (data_inicio, data_fim) e confere se devolvem as mesmas linhas.
+
+    Returns:
+        lista de dicts (periodo, linhas, anterior_ms, busca_ms, indice_ms, ganho)
+    """
+    from processar_planilha_otimizado_melhorado import posicoes_periodo_ordenado, indexar_dias
+    resultados = []
+    indice_dias = indexar_dias(df, COL_DATA)
+    for data_inicio, data_fim in periodos:
+        anterior_ms, esperado = _mediana_ms(lambda: filtro_anterior(df, data_inicio, data_fim), repeticoes)
+        busca_ms, por_busca = _mediana_ms(lambda: df.iloc[slice(*posicoes_periodo_ordenado(df, data_inicio, data_fim, COL_DATA))], repeticoes)
+        indice_ms, por_indice = _mediana_ms(lambda: df.iloc[slice(*posicoes_periodo_ordenado(df, data_inicio, data_fim, COL_DATA, indice_dias))], repeticoes)
+        pd.testing.assert_frame_equal(por_busca, esperado)
+        pd.testing.assert_frame_equal(por_indice, esperado)
+        resultados.append({"periodo": f"{data_inicio:%d/%m/%Y} a {data_fim:%d/%m/%Y}", "linhas": len(esperado),
+                           "anterior_ms": anterior_ms, "busca_ms": busca_ms, "indice_ms": indice_ms,
+                           "ganho": round(anterior_ms / indice_ms, 1) if indice_ms else None})
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara o filtro de período por .dt.date com as buscas binárias no dataset ordenado.")
+    parser.add_argument("--linhas", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--dias", type=int, nargs="+", default=[1, 7, 30, 90, 365], help="Tamanhos de período, terminando no último dia")
+    args = parser.parse_args()
+
+    from processar_planilha_otimizado_melhorado import indexar_dias
+    for linhas in args.linhas:
+        # Só as colunas da aba CUSTOS, com datas convertidas e ordenadas como no processamento
+        df, _ = gerar_dados_sinteticos(linhas)
+        df[COL_DATA] = pd.to_datetime(df[COL_DATA], errors='coerce')
+        df = df.dropna(subset=[COL_DATA]).sort_values(COL_DATA, kind='mergesort').reset_index(drop=True)
+        inicio = time.perf_counter()
+        indexar_dias(df, COL_DATA)
+        montagem_ms = 1000 * (time.perf_counter() - inicio)
+
+        ultimo_dia = df[COL_DATA].iloc[-1].date()
+        periodos = [(ultimo_dia - pd.Timedelta(days=dias - 1), ultimo_dia) for dias in args.dias]
+        print(f"{len(df):,} linhas".replace(",", ".") + f" (índice de dias montado em {montagem_ms:.1f} ms, uma vez por versão do dataset)", flush=True)
+        print(f"  {'período':<26} {'linhas':>9} {'.dt.date':>11} {'busca':>9} {'índice':>9} {'ganho':>8}")
+        for r in medir_periodos(df, periodos, args.repeticoes):
+            print(f"  {r['periodo']:<26} {r['linhas']:>9} {r['anterior_ms']:>9.1f}ms {r['busca_ms']:>7.3f}ms {r['indice_ms']:>7.3f}ms {r['ganho']:>7}x", flush=True)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
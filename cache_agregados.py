@@ -0,0 +1,137 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from indice_filtros import VALORES_SEM_FILTRO
+
+# --- CACHE DE CONSULTAS AGREGADAS DO PAINEL ---
+# Métricas, série temporal, mapa e gráficos por categoria são os mesmos para todas as sessões que olham
+# a mesma visão (ex.: Marketplaces / Mercado Livre / 30 dias). O resultado de cada consulta fica em um
+# cache do processo, chaveado por versão do dataset + consulta + filtros normalizados, com um orçamento
+# global de memória: ao passar do orçamento, saem as entradas usadas há mais tempo (LRU).
+# Os resultados são compartilhados entre as sessões e tratados como somente leitura
+ORCAMENTO_CACHE_AGREGADOS_BYTES = int(os.environ.get("VIAFLIX_CACHE_AGREGADOS_MB", "64")) * 1024 * 1024
+
+_entradas = OrderedDict()  # chave -> {"valor", "bytes", "acertos"}
+_trava_agregados = threading.Lock()
+_contadores = {"acertos": 0, "faltas": 0, "despejos": 0}
+_bytes_em_uso = 0
+
+
+def normalizar_filtros(filtros):
+    """
+    Forma canônica dos filtros do painel: filtros que não filtram ("Todos"/"Todas"/None) saem e
+    datas viram o dia em ISO, de modo que visões equivalentes caiam na mesma entrada.
+
+    Returns:
+        tuple ordenada de pares (chave, valor)
+    """
+    itens = []
+    for chave, valor in (filtros or {}).items():
+        if valor in VALORES_SEM_FILTRO: continue
+        if hasattr(valor, "isoformat"): valor = pd.Timestamp(valor).date().isoformat()
+        itens.append((chave, valor))
+    return tuple(sorted(itens))
+
+
+def _tamanho_bytes(valor):
+    # Estimativa do que o resultado ocupa em memória (o orçamento é aproximado)
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, (pd.Series, pd.Index)):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(sys.getsizeof(k) + _tamanho_bytes(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamanho_bytes(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+def obter_agregado(versao, consulta, filtros, calcular, *parametros):
+    """
+    Resultado da consulta agregada para a versão do dataset e os filtros, calculado uma vez para
+    todas as sessões. Sem versão, calcula sem guardar. Um resultado maior que o orçamento inteiro
+    não é guardado.
+
+    Args:
+        versao: Versão do dataset (em memória ou no banco)
+        consulta: Nome da consulta (ex.: "metricas", ("dimensao", "estado", "faturamento"))
+        filtros: dict de montar_filtros_painel
+        calcular: Função sem argumentos que calcula o resultado
+        *parametros: O que mais muda o resultado (ex.: o tipo de margem)
+
+    Returns:
+        Resultado de calcular() (compartilhado: não alterar)
+    """
+    global _bytes_em_uso
+    if not versao:
+        return calcular()
+    chave = (versao, consulta, normalizar_filtros(filtros), parametros)
+    with _trava_agregados:
+        entrada = _entradas.get(chave)
+        if entrada is not None:
+            _entradas.move_to_end(chave)
+            entrada["acertos"] += 1; _contadores["acertos"] += 1
+            return entrada["valor"]
+        _contadores["faltas"] += 1
+    # O cálculo roda fora da trava: consultas diferentes não esperam umas pelas outras
+    valor = calcular()
+    tamanho = _tamanho_bytes(valor)
+    if tamanho > ORCAMENTO_CACHE_AGREGADOS_BYTES:
+        return valor
+    with _trava_agregados:
+        existente = _entradas.get(chave)
+        if existente is not None:  # Outra sessão calculou a mesma consulta ao mesmo tempo
+            return existente["valor"]
+        _entradas[chave] = {"valor": valor, "bytes": tamanho, "acertos": 0}
+        _bytes_em_uso += tamanho
+        while _bytes_em_uso > ORCAMENTO_CACHE_AGREGADOS_BYTES:
+            _, removida = _entradas.popitem(last=False)
+            _bytes_em_uso -= removida["bytes"]; _contadores["despejos"] += 1
+    return valor
+
+
+def estatisticas_cache_agregados():
+    """
+    Returns:
+        dict com entradas, bytes, orcamento_bytes, acertos, faltas, despejos e taxa_acerto (None sem consultas)
+    """
+    with _trava_agregados:
+        contadores = dict(_contadores)
+        entradas, bytes_em_uso = len(_entradas), _bytes_em_uso
+    consultas = contadores["acertos"] + contadores["faltas"]
+    return {"entradas": entradas, "bytes": bytes_em_uso, "orcamento_bytes": ORCAMENTO_CACHE_AGREGADOS_BYTES, **contadores,
+            "taxa_acerto": contadores["acertos"] / consultas if consultas else None}
+
+
+def listar_cache_agregados():
+    """
+    Entradas do cache, da usada mais recentemente para a mais antiga.
+
+    Returns:
+        DataFrame com uma linha por entrada
+    """
+    colunas = ["Versão", "Consulta", "Filtros", "Parâmetros", "Tamanho (KB)", "Acertos"]
+    with _trava_agregados:
+        itens = [(chave, entrada["bytes"], entrada["acertos"]) for chave, entrada in reversed(_entradas.items())]
+    return pd.DataFrame([{
+        "Versão": str(versao)[:12],
+        "Consulta": consulta if isinstance(consulta, str) else " / ".join(map(str, consulta)),
+        "Filtros": ", ".join(f"{chave}={valor}" for chave, valor in filtros) or "-",
+        "Parâmetros": ", ".join(map(str, parametros)) or "-",
+        "Tamanho (KB)": round(tamanho / 1024, 1), "Acertos": acertos,
+    } for (versao, consulta, filtros, parametros), tamanho, acertos in itens], columns=colunas)
+
+
+def limpar_cache_agregados():
+    """Remove todas as entradas e zera os contadores."""
+    global _bytes_em_uso
+    with _trava_agregados:
+        _entradas.clear(); _bytes_em_uso = 0
+        for nome in _contadores: _contadores[nome] = 0
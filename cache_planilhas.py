@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# --- CONFIGURAÇÕES DO CACHE EM DISCO ---
+# Diretório e limite de tamanho podem ser ajustados por variáveis de ambiente
+CACHE_DIR = os.environ.get("VIAFLIX_CACHE_DIR", "cache_planilhas")
+LIMITE_CACHE_BYTES = int(os.environ.get("VIAFLIX_CACHE_LIMITE_MB", "1024")) * 1024 * 1024
+INDICE_CACHE = "indice.json"
+
+_trava_cache = threading.Lock()
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_DISPONIVEL = True
+except ImportError:
+    PARQUET_DISPONIVEL = False
+
+
+def calcular_hash_conteudo(conteudo):
+    """
+    Calcula o SHA-256 do conteúdo bruto da planilha enviada.
+
+    Args:
+        conteudo: bytes do arquivo enviado
+
+    Returns:
+        str: hash hexadecimal usado como chave do cache
+    """
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def _caminho(nome_arquivo):
+    return os.path.join(CACHE_DIR, nome_arquivo)
+
+
+def _ler_indice():
+    caminho_indice = _caminho(INDICE_CACHE)
+    if not os.path.exists(caminho_indice):
+        return {}
+    try:
+        with open(caminho_indice, 'r') as f: data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _sufixo_tmp():
+    # Temporário exclusivo por processo/thread: as planilhas de um lote gravam o cache ao mesmo tempo
+    return f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _salvar_indice(indice):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    caminho_tmp = _caminho(INDICE_CACHE + _sufixo_tmp())
+    with open(caminho_tmp, 'w') as f: json.dump(indice, f, indent=4)
+    os.replace(caminho_tmp, _caminho(INDICE_CACHE))
+
+
+def _remover_arquivos(entrada):
+    for nome_arquivo in entrada.get("arquivos", []):
+        try: os.remove(_caminho(nome_arquivo))
+        except OSError: pass
+
+
+def _gravar_frame(df, nome_base):
+    """
+    Grava o DataFrame em Parquet (quando o pyarrow está disponível) ou em pickle.
+    Colunas com tipos mistos não são aceitas pelo Parquet, por isso o pickle é o fallback.
+    """
+    if PARQUET_DISPONIVEL:
+        nome_arquivo = nome_base + ".parquet"
+        caminho_tmp = _caminho(nome_arquivo + _sufixo_tmp())
+        df_gravar = df.copy(deep=False)
+        df_gravar.columns = [str(c) for c in df_gravar.columns]
+        try:
+            df_gravar.to_parquet(caminho_tmp, index=False)
+            os.replace(caminho_tmp, _caminho(nome_arquivo))
+            return nome_arquivo
+        except Exception:
+            try: os.remove(caminho_tmp)
+            except OSError: pass
+    nome_arquivo = nome_base + ".pkl"
+    caminho_tmp = _caminho(nome_arquivo + _sufixo_tmp())
+    df.to_pickle(caminho_tmp)
+    os.replace(caminho_tmp, _caminho(nome_arquivo))
+    return nome_arquivo
+
+
+def _ler_frame(nome_arquivo):
+    if nome_arquivo.endswith(".parquet"):
+        return pd.read_parquet(_caminho(nome_arquivo))
+    return pd.read_pickle(_caminho(nome_arquivo))
+
+
+def carregar_abas_do_cache(chave, assinatura_leitura):
+    """
+    Recupera as abas CUSTOS e ESTOQUE já lidas de uma planilha idêntica.
+
+    Args:
+        chave: hash SHA-256 do conteúdo da planilha
+        assinatura_leitura: lista de colunas lidas da aba CUSTOS (invalida o cache se mudar)
+
+    Returns:
+        tuple (custos_df, estoque_df) ou None se não houver entrada válida
+    """
+    with _trava_cache:
+        indice = _ler_indice()
+        entrada = indice.get(chave)
+        if entrada is None or entrada.get("assinatura") != list(assinatura_leitura):
+            return None
+        try:
+            custos_df = _ler_frame(entrada["arquivos"][0])
+            estoque_df = _ler_frame(entrada["arquivos"][1])
+        except Exception:
+            # Entrada corrompida ou apagada manualmente: descartar
+            _remover_arquivos(entrada)
+            del indice[chave]
+            _salvar_indice(indice)
+            return None
+        entrada["ultimo_acesso"] = time.time()
+        entrada["acessos"] = entrada.get("acessos", 0) + 1
+        try: _salvar_indice(indice)
+        except OSError: pass  # Estatística de acesso não impede o uso da entrada
+    return custos_df, estoque_df
+
+
+def salvar_abas_no_cache(chave, assinatura_leitura, custos_df, estoque_df):
+    """
+    Persiste as abas lidas e aplica a remoção LRU até caber no limite de tamanho.
+    Falhas de gravação nunca interrompem o processamento da planilha.
+    """
+    try:
+        with _trava_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            indice = _ler_indice()
+            if chave in indice: _remover_arquivos(indice.pop(chave))
+            arquivos = [_gravar_frame(custos_df, f"{chave}_custos"), _gravar_frame(estoque_df, f"{chave}_estoque")]
+            agora = time.time()
+            indice[chave] = {
+                "arquivos": arquivos,
+                "assinatura": list(assinatura_leitura),
+                "tamanho_bytes": sum(os.path.getsize(_caminho(a)) for a in arquivos),
+                "linhas_custos": int(len(custos_df)),
+                "criado_em": agora, "ultimo_acesso": agora, "acessos": 0
+            }
+            _aplicar_limite(indice)
+            _salvar_indice(indice)
+    except Exception:
+        pass
+
+
+def _aplicar_limite(indice):
+    # Remove as entradas menos recentemente usadas até o total caber no limite
+    total = sum(e.get("tamanho_bytes", 0) for e in indice.values())
+    for chave_antiga in sorted(indice, key=lambda k: indice[k].get("ultimo_acesso", 0)):
+        if total <= LIMITE_CACHE_BYTES: break
+        total -= indice[chave_antiga].get("tamanho_bytes", 0)
+        _remover_arquivos(indice.pop(chave_antiga))
+
+
+def listar_cache():
+    """
+    Lista as entradas do cache para exibição no painel de administração.
+
+    Returns:
+        DataFrame com uma linha por planilha em cache, da mais recente para a mais antiga
+    """
+    with _trava_cache:
+        indice = _ler_indice()
+    linhas = [{
+        "Hash": chave[:16],
+        "Formato": os.path.splitext(e["arquivos"][0])[1].lstrip("."),
+        "Linhas CUSTOS": e.get("linhas_custos", 0),
+        "Tamanho (MB)": round(e.get("tamanho_bytes", 0) / (1024 * 1024), 2),
+        "Acessos": e.get("acessos", 0),
+        "Criado em": datetime.fromtimestamp(e.get("criado_em", 0)).strftime("%Y-%m-%d %H:%M:%S"),
+        "Último acesso": datetime.fromtimestamp(e.get("ultimo_acesso", 0)).strftime("%Y-%m-%d %H:%M:%S"),
+    } for chave, e in sorted(indice.items(), key=lambda kv: kv[1].get("ultimo_acesso", 0), reverse=True)]
+    return pd.DataFrame(linhas, columns=["Hash", "Formato", "Linhas CUSTOS", "Tamanho (MB)", "Acessos", "Criado em", "Último acesso"])
+
+
+def tamanho_total_cache():
+    with _trava_cache:
+        indice = _ler_indice()
+    return sum(e.get("tamanho_bytes", 0) for e in indice.values())
+
+
+def limpar_cache():
+    """Remove todas as entradas do cache em disco."""
+    with _trava_cache:
+        indice = _ler_indice()
+        for entrada in indice.values(): _remover_arquivos(entrada)
+        _salvar_indice({})
@@ -0,0 +1,251 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from indice_filtros import VALORES_SEM_FILTRO
+
+# --- CUBO DIÁRIO DE VENDAS ---
+# Agregado do dataset por dia × conta × plataforma × tipo de venda × tipo de anúncio × estado, com
+# faturamento, pedidos, unidades e soma/contagem das duas margens. Cards, série temporal, pizzas/barras
+# por tipo de venda e marketplace e o mapa por estado são respondidos pelas células do cubo (milhares),
+# não pelas linhas de pedido (milhões): o custo de uma execução do painel deixa de crescer com o volume.
+# O cubo é montado na carga (etapa "cubo") e compartilhado entre as sessões por versão do dataset; as duas
+# margens ficam no cubo, então trocar o tipo de margem não o remonta.
+# SKUs distintos não são somáveis: cada célula guarda o conjunto dos seus SKUs, no estilo dos contêineres
+# do roaring bitmap (lista de códigos para células com poucos SKUs, bitset np.packbits para as demais),
+# e a contagem de um recorte é o OR desses conjuntos
+DIMENSOES_CUBO = {"conta": 'CONTAS', "plataforma": 'PLATAFORMA', "tipo_venda": 'TIPO DE VENDA',
+                  "tipo_anuncio": 'Tipo de Anúncio', "estado": 'Estado'}
+MARGENS_CUBO = {"estrategica": 'Margem_Estrategica_Num', "real": 'Margem_Real_Num'}
+MAX_CUBOS = int(os.environ.get("VIAFLIX_MAX_CUBOS", "8"))  # Versões do dataset com cubo em memória (LRU)
+COL_DATA = 'DIA DE VENDA'
+COL_VALOR = 'VALOR DO PEDIDO'
+COL_QUANTIDADE = 'QUANTIDADE'
+COL_SKU = 'SKU PRODUTOS'
+BYTES_CODIGO_SKU = 4  # Cada código na lista de uma célula é um int32
+
+_cubos = OrderedDict()  # versão base do dataset -> CuboVendas
+_trava_cubos = threading.Lock()
+
+
+def _chave_margem(tipo_margem):
+    # Mesma regra de _aplicar_margem: qualquer coisa que não seja a Margem Real usa a Estratégica
+    return "real" if tipo_margem and "Margem Real (M)" in tipo_margem else "estrategica"
+
+
+class CuboVendas:
+    """
+    Células (dia, dimensões) de um dataset, ordenadas por dia. Cada dimensão guarda o código da
+    categoria por célula (-1 para vazio) e cada medida um float64 por célula.
+    """
+
+    def __init__(self, df):
+        self.versao = df.attrs.get('versao_base') or df.attrs.get('versao')
+        validas = df[COL_DATA].notna().to_numpy() if COL_DATA in df.columns else np.zeros(len(df), dtype=bool)
+        dias = df[COL_DATA].to_numpy()[validas].astype('datetime64[D]').astype(np.int64) if validas.any() else np.zeros(0, dtype=np.int64)
+        dia_base = int(dias.min()) if len(dias) else 0
+
+        # Chave de célula em base mista: o dia é o dígito mais significativo, então as células saem ordenadas por dia
+        chave = dias - dia_base
+        self.categorias, bases = {}, []
+        for nome, coluna in DIMENSOES_CUBO.items():
+            if coluna not in df.columns: continue  # Dimensão ausente não filtra (como no índice de filtros)
+            serie = df[coluna]
+            if not isinstance(serie.dtype, pd.CategoricalDtype): serie = serie.astype('category')
+            self.categorias[nome] = list(serie.cat.categories)
+            bases.append(len(self.categorias[nome]) + 1)
+            chave = chave * bases[-1] + (serie.cat.codes.to_numpy()[validas].astype(np.int64) + 1)
+        celulas, inversa = np.unique(chave, return_inverse=True)
+
+        self.codigos = {}
+        resto = celulas
+        for nome, base in zip(reversed(list(self.categorias)), reversed(bases)):
+            resto, codigo = np.divmod(resto, base)
+            self.codigos[nome] = (codigo - 1).astype(np.int32)
+        self.dias = (resto + dia_base).astype('datetime64[D]')
+        self.linhas = int(validas.sum())
+
+        def somar(pesos=None):
+            return np.bincount(inversa, weights=pesos, minlength=len(celulas)).astype(np.float64)
+        def coluna_numerica(coluna):
+            if coluna not in df.columns: return np.zeros(self.linhas)
+            return pd.to_numeric(df[coluna], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)[validas]
+
+        self.medidas = {
+            "faturamento": somar(np.nan_to_num(coluna_numerica(COL_VALOR))),
+            "pedidos": somar(),
+            "unidades": somar(np.nan_to_num(coluna_numerica(COL_QUANTIDADE))),
+        }
+        for chave_margem, coluna in MARGENS_CUBO.items():
+            margem = coluna_numerica(coluna)
+            self.medidas[f"margem_{chave_margem}_soma"] = somar(np.nan_to_num(margem))
+            self.medidas[f"margem_{chave_margem}_n"] = somar((~np.isnan(margem)).astype(np.float64))
+        self._montar_skus(df, validas, inversa, len(celulas))
+
+    def _montar_skus(self, df, validas, inversa, n_celulas):
+        # Pares (célula, SKU) distintos, ordenados por célula; SKU vazio não conta (como no nunique)
+        if COL_SKU in df.columns:
+            serie = df[COL_SKU]
+            if not isinstance(serie.dtype, pd.CategoricalDtype): serie = serie.astype('category')
+            self.total_skus = len(serie.cat.categories)
+            codigos = serie.cat.codes.to_numpy()[validas].astype(np.int64)
+        else:
+            self.total_skus, codigos = 0, np.zeros(len(inversa), dtype=np.int64) - 1
+        preenchidos = codigos >= 0
+        base = max(self.total_skus, 1)
+        pares = np.sort(inversa[preenchidos].astype(np.int64) * base + codigos[preenchidos])
+        pares = pares[np.concatenate([[True], pares[1:] != pares[:-1]])] if len(pares) else pares  # np.unique com hash é bem mais lento aqui
+        celula_par, sku_par = np.divmod(pares, base)
+        skus_por_celula = np.bincount(celula_par, minlength=n_celulas)
+
+        # Contêiner de cada célula: o que ocupar menos, a lista de códigos ou o bitset de todos os SKUs
+        bytes_bitset = -(-self.total_skus // 8)
+        densas = skus_por_celula * BYTES_CODIGO_SKU > bytes_bitset
+        par_denso = densas[celula_par]
+        self.skus_codigos = sku_par[~par_denso].astype(np.int32)
+        self.skus_por_celula = np.where(densas, 0, skus_por_celula)
+        self.skus_inicio = np.concatenate([[0], np.cumsum(self.skus_por_celula)])  # Lista da célula i: skus_codigos[skus_inicio[i]:skus_inicio[i + 1]]
+        self.skus_linha_bitset = np.full(n_celulas, -1, dtype=np.int32)
+        self.skus_linha_bitset[densas] = np.arange(int(densas.sum()), dtype=np.int32)
+        self.skus_bitsets = np.zeros((int(densas.sum()), bytes_bitset), dtype=np.uint8)
+        linhas, skus_densos = self.skus_linha_bitset[celula_par[par_denso]], sku_par[par_denso]
+        np.bitwise_or.at(self.skus_bitsets, (linhas, skus_densos >> 3), (128 >> (skus_densos & 7)).astype(np.uint8))
+
+    @property
+    def celulas(self):
+        return len(self.dias)
+
+    @property
+    def tamanho_bytes(self):
+        skus = self.skus_codigos.nbytes + self.skus_inicio.nbytes + self.skus_linha_bitset.nbytes + self.skus_bitsets.nbytes
+        return self.dias.nbytes + sum(a.nbytes for a in self.codigos.values()) + sum(a.nbytes for a in self.medidas.values()) + skus
+
+    def selecionar(self, filtros):
+        """
+        Células que atendem ao período e aos filtros.
+
+        Args:
+            filtros: dict de montar_filtros_painel (data_inicio, data_fim, conta, tipo_venda, plataforma, tipo_anuncio)
+
+        Returns:
+            slice (só o período, sem cópia) ou np.ndarray com as posições das células
+        """
+        inicio, fim = 0, self.celulas
+        if filtros.get("data_inicio") is not None and filtros.get("data_fim") is not None:
+            inicio = int(np.searchsorted(self.dias, pd.Timestamp(filtros["data_inicio"]).to_datetime64().astype('datetime64[D]'), side='left'))
+            fim = int(np.searchsorted(self.dias, pd.Timestamp(filtros["data_fim"]).to_datetime64().astype('datetime64[D]'), side='right'))
+        mascara = None
+        for chave, valor in filtros.items():
+            if chave not in self.codigos or valor in VALORES_SEM_FILTRO: continue
+            if valor not in self.categorias[chave]: return np.zeros(0, dtype=np.int64)  # Valor inexistente: nenhuma célula
+            condicao = self.codigos[chave][inicio:fim] == self.categorias[chave].index(valor)
+            mascara = condicao if mascara is None else mascara & condicao
+        if mascara is None:
+            return slice(inicio, fim)
+        return np.flatnonzero(mascara) + inicio
+
+    def skus_distintos(self, selecao):
+        """
+        SKUs distintos nas células selecionadas (exato): as listas viram um bitset e os bitsets das
+        células densas entram por OR.
+
+        Args:
+            selecao: Resultado de selecionar()
+        """
+        if not self.total_skus:
+            return 0
+        marcados = np.zeros(self.total_skus, dtype=bool)
+        if isinstance(selecao, slice):
+            marcados[self.skus_codigos[self.skus_inicio[selecao.start]:self.skus_inicio[selecao.stop]]] = True
+        elif len(selecao):
+            # As posições vêm ordenadas: só o trecho de listas entre a primeira e a última célula é percorrido
+            primeira, ultima = int(selecao[0]), int(selecao[-1]) + 1
+            mascara = np.zeros(ultima - primeira, dtype=bool)
+            mascara[selecao - primeira] = True
+            trecho = self.skus_codigos[self.skus_inicio[primeira]:self.skus_inicio[ultima]]
+            marcados[trecho[np.repeat(mascara, self.skus_por_celula[primeira:ultima])]] = True
+        bits = np.packbits(marcados)
+        linhas = self.skus_linha_bitset[selecao]
+        linhas = linhas[linhas >= 0]
+        if len(linhas):
+            np.bitwise_or(bits, np.bitwise_or.reduce(self.skus_bitsets[linhas], axis=0), out=bits)
+        return int(np.unpackbits(bits, count=self.total_skus).sum())
+
+    def metricas(self, filtros, tipo_margem):
+        """
+        Métricas do cabeçalho, no mesmo formato de consultar_metricas.
+
+        Returns:
+            dict com faturamento, margem_media (None sem margens), skus_unicos, pedidos e unidades
+        """
+        selecao = self.selecionar(filtros)
+        chave_margem = _chave_margem(tipo_margem)
+        n_margem = self.medidas[f"margem_{chave_margem}_n"][selecao].sum()
+        return {
+            "faturamento": float(self.medidas["faturamento"][selecao].sum()),
+            "margem_media": float(self.medidas[f"margem_{chave_margem}_soma"][selecao].sum() / n_margem) if n_margem else None,
+            "skus_unicos": self.skus_distintos(selecao),
+            "pedidos": int(self.medidas["pedidos"][selecao].sum()),
+            "unidades": int(self.medidas["unidades"][selecao].sum()),
+        }
+
+    def por_dia(self, filtros, medida="faturamento"):
+        """
+        Medida somada por dia, no mesmo formato de consultar_vendas_por_dia.
+
+        Returns:
+            DataFrame com 'Data' (date) e 'VALOR DO PEDIDO', em ordem cronológica
+        """
+        selecao = self.selecionar(filtros)
+        dias, posicao_dia = np.unique(self.dias[selecao], return_inverse=True)
+        valores = np.bincount(posicao_dia, weights=self.medidas[medida][selecao], minlength=len(dias))
+        return pd.DataFrame({'Data': dias.astype(object), COL_VALOR: valores})
+
+    def por_dimensao(self, dimensao, filtros, medida="pedidos"):
+        """
+        Medida somada por valor de uma dimensão (só valores com algum pedido no recorte, na ordem das categorias).
+        medida="valor_medio" dá o faturamento por pedido.
+
+        Returns:
+            pd.Series indexada pelos valores da dimensão
+        """
+        if dimensao not in self.codigos:
+            return pd.Series(dtype=np.float64)
+        selecao = self.selecionar(filtros)
+        codigos = self.codigos[dimensao][selecao]
+        preenchidas = codigos >= 0
+        tamanho = len(self.categorias[dimensao])
+        def somar(nome): return np.bincount(codigos[preenchidas], weights=self.medidas[nome][selecao][preenchidas], minlength=tamanho)
+        pedidos = somar("pedidos")
+        if medida == "valor_medio":
+            valores = np.divide(somar("faturamento"), pedidos, out=np.zeros(tamanho), where=pedidos > 0)
+        else:
+            valores = pedidos.astype(np.int64) if medida == "pedidos" else somar(medida)
+        presentes = pedidos > 0
+        return pd.Series(valores[presentes], index=pd.Index(np.array(self.categorias[dimensao], dtype=object)[presentes], name=dimensao))
+
+
+def obter_cubo(df):
+    """
+    Cubo diário da versão do dataset, montado na primeira chamada (normalmente na carga) e mantido
+    em um LRU por versão base (o tipo de margem não muda as células). Sem versão, o cubo não é guardado.
+
+    Returns:
+        CuboVendas
+    """
+    versao = df.attrs.get('versao_base') or df.attrs.get('versao')
+    if not versao:
+        return CuboVendas(df)
+    with _trava_cubos:
+        cubo = _cubos.get(versao)
+        if cubo is not None:
+            _cubos.move_to_end(versao); return cubo
+    cubo = CuboVendas(df)
+    with _trava_cubos:
+        cubo = _cubos.setdefault(versao, cubo)  # A carga e uma sessão podem montar o mesmo cubo ao mesmo tempo
+        _cubos.move_to_end(versao)
+        while len(_cubos) > MAX_CUBOS: _cubos.popitem(last=False)
+    return cubo
@@ -0,0 +1,189 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# --- PLANILHAS SINTÉTICAS PARA MEDIR A CARGA ---
+# Gera planilhas com as abas CUSTOS e ESTOQUE no mesmo formato da planilha de produção (e os Parquet
+# equivalentes), em vários tamanhos. As cardinalidades de SKU, conta e plataforma são configuráveis e
+# as margens vêm nos formatos "sujos" encontrados na prática ("15,23%", "0.1523", 0.1523, "abc", vazio...)
+try:
+    import xlsxwriter  # Escrita bem mais rápida que a do openpyxl, se instalado
+    XLSXWRITER_DISPONIVEL = True
+except ImportError:
+    XLSXWRITER_DISPONIVEL = False
+import openpyxl
+
+TAMANHOS_PADRAO = [10_000, 100_000, 1_000_000, 3_000_000]
+MAX_LINHAS_ABA = 1_048_575  # Limite do Excel (sem o cabeçalho): acima disso a planilha é dividida em partes
+COLUNAS_CUSTOS = ['SKU PRODUTOS', 'DIA DE VENDA', 'CONTAS', 'PLATAFORMA', 'PREÇO UND', 'ID DO PRODUTO', 'QUANTIDADE',
+                  'VALOR DO PEDIDO', 'MARGEM ESTRATÉGICA', 'MARGEM REAL', 'TIPO ANUNCIO ML', 'CEP']
+COLUNAS_ESTOQUE = ['SKU VF', 'QTD VF', '', 'SKU GS', 'QTD GS', '', 'SKU DK', 'QTD DK', '', 'SKU TINY', 'QTD TINY']
+CONTAS_BASE = ['Via Flix', 'Monaco', 'GS Torneira', 'DK Metais', 'Tiny Store']
+PLATAFORMAS_BASE = ['Mercado Livre', 'Shopee', 'Amazon', 'Magalu', 'Americanas', 'Atacado', 'Showroom', 'Loja Própria']
+MARGENS_SUJAS = ['0.1523', 0.1523, '15.23%', ' 15,23 % ', '-5,5%', 'abc', '', None, '#N/D', 12]
+# Último dia de vendas gerado: fixo, para que a mesma semente gere os mesmos arquivos em qualquer dia
+DATA_REFERENCIA_PADRAO = "2024-12-31"
+
+
+def _nomes(base, quantidade, prefixo):
+    return [base[i] if i < len(base) else f"{prefixo} {i + 1}" for i in range(quantidade)]
+
+
+def _margens(rng, linhas, proporcao_suja):
+    # Maioria no formato brasileiro "15,23%"; a proporção suja sorteia entre os formatos de MARGENS_SUJAS
+    valores = np.char.add(np.char.replace(np.char.mod('%.2f', rng.normal(18, 9, linhas)), '.', ','), '%').astype(object)
+    sujas = rng.random(linhas) < proporcao_suja
+    valores[sujas] = np.array(MARGENS_SUJAS, dtype=object)[rng.integers(0, len(MARGENS_SUJAS), sujas.sum())]
+    return valores
+
+
+def gerar_dados_sinteticos(linhas, n_skus=2000, n_contas=5, n_plataformas=6, dias=365, proporcao_margem_suja=0.2,
+                           proporcao_sem_data=0.005, semente=0, data_referencia=DATA_REFERENCIA_PADRAO):
+    """
+    Gera as abas CUSTOS e ESTOQUE em DataFrames, com distribuição de vendas concentrada em poucos SKUs.
+
+    Args:
+        linhas: Linhas da aba CUSTOS
+        n_skus, n_contas, n_plataformas: Cardinalidades das dimensões
+        dias: Janela de datas de venda (terminando em data_referencia)
+        proporcao_margem_suja: Fração das margens fora do formato "15,23%"
+        proporcao_sem_data: Fração de linhas sem data de venda (descartadas no processamento)
+        semente: Semente do gerador (mesma semente e data de referência, mesmos dados)
+        data_referencia: Último dia de vendas (data ou texto ISO)
+
+    Returns:
+        tuple (custos_df, estoque_df)
+    """
+    rng = np.random.default_rng(semente)
+    skus = np.array([f"SKU{i:05d}" for i in range(n_skus)], dtype=object)
+    ids_produto = np.array([f"MLB{rng.integers(1_000_000, 9_999_999)}" for _ in range(n_skus)], dtype=object)
+    precos_sku = np.round(rng.uniform(5, 500, n_skus), 2)
+    # Zipf truncado: poucos SKUs concentram a maior parte das vendas
+    pesos = 1.0 / np.arange(1, n_skus + 1) ** 1.1
+    sku_linha = rng.choice(n_skus, size=linhas, p=pesos / pesos.sum())
+
+    contas = np.array(_nomes(CONTAS_BASE, n_contas, "Conta"), dtype=object)
+    plataformas = np.array(_nomes(PLATAFORMAS_BASE, n_plataformas, "Plataforma"), dtype=object)
+    plataforma_linha = plataformas[rng.integers(0, n_plataformas, linhas)]
+
+    ultimo_dia = pd.Timestamp(data_referencia).normalize()
+    datas = (ultimo_dia - pd.to_timedelta(rng.integers(0, dias, linhas), unit='D')).to_numpy().astype('datetime64[us]').astype(object)
+    datas[rng.random(linhas) < proporcao_sem_data] = None
+
+    quantidades = rng.integers(1, 6, linhas)
+    tipo_anuncio = np.where(plataforma_linha == 'Mercado Livre', np.array(['Clássico', 'Premium'], dtype=object)[rng.integers(0, 2, linhas)], None)
+    ceps = np.char.mod('%08d', rng.integers(1_000_000, 99_999_999, linhas)).astype(object)
+    com_hifen = rng.random(linhas) < 0.1
+    ceps[com_hifen] = [f"{c[:5]}-{c[5:]}" for c in ceps[com_hifen]]
+
+    custos_df = pd.DataFrame({
+        'SKU PRODUTOS': skus[sku_linha],
+        'DIA DE VENDA': datas,
+        'CONTAS': contas[rng.integers(0, n_contas, linhas)],
+        'PLATAFORMA': plataforma_linha,
+        'PREÇO UND': precos_sku[sku_linha],
+        'ID DO PRODUTO': ids_produto[sku_linha],
+        'QUANTIDADE': quantidades,
+        'VALOR DO PEDIDO': np.round(precos_sku[sku_linha] * quantidades, 2),
+        'MARGEM ESTRATÉGICA': _margens(rng, linhas, proporcao_margem_suja),
+        'MARGEM REAL': _margens(rng, linhas, proporcao_margem_suja),
+        'TIPO ANUNCIO ML': tipo_anuncio,
+        'CEP': ceps,
+    })
+
+    # ESTOQUE: pares SKU/quantidade por depósito (VF, GS, DK, Tiny), cada um com parte dos SKUs
+    colunas_estoque = {}
+    for deposito in ['VF', 'GS', 'DK', 'TINY']:
+        presentes = skus[rng.random(n_skus) < 0.8]
+        colunas_estoque[f'SKU {deposito}'] = pd.Series(presentes, dtype=object)
+        colunas_estoque[f'QTD {deposito}'] = pd.Series(rng.integers(0, 100, len(presentes)))
+    estoque_df = pd.DataFrame(colunas_estoque)
+    for posicao in (2, 5, 8):
+        estoque_df.insert(posicao, f'vazia_{posicao}', None)
+    return custos_df, estoque_df
+
+
+def _linhas_planilha(df):
+    colunas = [df[c].tolist() for c in df.columns]
+    for linha in zip(*colunas):
+        yield [None if isinstance(v, float) and v != v else v for v in linha]
+
+
+def escrever_planilha(custos_df, estoque_df, caminho):
+    """Grava um .xlsx com as abas CUSTOS e ESTOQUE (xlsxwriter se instalado, senão openpyxl em modo de escrita)."""
+    if XLSXWRITER_DISPONIVEL:
+        wb = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+        formato_data = wb.add_format({'num_format': 'dd/mm/yyyy'})
+        for nome, df, cabecalho in (('CUSTOS', custos_df, COLUNAS_CUSTOS), ('ESTOQUE', estoque_df, COLUNAS_ESTOQUE)):
+            ws = wb.add_worksheet(nome)
+            ws.write_row(0, 0, cabecalho)
+            for i, linha in enumerate(_linhas_planilha(df), start=1):
+                for j, valor in enumerate(linha):
+                    if valor is None: continue
+                    if hasattr(valor, 'year'): ws.write_datetime(i, j, valor, formato_data)
+                    else: ws.write(i, j, valor)
+        wb.close()
+        return
+    wb = openpyxl.Workbook(write_only=True)
+    for nome, df, cabecalho in (('CUSTOS', custos_df, COLUNAS_CUSTOS), ('ESTOQUE', estoque_df, COLUNAS_ESTOQUE)):
+        ws = wb.create_sheet(nome)
+        ws.append(cabecalho)
+        for linha in _linhas_planilha(df): ws.append(linha)
+    wb.save(caminho)
+
+
+def gerar_conjunto(diretorio, linhas, n_skus=2000, n_contas=5, n_plataformas=6, proporcao_margem_suja=0.2, semente=0,
+                   formatos=("xlsx", "parquet"), data_referencia=DATA_REFERENCIA_PADRAO):
+    """
+    Gera (ou reaproveita, se já existirem) os arquivos de um tamanho. Acima de MAX_LINHAS_ABA a aba CUSTOS
+    é dividida em várias planilhas, cada uma com o ESTOQUE completo, como no upload de uma planilha por conta.
+    O nome dos arquivos inclui todos os parâmetros da geração, inclusive a data de referência.
+
+    Returns:
+        dict com as listas de caminhos "xlsx" e o par "parquet" (custos, estoque)
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    parametros = dict(n_skus=n_skus, n_contas=n_contas, n_plataformas=n_plataformas,
+                      proporcao_margem_suja=proporcao_margem_suja, semente=semente, data_referencia=data_referencia)
+    base = os.path.join(diretorio, f"vendas_{linhas}_s{n_skus}_c{n_contas}_p{n_plataformas}_m{proporcao_margem_suja:g}_r{semente}"
+                                   f"_d{pd.Timestamp(data_referencia):%Y%m%d}")
+    partes = -(-linhas // MAX_LINHAS_ABA)
+    caminhos = {
+        "xlsx": [f"{base}.xlsx"] if partes == 1 else [f"{base}_parte{i + 1}.xlsx" for i in range(partes)],
+        "parquet": (f"{base}_custos.parquet", f"{base}_estoque.parquet"),
+    }
+    faltando = ("xlsx" in formatos and not all(os.path.exists(c) for c in caminhos["xlsx"])) or \
+               ("parquet" in formatos and not all(os.path.exists(c) for c in caminhos["parquet"]))
+    if faltando:
+        custos_df, estoque_df = gerar_dados_sinteticos(linhas, **parametros)
+        if "parquet" in formatos:
+            custos_df.astype({c: str for c in ['MARGEM ESTRATÉGICA', 'MARGEM REAL']}).where(custos_df.notna(), None) \
+                .to_parquet(caminhos["parquet"][0], index=False)
+            estoque_df.to_parquet(caminhos["parquet"][1], index=False)
+        if "xlsx" in formatos:
+            for i, caminho in enumerate(caminhos["xlsx"]):
+                escrever_planilha(custos_df.iloc[i * MAX_LINHAS_ABA:(i + 1) * MAX_LINHAS_ABA], estoque_df, caminho)
+    return caminhos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera planilhas sintéticas de vendas (CUSTOS/ESTOQUE) e os Parquet equivalentes.")
+    parser.add_argument("--linhas", type=int, nargs="+", default=TAMANHOS_PADRAO, help="Tamanhos da aba CUSTOS")
+    parser.add_argument("--saida", default="dados_benchmark", help="Diretório de saída")
+    parser.add_argument("--skus", type=int, default=2000)
+    parser.add_argument("--contas", type=int, default=5)
+    parser.add_argument("--plataformas", type=int, default=6)
+    parser.add_argument("--margem-suja", type=float, default=0.2, help="Fração de margens fora do formato \"15,23%%\"")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--data-referencia", default=DATA_REFERENCIA_PADRAO, help="Último dia de vendas (AAAA-MM-DD)")
+    args = parser.parse_args()
+    for linhas in args.linhas:
+        caminhos = gerar_conjunto(args.saida, linhas, n_skus=args.skus, n_contas=args.contas, n_plataformas=args.plataformas,
+                                  proporcao_margem_suja=args.margem_suja, semente=args.semente, data_referencia=args.data_referencia)
+        print(f"{linhas:>10,} linhas:".replace(",", "."), ", ".join(caminhos['xlsx'] + list(caminhos['parquet'])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# --- CONFIGURAÇÕES DO HISTÓRICO DE VENDAS ---
+# As vendas acumuladas ficam em uma partição por mês (AAAA-MM). Cada upload grava apenas os meses
+# que têm dias novos ou alterados, então o custo da ingestão acompanha o tamanho da mudança
+INDICE_HISTORICO = "indice.json"
+ARQUIVO_ESTOQUE = "estoque"
+
+_trava_historico = threading.Lock()
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_DISPONIVEL = True
+except ImportError:
+    PARQUET_DISPONIVEL = False
+
+
+def _caminho(diretorio, nome_arquivo):
+    return os.path.join(diretorio, nome_arquivo)
+
+
+def _ler_indice(diretorio):
+    caminho_indice = _caminho(diretorio, INDICE_HISTORICO)
+    if not os.path.exists(caminho_indice):
+        return {}
+    try:
+        with open(caminho_indice, 'r') as f: data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _salvar_indice(diretorio, indice):
+    os.makedirs(diretorio, exist_ok=True)
+    caminho_tmp = _caminho(diretorio, INDICE_HISTORICO + ".tmp")
+    with open(caminho_tmp, 'w') as f: json.dump(indice, f, indent=4)
+    os.replace(caminho_tmp, _caminho(diretorio, INDICE_HISTORICO))
+
+
+def _gravar_frame(diretorio, df, nome_base):
+    # Parquet quando possível; colunas com tipos mistos caem para pickle (mesmo critério do cache de planilhas)
+    if PARQUET_DISPONIVEL:
+        nome_arquivo = nome_base + ".parquet"
+        df_gravar = df.copy(deep=False)
+        df_gravar.columns = [str(c) for c in df_gravar.columns]
+        try:
+            df_gravar.to_parquet(_caminho(diretorio, nome_arquivo + ".tmp"), index=False)
+            os.replace(_caminho(diretorio, nome_arquivo + ".tmp"), _caminho(diretorio, nome_arquivo))
+            return nome_arquivo
+        except Exception:
+            try: os.remove(_caminho(diretorio, nome_arquivo + ".tmp"))
+            except OSError: pass
+    nome_arquivo = nome_base + ".pkl"
+    df.to_pickle(_caminho(diretorio, nome_arquivo + ".tmp"))
+    os.replace(_caminho(diretorio, nome_arquivo + ".tmp"), _caminho(diretorio, nome_arquivo))
+    return nome_arquivo
+
+
+def _ler_frame(diretorio, nome_arquivo):
+    if nome_arquivo.endswith(".parquet"):
+        return pd.read_parquet(_caminho(diretorio, nome_arquivo))
+    return pd.read_pickle(_caminho(diretorio, nome_arquivo))
+
+
+def _substituir_arquivo(diretorio, antigo, novo):
+    # Uma partição pode trocar de formato (parquet <-> pickle); o arquivo anterior é removido
+    if antigo and antigo != novo:
+        try: os.remove(_caminho(diretorio, antigo))
+        except OSError: pass
+
+
+def _hashes_linhas(df):
+    """
+    Hash de cada linha sobre uma forma canônica das colunas, para que o mesmo conteúdo gere o mesmo
+    hash vindo do Excel, do cache em disco (texto como 'str' ou object) ou de outro modo de leitura.
+    """
+    canonico = {}
+    for col in sorted(df.columns, key=str):
+        serie = df[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            canonico[str(col)] = serie.to_numpy().astype('datetime64[ns]')
+        elif pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+            canonico[str(col)] = serie.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            canonico[str(col)] = serie.to_numpy(dtype=object, na_value=None)
+    return pd.util.hash_pandas_object(pd.DataFrame(canonico), index=False).to_numpy()
+
+
+def _hash_frame(df):
+    """Hash do conteúdo do frame, independente da ordem das linhas e sensível aos nomes das colunas."""
+    colunas = sorted(df.columns, key=str)
+    soma = int(_hashes_linhas(df).sum(dtype=np.uint64)) if len(df) else 0
+    return hashlib.sha256(f"{[str(c) for c in colunas]}|{soma}|{len(df)}".encode()).hexdigest()
+
+
+def _chaves_linhas(df, col_data, col_conta=None):
+    """
+    Chave de cada linha no índice do histórico: o dia ("AAAA-MM-DD") ou, com a coluna de conta,
+    o par dia e conta ("AAAA-MM-DD|CONTA"; conta vazia vira "").
+
+    Returns:
+        np.ndarray de objetos com uma chave por linha
+    """
+    codigos, dias = pd.factorize(pd.to_datetime(df[col_data]).dt.normalize())
+    chaves = pd.Series(np.asarray(pd.DatetimeIndex(dias).strftime('%Y-%m-%d'), dtype=object)[codigos], index=df.index, dtype=object)
+    if col_conta is not None and col_conta in df.columns:
+        contas = df[col_conta].astype(object)
+        chaves = chaves + "|" + contas.where(contas.notna(), "").astype(str)
+    return chaves.to_numpy(dtype=object)
+
+
+def _dia_da_chave(chave):
+    return chave.split("|", 1)[0]
+
+
+def _hash_por_dia(custos_df, col_data, col_conta=None):
+    """
+    Calcula um hash por dia de venda (ou por dia e conta, ver _chaves_linhas) em uma única passada vetorizada.
+
+    Returns:
+        dict {chave: {"hash": str, "linhas": int}}
+    """
+    colunas = sorted(custos_df.columns, key=str)
+    nomes_colunas = str([str(c) for c in colunas])
+    hashes_linhas = _hashes_linhas(custos_df)
+    codigos, chaves = pd.factorize(_chaves_linhas(custos_df, col_data, col_conta), sort=True)
+    ordem = np.argsort(codigos, kind='stable')
+    _, inicios, contagens = np.unique(codigos[ordem], return_index=True, return_counts=True)
+    # A soma (módulo 2^64) dos hashes das linhas não depende da ordem das linhas dentro do grupo
+    somas = np.add.reduceat(hashes_linhas[ordem], inicios) if len(ordem) else np.array([], dtype=np.uint64)
+    resultado = {}
+    for chave, soma, linhas in zip(chaves, somas, contagens):
+        resultado[chave] = {
+            "hash": hashlib.sha256(f"{nomes_colunas}|{int(soma)}|{int(linhas)}".encode()).hexdigest(),
+            "linhas": int(linhas)
+        }
+    return resultado
+
+
+def _mesclar_estoque(estoque_df, estoque_salvo):
+    """
+    Colunas vazias no ESTOQUE enviado (ex.: planilha de uma conta, sem os depósitos das outras) mantêm a
+    coluna do estoque salvo na mesma posição; as preenchidas substituem a anterior.
+    """
+    vazias = {i for i in range(min(estoque_df.shape[1], estoque_salvo.shape[1]))
+              if estoque_df.iloc[:, i].isna().all() and estoque_salvo.iloc[:, i].notna().any()}
+    if not vazias:
+        return estoque_df
+    colunas = [(estoque_salvo if i in vazias else estoque_df).iloc[:, i].reset_index(drop=True) for i in range(estoque_df.shape[1])]
+    mesclado = pd.concat(colunas, axis=1, ignore_index=True)
+    mesclado.columns = estoque_df.columns
+    return mesclado
+
+
+def incorporar_ao_historico(custos_df, estoque_df, diretorio, col_data='DIA DE VENDA', col_conta='CONTAS'):
+    """
+    Grava no histórico apenas os dias de venda novos ou alterados da planilha enviada, por conta:
+    cada par (dia, conta) do upload substitui só as linhas daquela conta naquele dia. Dias e contas
+    ausentes no upload são mantidos, então basta enviar a planilha com os dias novos, e a planilha de
+    uma conta não apaga as vendas das outras.
+    O ESTOQUE é um retrato atual: o do upload substitui o anterior, exceto as colunas que vierem
+    vazias, que mantêm as do estoque salvo (ver _mesclar_estoque).
+
+    Args:
+        custos_df: Aba CUSTOS como lida da planilha
+        estoque_df: Aba ESTOQUE como lida da planilha (None mantém o estoque salvo)
+        diretorio: Diretório do histórico
+        col_data: Coluna com a data de venda
+        col_conta: Coluna com a conta (ausente na planilha: as linhas são substituídas por dia)
+
+    Returns:
+        dict com os dias novos, alterados e inalterados, os meses regravados e a versão do histórico
+    """
+    custos_df = custos_df.assign(**{col_data: pd.to_datetime(custos_df[col_data], errors='coerce')})
+    custos_df = custos_df[custos_df[col_data].notna()]
+    col_conta = col_conta if col_conta in custos_df.columns else None
+    chaves_upload = _chaves_linhas(custos_df, col_data, col_conta)
+    hashes_upload = _hash_por_dia(custos_df, col_data, col_conta)
+
+    with _trava_historico:
+        os.makedirs(diretorio, exist_ok=True)
+        indice = _ler_indice(diretorio)
+        dias_indice = indice.setdefault("dias", {})
+        particoes = indice.setdefault("particoes", {})
+
+        chaves_afetadas = {c for c, info in hashes_upload.items() if dias_indice.get(c, {}).get("hash") != info["hash"]}
+        dias_com_vendas = {_dia_da_chave(c) for c in dias_indice}
+        dias_afetados = sorted({_dia_da_chave(c) for c in chaves_afetadas})
+        dias_novos = [d for d in dias_afetados if d not in dias_com_vendas]
+        dias_alterados = [d for d in dias_afetados if d in dias_com_vendas]
+
+        meses_gravados, linhas_gravadas = [], 0
+        if chaves_afetadas:
+            delta_df = custos_df[pd.Series(chaves_upload).isin(chaves_afetadas).to_numpy()]
+            meses_delta = delta_df[col_data].dt.strftime('%Y-%m')
+            for mes, novas_linhas in delta_df.groupby(meses_delta, sort=True):
+                entrada = particoes.get(mes)
+                if entrada is not None:
+                    existente = _ler_frame(diretorio, entrada["arquivo"])
+                    substituidas = pd.Series(_chaves_linhas(existente, col_data, col_conta)).isin(chaves_afetadas).to_numpy()
+                    particao = pd.concat([existente[~substituidas], novas_linhas], ignore_index=True)
+                else:
+                    particao = novas_linhas.reset_index(drop=True)
+                particao = particao.sort_values(col_data, kind='mergesort').reset_index(drop=True)
+                arquivo = _gravar_frame(diretorio, particao, f"vendas_{mes}")
+                _substituir_arquivo(diretorio, entrada and entrada.get("arquivo"), arquivo)
+                particoes[mes] = {
+                    "arquivo": arquivo, "linhas": int(len(particao)),
+                    "dias": int(particao[col_data].dt.normalize().nunique()),
+                    "tamanho_bytes": os.path.getsize(_caminho(diretorio, arquivo)),
+                    "atualizado_em": time.time()
+                }
+                meses_gravados.append(mes); linhas_gravadas += int(len(novas_linhas))
+            for chave in chaves_afetadas: dias_indice[chave] = hashes_upload[chave]
+            if col_conta is not None:
+                # Índices anteriores guardavam um hash por dia; as linhas desses dias seguem nas partições
+                for dia in dias_afetados: dias_indice.pop(dia, None)
+
+        estoque_atualizado = False
+        if estoque_df is not None:
+            if indice.get("estoque"):
+                estoque_df = _mesclar_estoque(estoque_df, _ler_frame(diretorio, indice["estoque"]["arquivo"]))
+            hash_estoque = _hash_frame(estoque_df)
+            if indice.get("estoque", {}).get("hash") != hash_estoque:
+                arquivo = _gravar_frame(diretorio, estoque_df, ARQUIVO_ESTOQUE)
+                _substituir_arquivo(diretorio, indice.get("estoque", {}).get("arquivo"), arquivo)
+                indice["estoque"] = {"arquivo": arquivo, "hash": hash_estoque, "atualizado_em": time.time()}
+                estoque_atualizado = True
+
+        if chaves_afetadas or estoque_atualizado or "versao" not in indice:
+            conteudo_versao = json.dumps([sorted((d, i["hash"]) for d, i in dias_indice.items()), indice.get("estoque", {}).get("hash")])
+            indice["versao"] = hashlib.sha256(conteudo_versao.encode()).hexdigest()[:16]
+        _salvar_indice(diretorio, indice)
+
+    return {
+        "dias_novos": dias_novos, "dias_alterados": dias_alterados,
+        "dias_inalterados": len({_dia_da_chave(c) for c in hashes_upload}) - len(dias_afetados),
+        "meses_gravados": meses_gravados, "linhas_gravadas": linhas_gravadas,
+        "estoque_atualizado": estoque_atualizado, "versao": indice["versao"]
+    }
+
+
+def carregar_historico(diretorio):
+    """
+    Carrega todas as partições mensais (em ordem cronológica) e o estoque salvo.
+
+    Returns:
+        tuple (custos_df, estoque_df ou None) ou None se o histórico estiver vazio
+    """
+    with _trava_historico:
+        indice = _ler_indice(diretorio)
+        particoes = indice.get("particoes", {})
+        if not particoes:
+            return None
+        custos_df = pd.concat([_ler_frame(diretorio, particoes[mes]["arquivo"]) for mes in sorted(particoes)], ignore_index=True)
+        entrada_estoque = indice.get("estoque")
+        estoque_df = _ler_frame(diretorio, entrada_estoque["arquivo"]) if entrada_estoque else None
+    return custos_df, estoque_df
+
+
+def versao_historico(diretorio):
+    """Token que muda a cada alteração do histórico (None se ainda não houver histórico)."""
+    with _trava_historico:
+        indice = _ler_indice(diretorio)
+    return indice.get("versao") if indice.get("particoes") else None
+
+
+def resumo_historico(diretorio):
+    """
+    Lista as partições mensais para exibição no painel de administração.
+
+    Returns:
+        DataFrame com uma linha por mês, do mais recente para o mais antigo
+    """
+    with _trava_historico:
+        indice = _ler_indice(diretorio)
+    linhas = [{
+        "Mês": mes,
+        "Linhas": e.get("linhas", 0),
+        "Dias": e.get("dias", 0),
+        "Formato": os.path.splitext(e["arquivo"])[1].lstrip("."),
+        "Tamanho (MB)": round(e.get("tamanho_bytes", 0) / (1024 * 1024), 2),
+        "Atualizado em": datetime.fromtimestamp(e.get("atualizado_em", 0)).strftime("%Y-%m-%d %H:%M:%S"),
+    } for mes, e in sorted(indice.get("particoes", {}).items(), reverse=True)]
+    return pd.DataFrame(linhas, columns=["Mês", "Linhas", "Dias", "Formato", "Tamanho (MB)", "Atualizado em"])
+
+
+def limpar_historico(diretorio):
+    """Remove todas as partições, o estoque e o índice do histórico."""
+    with _trava_historico:
+        indice = _ler_indice(diretorio)
+        arquivos = [e["arquivo"] for e in indice.get("particoes", {}).values()]
+        if indice.get("estoque"): arquivos.append(indice["estoque"]["arquivo"])
+        for nome_arquivo in arquivos + [INDICE_HISTORICO]:
+            try: os.remove(_caminho(diretorio, nome_arquivo))
+            except OSError: pass
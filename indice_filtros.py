@@ -0,0 +1,193 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from processar_planilha_otimizado_melhorado import posicoes_periodo_ordenado, indexar_dias, COLUNAS_FILTRO
+
+# --- ÍNDICE DE FILTROS POR BITMAP ---
+# Para cada dimensão filtrável (conta, tipo de venda, plataforma e tipo de anúncio) o índice guarda
+# um bitmap por valor, com 1 bit por linha (np.packbits). Uma combinação de filtros vira um AND entre
+# os bitmaps, restrito aos bytes do período (o dataset é ordenado por data), seguido de um único take:
+# nenhum DataFrame intermediário é criado, qualquer que seja o número de filtros ativos.
+# O índice também guarda onde começa cada dia (indexar_dias): o período é localizado por busca binária
+# sobre os dias distintos. É montado uma vez por versão do dataset e compartilhado entre as sessões; os recortes
+# resultantes (período + filtros) ficam em um LRU pequeno, também compartilhado, guardados como posições de linhas
+# (int32) e não como cópias do DataFrame (ver obter_recorte)
+VALORES_SEM_FILTRO = (None, "Todos", "Todas")
+MAX_RECORTES = int(os.environ.get("VIAFLIX_MAX_RECORTES", "16"))  # Recortes filtrados mantidos (LRU, compartilhados entre sessões)
+COL_DATA = 'DIA DE VENDA'
+
+_recortes = OrderedDict()  # (versão do dataset, filtros) -> RecorteFiltrado
+_trava_recortes = threading.Lock()
+
+
+class IndiceFiltros:
+    """
+    Bitmaps por valor das colunas de filtro de um dataset. As posições valem para qualquer
+    DataFrame com as mesmas linhas na mesma ordem (ex.: o dataset com outro tipo de margem).
+    """
+
+    def __init__(self, df, colunas_filtro=None):
+        self.linhas = len(df)
+        self.indice_dias = indexar_dias(df, COL_DATA) if COL_DATA in df.columns else None
+        self.bitmaps = {}
+        for chave, coluna in (colunas_filtro or COLUNAS_FILTRO).items():
+            if coluna not in df.columns: continue
+            serie = df[coluna]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                codigos, valores = serie.cat.codes.to_numpy(), list(serie.cat.categories)
+            else:
+                codigos, valores = pd.factorize(serie)
+                valores = list(valores)
+            self.bitmaps[chave] = {valor: np.packbits(codigos == i) for i, valor in enumerate(valores)}
+
+    @property
+    def tamanho_bytes(self):
+        bytes_dias = sum(a.nbytes for a in self.indice_dias) if self.indice_dias is not None else 0
+        return bytes_dias + sum(bitmap.nbytes for por_valor in self.bitmaps.values() for bitmap in por_valor.values())
+
+    def posicoes(self, filtros, inicio=0, fim=None):
+        """
+        Linhas que atendem a todos os filtros dentro de [inicio, fim).
+
+        Args:
+            filtros: dict com conta, tipo_venda, plataforma e/ou tipo_anuncio ("Todos"/"Todas"/None não filtram;
+                outras chaves, como as datas, são ignoradas)
+            inicio, fim: Intervalo de linhas (o recorte do período no dataset ordenado)
+
+        Returns:
+            np.ndarray com as posições (int64) ou None se nenhum filtro estiver ativo (o intervalo inteiro)
+        """
+        fim = self.linhas if fim is None else fim
+        byte_inicio, byte_fim = inicio // 8, -(-fim // 8)
+        combinado = self._combinar(filtros, byte_inicio, byte_fim)
+        if combinado is None:
+            return None
+        bits = np.unpackbits(combinado, count=fim - byte_inicio * 8)[inicio - byte_inicio * 8:]
+        return np.flatnonzero(bits) + inicio
+
+    def _combinar(self, filtros, byte_inicio=0, byte_fim=None):
+        # AND dos bitmaps dos filtros ativos nos bytes [byte_inicio, byte_fim); None se nenhum filtro estiver ativo
+        combinado = None
+        for chave, valor in filtros.items():
+            # Coluna ausente no dataset não filtra, como no encadeamento de filtros anterior
+            if chave not in self.bitmaps or valor in VALORES_SEM_FILTRO: continue
+            bitmap = self.bitmaps[chave].get(valor)
+            if bitmap is None: return np.zeros(len(range(-(-self.linhas // 8))[byte_inicio:byte_fim]), dtype=np.uint8)  # Valor inexistente: nenhuma linha
+            trecho = bitmap[byte_inicio:byte_fim]
+            if combinado is None: combinado = trecho.copy()
+            else: np.bitwise_and(combinado, trecho, out=combinado)
+        return combinado
+
+    def valores(self, chave, filtros=None):
+        """
+        Valores da dimensão presentes no dataset, em ordem; com filtros, só os que têm alguma linha
+        que os atenda (ex.: tipos de anúncio do Mercado Livre). Alimenta as opções da barra lateral.
+        """
+        combinado = self._combinar(filtros or {})
+        return [valor for valor, bitmap in self.bitmaps.get(chave, {}).items()
+                if (bitmap.any() if combinado is None else np.bitwise_and(bitmap, combinado).any())]
+
+    def filtrar(self, df, filtros, inicio=0, fim=None):
+        """
+        Recorte de df pelos filtros, com um único take (sem filtros ativos, a fatia [inicio, fim) sem cópia).
+        """
+        posicoes = self.posicoes(filtros, inicio, fim)
+        if posicoes is None:
+            return df.iloc[inicio:fim]
+        return df.take(posicoes)
+
+
+# st.cache_resource: o mesmo índice para todas as sessões. A chave é a versão do dataset; o DataFrame (_df) não é hasheado
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _indice_compartilhado(versao, _df):
+    return IndiceFiltros(_df)
+
+
+def obter_indice_filtros(df):
+    """
+    Índice de filtros da versão do dataset (montado na primeira chamada). A versão base é usada
+    porque trocar o tipo de margem não muda as linhas. Sem versão, o índice é montado sem cache.
+
+    Returns:
+        IndiceFiltros
+    """
+    versao = df.attrs.get('versao_base') or df.attrs.get('versao')
+    if not versao:
+        return IndiceFiltros(df)
+    return _indice_compartilhado(versao, df)
+
+
+class RecorteFiltrado:
+    """
+    Recorte (período + filtros) de uma versão do dataset. Guarda só o intervalo do período e as posições
+    das linhas filtradas (int32); as visões são montadas a cada acesso e tratadas como somente leitura:
+    por_data é uma fatia do dataset (sem cópia) e filtrado vem de um único take. Resultados derivados
+    do recorte (ex.: a tabela de produtos) são calculados uma vez e reaproveitados nas próximas execuções.
+    """
+
+    def __init__(self, df, inicio, fim, posicoes):
+        self._df = df
+        self.inicio, self.fim = inicio, fim
+        # None: nenhum filtro ativo além do período (filtrado é a própria fatia)
+        self.posicoes = None if posicoes is None else posicoes.astype(np.int32 if len(df) <= np.iinfo(np.int32).max else np.int64)
+        self._derivados = {}
+        self._trava = threading.Lock()
+
+    @property
+    def por_data(self):
+        return self._df.iloc[self.inicio:self.fim]
+
+    @property
+    def filtrado(self):
+        if self.posicoes is None:
+            return self.por_data
+        return self._df.take(self.posicoes)
+
+    def derivado(self, nome, funcao):
+        with self._trava:
+            if nome not in self._derivados: self._derivados[nome] = funcao()
+            return self._derivados[nome]
+
+
+def _montar_recorte(df, filtros):
+    indice = obter_indice_filtros(df)
+    if filtros.get("data_inicio") is not None and filtros.get("data_fim") is not None:
+        inicio, fim = posicoes_periodo_ordenado(df, filtros["data_inicio"], filtros["data_fim"], COL_DATA, indice.indice_dias)
+    else:
+        inicio, fim = 0, len(df)
+    return RecorteFiltrado(df, inicio, fim, indice.posicoes(filtros, inicio, fim))
+
+
+def obter_recorte(df, filtros):
+    """
+    Recorte do dataset para os filtros do painel, guardado em um LRU pequeno por (versão do dataset, filtros):
+    uma nova execução do script com os mesmos filtros (ex.: digitação em uma busca) não refaz a busca do
+    período nem o AND dos bitmaps, só o take das posições guardadas. A versão inclui o tipo de margem;
+    sem versão, o recorte não é guardado.
+
+    Args:
+        df: Dataset processado (ordenado por data)
+        filtros: dict de montar_filtros_painel (data_inicio, data_fim, conta, tipo_venda, plataforma, tipo_anuncio)
+
+    Returns:
+        RecorteFiltrado
+    """
+    versao = df.attrs.get('versao')
+    if not versao:
+        return _montar_recorte(df, filtros)
+    chave = (versao, tuple(sorted(filtros.items())))
+    with _trava_recortes:
+        recorte = _recortes.get(chave)
+        if recorte is not None:
+            _recortes.move_to_end(chave); return recorte
+    recorte = _montar_recorte(df, filtros)
+    with _trava_recortes:
+        recorte = _recortes.setdefault(chave, recorte)  # Outra sessão pode ter montado o mesmo recorte ao mesmo tempo
+        _recortes.move_to_end(chave)
+        while len(_recortes) > MAX_RECORTES: _recortes.popitem(last=False)
+    return recorte
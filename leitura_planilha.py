@@ -0,0 +1,482 @@
+import io
+import os
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import openpyxl
+
+try:
+    import pyarrow as pa
+    ARROW_DISPONIVEL = True
+except ImportError:
+    ARROW_DISPONIVEL = False
+
+# O modo paralelo pula as linhas anteriores a cada fatia com o parser interno do openpyxl, que não faz
+# parte da API pública; sem ele (ou com uma versão que mudou essas peças) a fatia é lida pelo iter_rows
+try:
+    from openpyxl.worksheet._reader import WorkSheetParser, ROW_TAG
+    from openpyxl.xml.functions import iterparse as iterparse_openpyxl
+    PARSER_OPENPYXL_DISPONIVEL = True
+except ImportError:
+    PARSER_OPENPYXL_DISPONIVEL = False
+
+# --- CONFIGURAÇÕES DE LEITURA ---
+TAMANHO_BLOCO_PADRAO = 50000  # Linhas convertidas por bloco na leitura em streaming
+MODOS_LEITURA = ["padrao", "streaming", "paralelo"]
+# Leitura paralela: tamanho do pool (0 = número de CPUs) e linhas por fatia da aba CUSTOS
+PROCESSOS_LEITURA = int(os.environ.get("VIAFLIX_PROCESSOS_LEITURA", "0"))
+LINHAS_POR_FATIA = int(os.environ.get("VIAFLIX_LINHAS_POR_FATIA", "200000"))
+
+
+def _texto_celula(valor):
+    # Mesma conversão do pd.read_excel(dtype=str): vazio vira NaN e float inteiro vira inteiro
+    if valor is None: return np.nan
+    if isinstance(valor, float):
+        if valor != valor: return np.nan
+        if valor.is_integer(): return str(int(valor))
+    return str(valor)
+
+
+def _converter_bloco(valores, tipo):
+    """
+    Converte os valores brutos de uma coluna (lista do bloco) em um array tipado.
+    """
+    if tipo == "texto":
+        return np.array([_texto_celula(v) for v in valores], dtype=object)
+    if tipo == "numero":
+        return pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    if tipo == "data":
+        return pd.to_datetime(pd.Series(valores, dtype=object), errors='coerce').to_numpy()
+    return np.array([np.nan if v is None else v for v in valores], dtype=object)
+
+
+def _montar_coluna(blocos, tipo, n_linhas):
+    # Junta os blocos de uma coluna; números inteiros sem vazios voltam a ser int64 (como no pd.read_excel)
+    if not blocos:
+        return np.array([], dtype='float64' if tipo == "numero" else object)
+    coluna = np.concatenate(blocos)[:n_linhas]
+    if tipo == "numero" and len(coluna) and not np.isnan(coluna).any() and np.all(np.mod(coluna, 1) == 0):
+        return coluna.astype('int64')
+    if tipo is None:
+        # Colunas sem tipo declarado seguem a inferência do pd.read_excel sobre a coluna inteira:
+        # inteiros e decimais misturados viram float64, só inteiros int64, textos str; tipos mistos ficam object
+        return pd.Series(coluna, dtype=object).infer_objects().to_numpy()
+    return coluna
+
+
+def listar_abas(conteudo):
+    """Retorna os nomes das abas sem carregar as células (modo somente leitura)."""
+    wb = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True)
+    try: return list(wb.sheetnames)
+    finally: wb.close()
+
+
+# --- SONDAGEM DO CABEÇALHO ---
+# Lê só a primeira linha de cada aba direto do XML do .xlsx. O load_workbook(read_only=True) carrega
+# a tabela inteira de textos compartilhados ao abrir, o que leva segundos em planilhas grandes;
+# aqui só os textos usados no cabeçalho são percorridos
+
+NS_PLANILHA = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_RELACOES = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def _indice_coluna(referencia):
+    # "K1" -> 10
+    indice = 0
+    for letra in referencia:
+        if not letra.isalpha(): break
+        indice = indice * 26 + (ord(letra.upper()) - 64)
+    return indice - 1
+
+
+def _caminhos_abas(zf):
+    relacoes = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    alvos = {rel.get("Id"): rel.get("Target") for rel in relacoes}
+    tipos = {rel.get("Target"): rel.get("Type", "") for rel in relacoes}
+    caminhos = {}
+    for aba in ET.fromstring(zf.read("xl/workbook.xml")).iter(NS_PLANILHA + "sheet"):
+        alvo = alvos.get(aba.get(NS_RELACOES + "id"))
+        if alvo: caminhos[aba.get("name")] = alvo.lstrip("/") if alvo.startswith("/") else "xl/" + alvo
+    textos = next((alvo for alvo, tipo in tipos.items() if tipo.endswith("/sharedStrings")), None)
+    caminho_textos = None if textos is None else (textos.lstrip("/") if textos.startswith("/") else "xl/" + textos)
+    return caminhos, caminho_textos
+
+
+def _textos_compartilhados(zf, caminho, indices):
+    # Percorre a tabela de textos só até o maior índice usado no cabeçalho
+    textos, maior, atual = {}, max(indices), 0
+    with zf.open(caminho) as fonte:
+        for _, elemento in ET.iterparse(fonte):
+            if elemento.tag != NS_PLANILHA + "si": continue
+            if atual in indices:
+                textos[atual] = "".join(t.text or "" for t in elemento.iter(NS_PLANILHA + "t"))
+            elemento.clear()
+            atual += 1
+            if atual > maior: break
+    return textos
+
+
+def _primeira_linha(zf, caminho):
+    # Retorna ({posição: (tipo, valor bruto)}, número de colunas declarado em <dimension>)
+    celulas, n_colunas = {}, 0
+    with zf.open(caminho) as fonte:
+        for _, elemento in ET.iterparse(fonte):
+            if elemento.tag == NS_PLANILHA + "dimension":
+                n_colunas = _indice_coluna(elemento.get("ref", "A1").split(":")[-1]) + 1
+            elif elemento.tag == NS_PLANILHA + "c":
+                tipo = elemento.get("t")
+                if tipo == "inlineStr": valor = "".join(t.text or "" for t in elemento.iter(NS_PLANILHA + "t"))
+                else: valor = elemento.findtext(NS_PLANILHA + "v")
+                if valor is not None: celulas[_indice_coluna(elemento.get("r", "A"))] = (tipo, valor)
+            elif elemento.tag == NS_PLANILHA + "row":
+                break
+    return celulas, n_colunas
+
+
+def ler_cabecalhos(conteudo, abas, abas_com_textos=None):
+    """
+    Lê apenas o cabeçalho (primeira linha) das abas indicadas, sem abrir a planilha inteira.
+
+    Args:
+        conteudo: bytes do arquivo .xlsx
+        abas: Lista de nomes de abas
+        abas_com_textos: Abas cujos textos compartilhados são resolvidos (None para todas). Nas demais
+            esses textos ficam None; serve para abas em que só a posição das colunas importa (ESTOQUE),
+            cujos textos costumam estar no fim da tabela compartilhada
+
+    Returns:
+        dict {nome_aba: (cabeçalho como tupla, número de colunas da aba) ou None se a aba não existir}
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+            caminhos, caminho_textos = _caminhos_abas(zf)
+            linhas = {aba: _primeira_linha(zf, caminhos[aba]) for aba in abas if aba in caminhos}
+            indices = {int(valor) for aba, (celulas, _) in linhas.items() for tipo, valor in celulas.values()
+                       if tipo == "s" and (abas_com_textos is None or aba in abas_com_textos)}
+            textos = _textos_compartilhados(zf, caminho_textos, indices) if indices and caminho_textos else {}
+    except (KeyError, ValueError, zipfile.BadZipFile, ET.ParseError):
+        return _ler_cabecalhos_openpyxl(conteudo, abas)
+
+    resultado = {}
+    for aba in abas:
+        if aba not in linhas:
+            resultado[aba] = None; continue
+        celulas, n_colunas = linhas[aba]
+        cabecalho = [None] * (max(celulas) + 1 if celulas else 0)
+        for pos, (tipo, valor) in celulas.items():
+            if tipo == "s": cabecalho[pos] = textos.get(int(valor))
+            elif tipo in ("inlineStr", "str", "e"): cabecalho[pos] = valor or None
+            elif tipo == "b": cabecalho[pos] = valor == "1"
+            else:
+                numero = float(valor)
+                cabecalho[pos] = int(numero) if numero.is_integer() else numero
+        resultado[aba] = (tuple(cabecalho), max(n_colunas, len(cabecalho)))
+    return resultado
+
+
+def _ler_cabecalhos_openpyxl(conteudo, abas):
+    # Alternativa para arquivos fora do layout usual do Excel
+    wb = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True)
+    try:
+        resultado = {}
+        for aba in abas:
+            if aba not in wb.sheetnames:
+                resultado[aba] = None; continue
+            ws = wb[aba]
+            cabecalho = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), None) or ()
+            resultado[aba] = (tuple(cabecalho), max(ws.max_column or 0, len(cabecalho)))
+        return resultado
+    finally:
+        wb.close()
+
+
+def _selecionar_colunas(cabecalho, colunas, tipos):
+    # Posições das colunas pedidas (primeira ocorrência de cada nome) e o tipo de conversão de cada uma
+    nomes_saida, posicoes = [], []
+    for pos, nome in enumerate(cabecalho):
+        nome_col = nome if nome is not None else f"Unnamed: {pos}"
+        if colunas is not None and (nome_col not in colunas or nome_col in nomes_saida): continue
+        nomes_saida.append(nome_col); posicoes.append(pos)
+    tipos_col = [tipos.get(nome, tipos.get(pos)) for nome, pos in zip(nomes_saida, posicoes)]
+    return nomes_saida, posicoes, tipos_col
+
+
+def _converter_linhas(linhas, posicoes, tipos_col, tamanho_bloco, callback_progresso=None, total_estimado=None):
+    """
+    Converte as linhas (tuplas de valores) em blocos tipados por coluna.
+
+    Returns:
+        tuple (blocos por coluna, linhas_lidas, última linha preenchida relativa ao início)
+    """
+    blocos = [[] for _ in posicoes]
+    linhas_lidas, inicio = 0, time.perf_counter()
+    ultima_linha_preenchida = 0
+
+    def _descarregar(buffer):
+        for i, (pos, tipo) in enumerate(zip(posicoes, tipos_col)):
+            blocos[i].append(_converter_bloco([linha[pos] if pos < len(linha) else None for linha in buffer], tipo))
+
+    buffer = []
+    for linha in linhas:
+        buffer.append(linha)
+        linhas_lidas += 1
+        if any(v is not None for v in linha): ultima_linha_preenchida = linhas_lidas
+        if len(buffer) >= tamanho_bloco:
+            _descarregar(buffer); buffer = []
+            if callback_progresso:
+                decorrido = time.perf_counter() - inicio
+                callback_progresso(linhas_lidas, total_estimado, linhas_lidas / decorrido if decorrido > 0 else 0.0)
+    if buffer: _descarregar(buffer)
+    return blocos, linhas_lidas, ultima_linha_preenchida
+
+
+def _montar_frame(nomes_saida, blocos, tipos_col, n_linhas):
+    # Linhas vazias no final da aba são descartadas, como no pd.read_excel
+    dados = {}
+    for nome, bloco, tipo in zip(nomes_saida, blocos, tipos_col):
+        dados[nome] = _montar_coluna(bloco, tipo, n_linhas)
+        bloco.clear()
+    return pd.DataFrame(dados, columns=nomes_saida)
+
+
+def ler_aba_streaming(conteudo, nome_aba, colunas=None, tipos=None, tamanho_bloco=TAMANHO_BLOCO_PADRAO, callback_progresso=None):
+    """
+    Lê uma aba da planilha em modo somente leitura (openpyxl read_only), convertendo as linhas
+    em arrays tipados por coluna a cada bloco. O pico de memória fica proporcional ao tamanho
+    do bloco mais as colunas finais, em vez do modelo completo de células do openpyxl.
+
+    Args:
+        conteudo: bytes do arquivo .xlsx
+        nome_aba: Nome da aba a ser lida
+        colunas: Lista de nomes de colunas a manter (None para todas)
+        tipos: Dicionário {nome ou posição da coluna: "texto" | "numero" | "data"}
+        tamanho_bloco: Quantidade de linhas convertidas por bloco
+        callback_progresso: Função chamada a cada bloco com (linhas_lidas, total_estimado, linhas_por_segundo)
+
+    Returns:
+        DataFrame com as colunas selecionadas
+    """
+    tipos = tipos or {}
+    wb = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        ws = wb[nome_aba]
+        total_estimado = ws.max_row - 1 if ws.max_row else None
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None) or ()
+        nomes_saida, posicoes, tipos_col = _selecionar_colunas(cabecalho, colunas, tipos)
+
+        inicio = time.perf_counter()
+        blocos, linhas_lidas, ultima_linha_preenchida = _converter_linhas(
+            linhas, posicoes, tipos_col, tamanho_bloco, callback_progresso, total_estimado)
+        if callback_progresso:
+            decorrido = time.perf_counter() - inicio
+            callback_progresso(linhas_lidas, linhas_lidas, linhas_lidas / decorrido if decorrido > 0 else 0.0)
+    finally:
+        wb.close()
+
+    return _montar_frame(nomes_saida, blocos, tipos_col, ultima_linha_preenchida)
+
+
+# --- LEITURA PARALELA (PROCESSOS) ---
+# As abas CUSTOS e ESTOQUE são lidas em processos separados e a aba CUSTOS grande é dividida em
+# fatias de linhas. Cada processo devolve colunas já tipadas (Arrow IPC quando o pyarrow existe);
+# o processo principal junta as fatias na ordem, então o resultado é idêntico ao do modo streaming.
+
+def _parser_openpyxl_compativel(ws):
+    # Confere as peças internas usadas por _iterar_linhas_intervalo antes de depender delas
+    wb = ws.parent
+    return (PARSER_OPENPYXL_DISPONIVEL and hasattr(WorkSheetParser, "parse_row")
+            and all(hasattr(ws, nome) for nome in ("_get_source", "_shared_strings"))
+            and all(hasattr(wb, nome) for nome in ("epoch", "_date_formats", "_timedelta_formats")))
+
+
+def _iterar_linhas_intervalo(ws, linha_inicial, linha_final=None):
+    """
+    Gera as linhas [linha_inicial, linha_final] de uma aba read_only como tuplas de valores.
+    As linhas anteriores são apenas percorridas no XML, sem converter as células, o que torna
+    barato começar uma fatia no meio da aba. Linhas ausentes no XML viram tuplas vazias, como no iter_rows.
+    Sem o parser interno do openpyxl, usa ws.iter_rows (mesmas linhas, mas converte as anteriores à fatia).
+    """
+    parser = None
+    if _parser_openpyxl_compativel(ws):
+        wb = ws.parent
+        try:
+            parser = WorkSheetParser(None, ws._shared_strings, data_only=wb.data_only, epoch=wb.epoch,
+                                     date_formats=wb._date_formats, timedelta_formats=wb._timedelta_formats)
+        except TypeError:  # Assinatura diferente nesta versão do openpyxl
+            parser = None
+    if parser is None:
+        yield from ws.iter_rows(min_row=linha_inicial, max_row=linha_final, values_only=True)
+        return
+
+    with ws._get_source() as src:
+        parser.source = src
+        proxima = linha_inicial
+        for _, elemento in iterparse_openpyxl(src):
+            if elemento.tag != ROW_TAG: continue
+            r = elemento.get('r')
+            idx = int(float(r)) if r is not None else parser.row_counter + 1
+            if idx < linha_inicial:
+                parser.row_counter = idx
+                elemento.clear(); continue
+            if linha_final is not None and idx > linha_final:
+                for _ in range(proxima, linha_final + 1): yield ()
+                return
+            idx, celulas = parser.parse_row(elemento)
+            elemento.clear()
+            for _ in range(proxima, idx): yield ()
+            valores = [None] * max((c['column'] for c in celulas), default=0)
+            for celula in celulas: valores[celula['column'] - 1] = celula['value']
+            proxima = idx + 1
+            yield tuple(valores)
+
+
+def _serializar_colunas(colunas, tipos_col):
+    # Colunas tipadas vão em Arrow IPC; colunas brutas (tipos mistos) seguem como arrays de objetos
+    if not ARROW_DISPONIVEL:
+        return None, dict(enumerate(colunas))
+    # Os campos usam a posição da coluna, pois o cabeçalho pode ter nomes repetidos ou não textuais
+    campos, arrays, brutas = [], [], {}
+    for i, (coluna, tipo) in enumerate(zip(colunas, tipos_col)):
+        if tipo in ("texto", "numero", "data"):
+            campos.append(str(i)); arrays.append(pa.array(coluna, from_pandas=(tipo == "texto")))
+        else:
+            brutas[i] = coluna
+    tabela = pa.Table.from_arrays(arrays, names=campos)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabela.schema) as escritor: escritor.write_table(tabela)
+    return sink.getvalue().to_pybytes(), brutas
+
+
+def _desserializar_colunas(tipos_col, pacote_arrow, brutas):
+    if pacote_arrow is None:
+        return [brutas[i] for i in range(len(tipos_col))]
+    tabela = pa.ipc.open_stream(pacote_arrow).read_all()
+    colunas = []
+    for i, tipo in enumerate(tipos_col):
+        if tipo not in ("texto", "numero", "data"):
+            colunas.append(brutas[i]); continue
+        coluna = tabela.column(str(i)).to_numpy(zero_copy_only=False)
+        if tipo == "texto":
+            coluna = coluna.astype(object)
+            coluna[pd.isna(coluna)] = np.nan  # nulos do Arrow voltam como None; o streaming usa NaN
+        colunas.append(coluna)
+    return colunas
+
+
+def _ler_fatia_processo(conteudo, nome_aba, nomes_saida, posicoes, tipos_col, linha_inicial, linha_final, tamanho_bloco):
+    """
+    Executada no processo de leitura: converte uma fatia de linhas e devolve as colunas serializadas.
+    Os blocos não são convertidos para int64 aqui; isso é decidido sobre a coluna completa no processo principal.
+    """
+    wb = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        linhas = _iterar_linhas_intervalo(wb[nome_aba], linha_inicial, linha_final)
+        blocos, linhas_lidas, ultima_linha_preenchida = _converter_linhas(linhas, posicoes, tipos_col, tamanho_bloco)
+    finally:
+        wb.close()
+    colunas = [np.concatenate(b) if b else np.array([], dtype='float64' if t == "numero" else object)
+               for b, t in zip(blocos, tipos_col)]
+    pacote_arrow, brutas = _serializar_colunas(colunas, tipos_col)
+    return pacote_arrow, brutas, linhas_lidas, ultima_linha_preenchida
+
+
+def _planejar_fatias(conteudo, nome_aba, colunas, tipos, linhas_por_fatia, tamanho_bloco):
+    # Lê só o cabeçalho e a dimensão declarada da aba para dividir as linhas em fatias alinhadas aos blocos
+    wb = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        ws = wb[nome_aba]
+        cabecalho = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), None) or ()
+        total_estimado = ws.max_row - 1 if ws.max_row else None
+    finally:
+        wb.close()
+    nomes_saida, posicoes, tipos_col = _selecionar_colunas(cabecalho, colunas, tipos or {})
+
+    # Fatias múltiplas do tamanho do bloco mantêm as mesmas fronteiras de conversão do modo streaming
+    linhas_por_fatia = max(tamanho_bloco, -(-linhas_por_fatia // tamanho_bloco) * tamanho_bloco)
+    fatias = []
+    if linhas_por_fatia and total_estimado and total_estimado > linhas_por_fatia:
+        for inicio in range(2, total_estimado + 2, linhas_por_fatia):
+            fatias.append((inicio, inicio + linhas_por_fatia - 1))
+        fatias[-1] = (fatias[-1][0], None)  # a última fatia vai até o fim real da aba
+    else:
+        fatias.append((2, None))
+    return nomes_saida, posicoes, tipos_col, fatias, total_estimado
+
+
+def ler_abas_paralelo(conteudo, abas, max_processos=None, linhas_por_fatia=None,
+                      tamanho_bloco=TAMANHO_BLOCO_PADRAO, callback_progresso=None, aba_progresso=None):
+    """
+    Lê várias abas da planilha em paralelo com um ProcessPoolExecutor, dividindo abas grandes
+    em fatias de linhas. O resultado de cada aba é idêntico ao de ler_aba_streaming.
+
+    Args:
+        conteudo: bytes do arquivo .xlsx
+        abas: Dicionário {nome_aba: {"colunas": [...], "tipos": {...}}}
+        max_processos: Tamanho do pool (None usa PROCESSOS_LEITURA ou o número de CPUs)
+        linhas_por_fatia: Linhas por fatia (None usa LINHAS_POR_FATIA)
+        tamanho_bloco: Quantidade de linhas convertidas por bloco
+        callback_progresso: Função chamada a cada fatia concluída com (linhas_lidas, total_estimado, linhas_por_segundo)
+        aba_progresso: Aba cujo avanço é reportado (None para todas)
+
+    Returns:
+        dict {nome_aba: DataFrame ou a exceção levantada na leitura daquela aba}
+    """
+    linhas_por_fatia = linhas_por_fatia or LINHAS_POR_FATIA
+    max_processos = max_processos or PROCESSOS_LEITURA or os.cpu_count() or 1
+    resultados, planos, tarefas = {}, {}, []
+    for nome_aba, opcoes in abas.items():
+        try:
+            planos[nome_aba] = _planejar_fatias(conteudo, nome_aba, opcoes.get("colunas"), opcoes.get("tipos"),
+                                                linhas_por_fatia, tamanho_bloco)
+        except Exception as e:
+            resultados[nome_aba] = e; continue
+        nomes_saida, posicoes, tipos_col, fatias, _ = planos[nome_aba]
+        for i, (linha_inicial, linha_final) in enumerate(fatias):
+            tarefas.append((nome_aba, i, (conteudo, nome_aba, nomes_saida, posicoes, tipos_col, linha_inicial, linha_final, tamanho_bloco)))
+
+    partes = {nome_aba: [None] * len(plano[3]) for nome_aba, plano in planos.items()}
+    total_progresso = sum((plano[4] or 0) for nome_aba, plano in planos.items() if aba_progresso in (None, nome_aba))
+    linhas_concluidas, inicio = 0, time.perf_counter()
+
+    def _registrar(nome_aba, i, parte):
+        nonlocal linhas_concluidas
+        partes[nome_aba][i] = parte
+        if callback_progresso and aba_progresso in (None, nome_aba) and not isinstance(parte, Exception):
+            linhas_concluidas += parte[2]
+            decorrido = time.perf_counter() - inicio
+            callback_progresso(linhas_concluidas, max(total_progresso, linhas_concluidas),
+                               linhas_concluidas / decorrido if decorrido > 0 else 0.0)
+
+    n_processos = min(max_processos, len(tarefas))
+    if n_processos <= 1:
+        # Sem ganho com processos: lê as fatias no próprio processo
+        for nome_aba, i, argumentos in tarefas:
+            try: _registrar(nome_aba, i, _ler_fatia_processo(*argumentos))
+            except Exception as e: _registrar(nome_aba, i, e)
+    else:
+        with ProcessPoolExecutor(max_workers=n_processos) as executor:
+            futuros = {executor.submit(_ler_fatia_processo, *argumentos): (nome_aba, i) for nome_aba, i, argumentos in tarefas}
+            for futuro in as_completed(futuros):
+                nome_aba, i = futuros[futuro]
+                try: _registrar(nome_aba, i, futuro.result())
+                except Exception as e: _registrar(nome_aba, i, e)
+
+    # Juntar as fatias na ordem e descartar as linhas vazias do final da aba
+    for nome_aba, (nomes_saida, _, tipos_col, _, _) in planos.items():
+        erro = next((p for p in partes[nome_aba] if isinstance(p, Exception)), None)
+        if erro is not None:
+            resultados[nome_aba] = erro; continue
+        blocos = [[] for _ in nomes_saida]
+        deslocamento, ultima_linha_preenchida = 0, 0
+        for pacote_arrow, brutas, linhas_lidas, ultima_fatia in partes[nome_aba]:
+            for i, coluna in enumerate(_desserializar_colunas(tipos_col, pacote_arrow, brutas)):
+                blocos[i].append(coluna)
+            if ultima_fatia: ultima_linha_preenchida = deslocamento + ultima_fatia
+            deslocamento += linhas_lidas
+        resultados[nome_aba] = _montar_frame(nomes_saida, blocos, tipos_col, ultima_linha_preenchida)
+    return {nome_aba: resultados[nome_aba] for nome_aba in abas}
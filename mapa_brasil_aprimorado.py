@@ -7,13 +7,15 @@ import numpy as np
 from datetime import datetime
 import random
 
-def criar_mapa_brasil_interativo(df):
+def criar_mapa_brasil_interativo(df, vendas_por_estado=None):
     """
     Cria um mapa interativo do Brasil com dados de vendas por estado.
     Versão aprimorada com visual moderno e futurista.
     
     Args:
         df: DataFrame com os dados de vendas
+        vendas_por_estado: Faturamento por sigla de estado já agregado (ex.: pelo cubo diário); se
+            informado, df não é agregado
         
     Returns:
         figura: Objeto de figura Plotly com o mapa interativo
@@ -70,12 +72,15 @@ def criar_mapa_brasil_interativo(df):
         
         # Verificar se temos dados reais ou precisamos simular
         tem_dados_reais = False
-        if df is not None and not df.empty:
+        if vendas_por_estado is not None:
+            tem_dados_reais = len(vendas_por_estado) > 0
+            vendas_por_estado_dict = dict(vendas_por_estado.items())
+        elif df is not None and not df.empty:
             # Verificar se temos coluna de estado
             if 'Estado' in df.columns and COL_VALOR_PEDIDO_CUSTOS in df.columns:
                 tem_dados_reais = True
                 # Agrupar vendas por estado
-                vendas_por_estado = df.groupby('Estado')[COL_VALOR_PEDIDO_CUSTOS].sum().reset_index()
+                vendas_por_estado = df.groupby('Estado', observed=True)[COL_VALOR_PEDIDO_CUSTOS].sum().reset_index()
                 vendas_por_estado_dict = dict(zip(vendas_por_estado['Estado'], vendas_por_estado[COL_VALOR_PEDIDO_CUSTOS]))
         
         # Preparar dados para cada estado
@@ -0,0 +1,170 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from tarefas_ingestao import TarefaCancelada
+
+# --- MÉTRICAS DAS CARGAS DE PLANILHAS ---
+# O processamento informa o início de cada etapa (validação, leitura, conversão, margens, estoque,
+# derivação...) com o número de linhas naquele ponto. Cada carga vira um registro com a duração e
+# as linhas de cada etapa, guardado em um buffer circular do processo (as cargas mais antigas saem
+# sozinhas) e exibido na aba de Logs do painel de administração
+MAX_CARGAS_METRICAS = int(os.environ.get("VIAFLIX_METRICAS_MAX_CARGAS", "100"))
+
+_cargas = deque(maxlen=MAX_CARGAS_METRICAS)
+_trava_cargas = threading.Lock()
+_medicao_thread = threading.local()
+_contador_cargas = itertools.count(1)
+
+
+class _MedicaoCarga:
+    def __init__(self, descricao, modo, arquivos):
+        self.registro = {"id": next(_contador_cargas), "inicio": datetime.now(), "descricao": descricao,
+                         "modo": modo, "arquivos": arquivos, "estado": None, "erro": None,
+                         "total_s": None, "linhas": None, "etapas": []}
+        self._inicio = time.perf_counter()
+
+    def etapa(self, etapa, linhas=None):
+        self.registro["etapas"].append({"etapa": etapa, "inicio_s": time.perf_counter() - self._inicio, "linhas": linhas})
+
+    def encerrar(self, estado, linhas=None, erro=None):
+        total = time.perf_counter() - self._inicio
+        etapas = self.registro["etapas"]
+        # Cada etapa dura até o início da seguinte; as linhas exibidas são as que a etapa entregou
+        for atual, seguinte in zip(etapas, etapas[1:] + [None]):
+            atual["duracao_s"] = (seguinte["inicio_s"] if seguinte else total) - atual["inicio_s"]
+            atual["linhas_saida"] = seguinte["linhas"] if seguinte else linhas
+        self.registro.update(estado=estado, erro=erro, total_s=total, linhas=linhas)
+
+
+@contextmanager
+def medir_carga(descricao, modo=None, arquivos=None):
+    """
+    Mede a carga executada no bloco (nesta thread). Cargas aninhadas usam a medição mais externa.
+    Ao sair, o registro entra no buffer circular (resultados vindos de cache, sem nenhuma etapa,
+    não são registrados); as linhas do dataset final são informadas por registrar_linhas_carga.
+
+    Args:
+        descricao: Nome das planilhas ou "Histórico"
+        modo: Modo de leitura
+        arquivos: Quantidade de planilhas
+    """
+    if getattr(_medicao_thread, "medicao", None) is not None:
+        yield _medicao_thread.medicao; return
+    medicao = _MedicaoCarga(descricao, modo, arquivos)
+    _medicao_thread.medicao = medicao
+    try:
+        yield medicao
+        medicao.encerrar("concluída", medicao.registro["linhas"])
+    except TarefaCancelada:
+        medicao.encerrar("cancelada"); raise
+    except BaseException as e_carga:
+        medicao.encerrar("falhou", erro=str(e_carga) or type(e_carga).__name__); raise
+    finally:
+        _medicao_thread.medicao = None
+        # Sem nenhuma etapa e sem erro o resultado veio de um cache: não houve carga a medir
+        if medicao.registro["etapas"] or medicao.registro["estado"] != "concluída":
+            with _trava_cargas: _cargas.append(medicao.registro)
+
+
+def registrar_etapa(etapa, linhas=None):
+    """Marca o início de uma etapa na carga medida nesta thread (sem medição ativa, não faz nada)."""
+    medicao = getattr(_medicao_thread, "medicao", None)
+    if medicao is not None: medicao.etapa(etapa, None if linhas is None else int(linhas))
+
+
+def registrar_linhas_carga(linhas):
+    """Informa as linhas do dataset final da carga medida nesta thread."""
+    medicao = getattr(_medicao_thread, "medicao", None)
+    if medicao is not None: medicao.registro["linhas"] = None if linhas is None else int(linhas)
+
+
+def _registros(ultimas=None):
+    with _trava_cargas: registros = list(_cargas)
+    return registros[-ultimas:] if ultimas else registros
+
+
+def listar_cargas(ultimas=None):
+    """
+    Resumo das cargas medidas, da mais recente para a mais antiga.
+
+    Returns:
+        DataFrame com uma linha por carga
+    """
+    colunas = ["Carga", "Início", "Planilhas", "Modo", "Estado", "Linhas", "Total (s)", "Etapa mais lenta"]
+    linhas = []
+    for registro in reversed(_registros(ultimas)):
+        mais_lenta = max(registro["etapas"], key=lambda e: e["duracao_s"], default=None)
+        linhas.append({
+            "Carga": registro["id"], "Início": registro["inicio"].strftime("%Y-%m-%d %H:%M:%S"),
+            "Planilhas": registro["descricao"], "Modo": registro["modo"] or "-", "Estado": registro["estado"],
+            "Linhas": registro["linhas"], "Total (s)": round(registro["total_s"], 3),
+            "Etapa mais lenta": f"{mais_lenta['etapa']} ({mais_lenta['duracao_s']:.2f}s)" if mais_lenta else "-",
+        })
+    return pd.DataFrame(linhas, columns=colunas)
+
+
+def detalhar_carga(id_carga):
+    """
+    Duração, participação no total e linhas de cada etapa de uma carga.
+    Etapas repetidas (ex.: uma por planilha de um lote processado no mesmo processo) são somadas.
+
+    Returns:
+        DataFrame com uma linha por etapa, na ordem em que ocorreram
+    """
+    colunas = ["Etapa", "Duração (s)", "% do total", "Linhas ao entrar", "Linhas ao sair"]
+    registro = next((r for r in _registros() if r["id"] == id_carga), None)
+    if registro is None: return pd.DataFrame(columns=colunas)
+    etapas = {}
+    for evento in registro["etapas"]:
+        atual = etapas.setdefault(evento["etapa"], {"Etapa": evento["etapa"], "Duração (s)": 0.0, "Linhas ao entrar": evento["linhas"]})
+        atual["Duração (s)"] += evento["duracao_s"]
+        atual["Linhas ao sair"] = evento["linhas_saida"]
+    for atual in etapas.values():
+        atual["% do total"] = round(100 * atual["Duração (s)"] / registro["total_s"], 1) if registro["total_s"] else 0.0
+        atual["Duração (s)"] = round(atual["Duração (s)"], 3)
+    return pd.DataFrame(list(etapas.values()), columns=colunas)
+
+
+def estatisticas_etapas(ultimas=20):
+    """
+    p50 e p95 da duração de cada etapa (e do total) nas últimas cargas concluídas.
+
+    Returns:
+        DataFrame com Etapa, Cargas, p50 (s), p95 (s) e Máximo (s)
+    """
+    colunas = ["Etapa", "Cargas", "p50 (s)", "p95 (s)", "Máximo (s)"]
+    duracoes = {}
+    for registro in _registros(ultimas):
+        if registro["estado"] != "concluída": continue
+        por_etapa = {}
+        for evento in registro["etapas"]: por_etapa[evento["etapa"]] = por_etapa.get(evento["etapa"], 0.0) + evento["duracao_s"]
+        for etapa, duracao in [*por_etapa.items(), ("total", registro["total_s"])]:
+            duracoes.setdefault(etapa, []).append(duracao)
+    return pd.DataFrame([{
+        "Etapa": etapa, "Cargas": len(valores),
+        "p50 (s)": round(float(np.percentile(valores, 50)), 3), "p95 (s)": round(float(np.percentile(valores, 95)), 3),
+        "Máximo (s)": round(max(valores), 3),
+    } for etapa, valores in duracoes.items()], columns=colunas)
+
+
+def exportar_eventos():
+    """Eventos de todas as cargas do buffer, um por etapa, para exportação em CSV."""
+    colunas = ["Carga", "Início", "Planilhas", "Modo", "Estado", "Etapa", "Início da etapa (s)", "Duração (s)", "Linhas ao entrar", "Linhas ao sair"]
+    return pd.DataFrame([{
+        "Carga": registro["id"], "Início": registro["inicio"].strftime("%Y-%m-%d %H:%M:%S"), "Planilhas": registro["descricao"],
+        "Modo": registro["modo"], "Estado": registro["estado"], "Etapa": evento["etapa"],
+        "Início da etapa (s)": round(evento["inicio_s"], 4), "Duração (s)": round(evento["duracao_s"], 4),
+        "Linhas ao entrar": evento["linhas"], "Linhas ao sair": evento["linhas_saida"],
+    } for registro in _registros() for evento in registro["etapas"]], columns=colunas)
+
+
+def limpar_metricas():
+    with _trava_cargas: _cargas.clear()
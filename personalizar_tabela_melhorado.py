@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+from processar_planilha_otimizado_melhorado import formatar_margem_para_exibicao_final
+
 def personalizar_tabela_por_marketplace(df, marketplace_selecionado, tipo_margem):
     """
     Personaliza a tabela de produtos com base no marketplace selecionado.
@@ -21,6 +23,7 @@ def personalizar_tabela_por_marketplace(df, marketplace_selecionado, tipo_margem
     COL_PLATAFORMA_CUSTOS = 'PLATAFORMA'
     COL_ID_PRODUTO_CUSTOS = 'ID DO PRODUTO'
     COL_VALOR_PRODUTO_PLANILHA_CUSTOS = 'PREÇO UND'
+    COL_QUANTIDADE_CUSTOS_ABA_CUSTOS = 'QUANTIDADE'
     
     # Verificar se df é um DataFrame ou uma Series
     if isinstance(df, pd.Series):
@@ -35,13 +38,18 @@ def personalizar_tabela_por_marketplace(df, marketplace_selecionado, tipo_margem
     if df.empty:
         return pd.DataFrame(columns=[COL_SKU_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS, 'Margem', COL_VALOR_PRODUTO_PLANILHA_CUSTOS])
     
+    # Unidades vendidas por produto no período exibido (o processamento não fixa mais o período).
+    # Com o backend SQL as linhas já chegam uma por produto, com as unidades somadas no banco (consultar_produtos)
+    if COL_SKU_CUSTOS in df.columns and COL_QUANTIDADE_CUSTOS_ABA_CUSTOS in df.columns and 'Unidades_Vendidas_Periodo' not in df.columns:
+        df = df.assign(Unidades_Vendidas_Periodo=df.groupby(COL_SKU_CUSTOS, observed=True)[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS].transform('sum').fillna(0).astype(int))
+    
     # Selecionar colunas relevantes com base no marketplace
     colunas_base = [
         COL_SKU_CUSTOS,
         COL_ID_PRODUTO_CUSTOS,
         COL_CONTA_CUSTOS_ORIGINAL,
         COL_PLATAFORMA_CUSTOS,
-        'Margem_Original',  # Usar a margem já formatada
+        'Margem_Num',  # Margem numérica; a formatação "15,23%" é aplicada na exibição
         'Unidades_Vendidas_Periodo',  # Nova coluna de unidades vendidas
         COL_VALOR_PRODUTO_PLANILHA_CUSTOS
     ]
@@ -74,7 +82,7 @@ def personalizar_tabela_por_marketplace(df, marketplace_selecionado, tipo_margem
         COL_ID_PRODUTO_CUSTOS: 'ID do Produto',
         COL_CONTA_CUSTOS_ORIGINAL: 'Conta',
         COL_PLATAFORMA_CUSTOS: 'Marketplace',
-        'Margem_Original': 'Margem',
+        'Margem_Num': 'Margem',
         'Unidades_Vendidas_Periodo': 'Unidades Vendidas',
         COL_VALOR_PRODUTO_PLANILHA_CUSTOS: 'Preço'
     }
@@ -85,28 +93,49 @@ def personalizar_tabela_por_marketplace(df, marketplace_selecionado, tipo_margem
     
     return df_personalizado
 
+# Função para formatar as colunas de margem somente na renderização da tabela
+def estilizar_margens(df_exibicao):
+    """
+    Aplica a formatação brasileira de margem ("15,23%") às colunas de margem da tabela exibida.
+    
+    Args:
+        df_exibicao: DataFrame já recortado para exibição
+        
+    Returns:
+        Styler com os formatadores de coluna aplicados
+    """
+    colunas_margem = [c for c in df_exibicao.columns if c == 'Margem' or (str(c).startswith('Margem_') and str(c).endswith('_Num'))]
+    return df_exibicao.style.format(formatar_margem_para_exibicao_final, subset=colunas_margem, na_rep="-")
+
 # Função para atualizar a tabela quando o tipo de margem é alterado
-@st.cache_data(ttl=600, show_spinner=False)
-def atualizar_tabela_com_nova_margem(df_tabela, tipo_margem):
+def atualizar_tabela_com_nova_margem(df_tabela, tipo_margem, versao_tabela=None):
     """
     Atualiza a tabela de produtos com o novo tipo de margem selecionado.
     
     Args:
         df_tabela: DataFrame com a tabela personalizada
         tipo_margem: Tipo de margem selecionada (Estratégica ou Real)
+        versao_tabela: Token do recorte que gerou a tabela (versão do dataset + filtros); com ele o
+            resultado vem do cache sem hashear a tabela. Sem token, a margem é aplicada diretamente
         
     Returns:
         DataFrame: DataFrame atualizado com a nova margem
     """
     if df_tabela is None or df_tabela.empty:
         return df_tabela
-    
-    df_atualizado = df_tabela.copy()
-    
-    # Verificar qual coluna de margem usar
-    if "Margem Estratégica (L)" in tipo_margem and 'Margem_Estrategica_Original' in df_atualizado.columns:
-        df_atualizado['Margem'] = df_atualizado['Margem_Estrategica_Original']
-    elif "Margem Real (M)" in tipo_margem and 'Margem_Real_Original' in df_atualizado.columns:
-        df_atualizado['Margem'] = df_atualizado['Margem_Real_Original']
-    
-    return df_atualizado
+    if versao_tabela is None:
+        return _aplicar_margem_tabela(df_tabela, tipo_margem)
+    return _tabela_com_margem_em_cache(versao_tabela, tipo_margem, df_tabela)
+
+# A tabela (_df_tabela) fica fora da chave do cache: o token já identifica o conteúdo
+@st.cache_data(ttl=600, show_spinner=False)
+def _tabela_com_margem_em_cache(versao_tabela, tipo_margem, _df_tabela):
+    return _aplicar_margem_tabela(_df_tabela, tipo_margem)
+
+def _aplicar_margem_tabela(df_tabela, tipo_margem):
+    # Verificar qual coluna de margem usar (assign não copia as demais colunas)
+    if "Margem Estratégica (L)" in tipo_margem and 'Margem_Estrategica_Num' in df_tabela.columns:
+        return df_tabela.assign(Margem=df_tabela['Margem_Estrategica_Num'])
+    elif "Margem Real (M)" in tipo_margem and 'Margem_Real_Num' in df_tabela.columns:
+        return df_tabela.assign(Margem=df_tabela['Margem_Real_Num'])
+    return df_tabela
@@ -1,11 +1,117 @@
 import pandas as pd
 import streamlit as st
 import traceback
+import io
+import time
+import hashlib
+import os
+import threading
+import unicodedata
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import numpy as np
+from pandas.api.types import union_categoricals
 
-# Função para converter margem para número, otimizada para performance
-@st.cache_data(ttl=3600)  # Cache por 1 hora
+from cache_planilhas import calcular_hash_conteudo, carregar_abas_do_cache, salvar_abas_no_cache
+from leitura_planilha import ler_aba_streaming, ler_abas_paralelo, listar_abas, ler_cabecalhos, PROCESSOS_LEITURA
+from historico_vendas import incorporar_ao_historico, carregar_historico, versao_historico
+from regras_derivacao import aplicar_regras_derivacao, carregar_regras_derivacao, versao_regras, ErroRegrasDerivacao
+from metricas_ingestao import medir_carga, registrar_etapa, registrar_linhas_carga
+
+# --- MOTORES DE LEITURA DO MODO PADRÃO ---
+# O calamine (python-calamine, leitor nativo em Rust) é usado pelo pd.ExcelFile quando instalado;
+# sem ele a leitura continua no openpyxl
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_DISPONIVEL = True
+except ImportError:
+    CALAMINE_DISPONIVEL = False
+MOTORES_LEITURA = ["calamine", "openpyxl"]
+
+# --- AVISOS DO PROCESSAMENTO ---
+# Avisos vão para a tela; em tarefas de segundo plano (sem sessão do Streamlit na thread)
+# são coletados em uma lista e exibidos quando a tarefa termina
+_avisos_thread = threading.local()
+
+
+@contextmanager
+def coletar_avisos(lista_avisos):
+    """Durante o bloco, os avisos do processamento nesta thread são acrescentados a lista_avisos."""
+    anterior = getattr(_avisos_thread, "lista", None)
+    _avisos_thread.lista = lista_avisos
+    try: yield lista_avisos
+    finally: _avisos_thread.lista = anterior
+
+
+def _avisar(mensagem):
+    lista_avisos = getattr(_avisos_thread, "lista", None)
+    if lista_avisos is not None: lista_avisos.append(mensagem)
+    else: st.warning(mensagem)
+
+# Início de uma etapa: vai para o callback do chamador (progresso da tarefa) e para as métricas da carga
+def _iniciar_etapa(callback_etapa, etapa, linhas=None):
+    registrar_etapa(etapa, linhas)
+    if callback_etapa: callback_etapa(etapa)
+
+# --- VERSÃO DO DATASET ---
+# Token curto que identifica um dataset (hash da planilha + parâmetros do processamento). Vai em
+# df.attrs['versao'] e é usado como chave dos caches no lugar do conteúdo: o st.cache_data compara
+# uma string de 32 caracteres em vez de hashear o arquivo ou o DataFrame inteiro a cada chamada
+def versao_dataset(*partes):
+    return hashlib.sha256("|".join(str(parte) for parte in partes).encode()).hexdigest()[:32]
+
+
+def escolher_motor_leitura(motor_preferido=None):
+    """
+    Define o motor do pd.ExcelFile: o preferido quando disponível, senão o mais rápido instalado.
+
+    Args:
+        motor_preferido: "calamine", "openpyxl" ou None (automático)
+
+    Returns:
+        str: nome do motor aceito pelo pandas (engine=)
+    """
+    if motor_preferido == "openpyxl" or not CALAMINE_DISPONIVEL:
+        return "openpyxl"
+    return "calamine"
+
+
+def verificar_paridade_motores(conteudo, colunas, dtypes_leitura):
+    """
+    Lê a aba CUSTOS com cada motor disponível e compara os dtypes e os valores das colunas usadas
+    pelo painel, já com as mesmas conversões do processamento (números e data).
+
+    Args:
+        conteudo: bytes do arquivo .xlsx
+        colunas: Colunas da aba CUSTOS lidas pelo processamento
+        dtypes_leitura: Dicionário de colunas lidas como texto (mesmo do processamento)
+
+    Returns:
+        DataFrame com uma linha por coluna e o resultado da comparação entre os motores
+    """
+    motores = [m for m in MOTORES_LEITURA if m != "calamine" or CALAMINE_DISPONIVEL]
+    lidos = {}
+    for motor in motores:
+        df = pd.read_excel(io.BytesIO(conteudo), sheet_name='CUSTOS', engine=motor, dtype=dtypes_leitura,
+                           usecols=lambda x: x in colunas)
+        for col in ['VALOR DO PEDIDO', 'QUANTIDADE']:
+            if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+        if 'DIA DE VENDA' in df.columns: df['DIA DE VENDA'] = pd.to_datetime(df['DIA DE VENDA'], errors='coerce')
+        lidos[motor] = df
+
+    referencia = lidos["openpyxl"]
+    linhas = []
+    for col in referencia.columns:
+        linha = {"Coluna": col}
+        for motor, df in lidos.items(): linha[f"dtype {motor}"] = str(df[col].dtype) if col in df.columns else "ausente"
+        outros = [df for motor, df in lidos.items() if motor != "openpyxl"]
+        linha["Mesmo dtype"] = all(col in df.columns and df[col].dtype == referencia[col].dtype for df in outros)
+        linha["Mesmos valores"] = all(col in df.columns and df[col].equals(referencia[col]) for df in outros)
+        linhas.append(linha)
+    return pd.DataFrame(linhas)
+
+# Função escalar de referência para converter margem em número (usada célula a célula apenas fora do processamento)
 def converter_margem_para_numero_final(valor_da_planilha):
     """
     Converte o valor da planilha para um float que representa a porcentagem (ex: 15.23).
@@ -35,229 +141,933 @@ def converter_margem_para_numero_final(valor_da_planilha):
             return 0.0
     return 0.0
 
-# Função para formatar margem para exibição, otimizada para performance
-@st.cache_data(ttl=3600)  # Cache por 1 hora
+# Função escalar de referência para formatar margem para exibição
 def formatar_margem_para_exibicao_final(valor_numerico_percentual):
     if pd.isna(valor_numerico_percentual): return "0,00%"
     try: return f"{float(valor_numerico_percentual):.2f}".replace(".", ",") + "%"
     except (ValueError, TypeError): return str(valor_numerico_percentual) 
 
-# Função principal para processar a planilha, com otimizações de performance
-@st.cache_data(ttl=600, show_spinner=False)  # Cache por 10 minutos, sem mostrar spinner
-def processar_planilha_otimizado(
-    uploaded_file, 
-    tipo_margem_selecionada_ui_proc, 
-    data_inicio_analise_proc,
-    data_fim_analise_proc,
-    col_margem_estrategica, # Nome do parâmetro como na chamada do app.py
-    col_margem_real,         # Nome do parâmetro como na chamada do app.py
-    col_tipo_anuncio_ml_planilha_proc, # Nome da coluna de tipo de anúncio da planilha
-    _dummy_rerun_arg=None 
-    ):
+def _float_texto_ou_zero(texto):
+    try: return float(texto)
+    except ValueError: return 0.0
+
+# Kernel vetorizado de conversão de margens: mesmo resultado de converter_margem_para_numero_final,
+# mas aplicado à coluna inteira com acessores .str, pd.to_numeric e máscaras NumPy
+def converter_margem_vetorizado(serie):
+    """
+    Converte uma coluna de margens da planilha para floats em pontos percentuais (ex: 15.23).
+    Valores com |v| em (0, 1.5] são tratados como fração e multiplicados por 100.
     
-    try:
-        COL_SKU_CUSTOS = 'SKU PRODUTOS'; COL_DATA_CUSTOS = 'DIA DE VENDA'; COL_CONTA_CUSTOS_ORIGINAL = 'CONTAS'
-        COL_PLATAFORMA_CUSTOS = 'PLATAFORMA'; COL_VALOR_PRODUTO_PLANILHA_CUSTOS = 'PREÇO UND'
-        COL_ID_PRODUTO_CUSTOS = 'ID DO PRODUTO'; COL_QUANTIDADE_CUSTOS_ABA_CUSTOS = 'QUANTIDADE'
-        COL_VALOR_PEDIDO_CUSTOS = 'VALOR DO PEDIDO'
-        NOME_PADRAO_TIPO_ANUNCIO = 'Tipo de Anúncio' # Nome padrão para a coluna no DataFrame
-        COL_TIPO_VENDA = 'TIPO DE VENDA'  # Nova coluna para identificar Marketplace, Atacado ou Showroom
-
-        xls = pd.ExcelFile(uploaded_file)
-        abas_necessarias = ['CUSTOS', 'ESTOQUE']
-        for aba in abas_necessarias:
-            if aba not in xls.sheet_names:
-                st.error(f"A aba '{aba}' não foi encontrada na planilha."); return None
-
-        colunas_base_leitura = [
-            COL_SKU_CUSTOS, COL_DATA_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS,
-            COL_VALOR_PRODUTO_PLANILHA_CUSTOS, COL_ID_PRODUTO_CUSTOS,
-            COL_QUANTIDADE_CUSTOS_ABA_CUSTOS, COL_VALOR_PEDIDO_CUSTOS
-        ]
-        colunas_margem_a_ler_da_planilha = list(set([col_margem_estrategica, col_margem_real]))
-        colunas_custos_ler_final = list(dict.fromkeys(
-            colunas_base_leitura + 
-            colunas_margem_a_ler_da_planilha + 
-            [col_tipo_anuncio_ml_planilha_proc] # Adiciona a coluna tipo anúncio
-        ))
+    Args:
+        serie: Series com as margens como texto ("15,23%", "0.1523") ou números
+        
+    Returns:
+        Series float64 com o mesmo índice da entrada
+    """
+    serie = pd.Series(serie)
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_numeric_dtype(serie):
+        valores = serie.to_numpy(dtype='float64', na_value=np.nan, copy=True)
+        zerar = np.isnan(valores)
+    else:
+        objetos = serie.astype(object)
+        # Só células str passam pelos acessores .str (em colunas mistas, Timestamp/date também têm .replace)
+        if pd.api.types.is_string_dtype(serie) and not pd.api.types.is_object_dtype(serie):
+            eh_texto = serie.notna().to_numpy()
+        else:
+            eh_texto = objetos.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+        valores = np.full(len(serie), np.nan)
+        zerar = ~eh_texto
         
-        dtypes_leitura = {str(col): str for col in [
-            COL_SKU_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, 
-            COL_PLATAFORMA_CUSTOS, col_tipo_anuncio_ml_planilha_proc
-        ]}
-        for col_margem_str in colunas_margem_a_ler_da_planilha: dtypes_leitura[str(col_margem_str)] = str
+        if eh_texto.any():
+            texto_valido = objetos[eh_texto].str.replace('%', '', regex=False).str.strip().str.replace(',', '.', regex=False)
+            try:
+                # Caminho rápido: astype usa o mesmo parser do float() do Python (resultado idêntico bit a bit)
+                valores[eh_texto] = texto_valido.astype('float64').to_numpy()
+            except ValueError:
+                convertiveis = pd.to_numeric(texto_valido, errors='coerce').notna().to_numpy()
+                valores_texto = np.full(len(texto_valido), np.nan)
+                if convertiveis.any():
+                    try: valores_texto[convertiveis] = texto_valido[convertiveis].astype('float64').to_numpy()
+                    except ValueError: valores_texto[convertiveis] = texto_valido[convertiveis].map(_float_texto_ou_zero).to_numpy(dtype='float64')
+                if not convertiveis.all():
+                    # Poucos casos ("", "abc", "nan", "1_0"): resolver pelos valores únicos
+                    restantes = texto_valido[~convertiveis]
+                    mapa_restantes = {v: _float_texto_ou_zero(v) for v in restantes.unique()}
+                    valores_texto[~convertiveis] = restantes.map(mapa_restantes).to_numpy(dtype='float64')
+                valores[eh_texto] = valores_texto
         
-        # Otimização: Usar nrows para limitar a quantidade de dados carregados se necessário
-        custos_df = pd.read_excel(xls, sheet_name='CUSTOS', dtype=dtypes_leitura, 
-                                 usecols=lambda x: x in colunas_custos_ler_final)
+        # Números misturados com texto em colunas object (int/float do Python; outros tipos viram 0)
+        outros = ~eh_texto & objetos.notna().to_numpy()
+        if outros.any():
+            numeros = objetos[outros].map(lambda v: float(v) if isinstance(v, (int, float)) else np.nan).to_numpy(dtype='float64')
+            valores[outros] = numeros
+            zerar[outros] = np.isnan(numeros)
+    
+    absolutos = np.abs(valores)
+    em_fracao = (absolutos > 0) & (absolutos <= 1.5)  # AJUSTE O LIMITE 1.5 SE NECESSÁRIO
+    resultado = np.where(em_fracao, valores * 100.0, valores)
+    resultado[zerar] = 0.0
+    return pd.Series(resultado, index=serie.index, dtype='float64')
+
+# Função para converter dimensões de texto em categóricas
+def codificar_colunas_categoricas(df, colunas):
+    """
+    Converte as colunas indicadas em pandas Categorical com dicionário ordenado (estável para o dataset).
+    
+    Args:
+        df: DataFrame processado
+        colunas: Lista de colunas de baixa cardinalidade (contas, plataformas, SKUs...)
         
-        # Renomear coluna de tipo de anúncio para um nome padrão ANTES de qualquer filtro
-        if col_tipo_anuncio_ml_planilha_proc in custos_df.columns:
-            custos_df.rename(columns={col_tipo_anuncio_ml_planilha_proc: NOME_PADRAO_TIPO_ANUNCIO}, inplace=True)
-            custos_df[NOME_PADRAO_TIPO_ANUNCIO] = custos_df[NOME_PADRAO_TIPO_ANUNCIO].fillna("Não Informado").astype(str)
+    Returns:
+        DataFrame com as colunas convertidas
+    """
+    for col in colunas:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+# Função para medir o ganho de memória das colunas categóricas
+def relatorio_memoria_categorias(df):
+    """
+    Compara, por coluna categórica, a memória como texto (object) e como categoria.
+    
+    Returns:
+        DataFrame com memória antes/depois (MB), redução percentual e número de categorias
+    """
+    linhas = []
+    if df is not None:
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                antes = df[col].astype(object).memory_usage(deep=True, index=False)
+                depois = df[col].memory_usage(deep=True, index=False)
+                linhas.append({
+                    "Coluna": col,
+                    "Categorias": len(df[col].cat.categories),
+                    "Texto (MB)": round(antes / (1024 * 1024), 3),
+                    "Categórica (MB)": round(depois / (1024 * 1024), 3),
+                    "Redução (%)": round(100 * (1 - depois / antes), 1) if antes else 0.0
+                })
+    return pd.DataFrame(linhas, columns=["Coluna", "Categorias", "Texto (MB)", "Categórica (MB)", "Redução (%)"])
+
+# Configuração da aba ESTOQUE: coluna de estoque -> (posição da coluna de SKU, posição da coluna de quantidade)
+ESTOQUE_MAP_CONFIG = {'Estoque Full VF': (0, 1), 'Estoque Full GS': (3, 4), 'Estoque Full DK': (6, 7), 'Estoque Tiny': (9, 10)}
+# Estoque Full de cada conta
+ESTOQUE_FULL_POR_CONTA = {'Via Flix': 'Estoque Full VF', 'Monaco': 'Estoque Full DK', 'GS Torneira': 'Estoque Full GS'}
+
+# Função para montar a tabela única de estoque da planilha
+def construir_indice_estoque(estoque_df):
+    """
+    Monta uma tabela indexada por SKU com as quatro colunas de estoque da aba ESTOQUE.
+    Para SKUs repetidos vale a primeira ocorrência; SKUs ausentes em um bloco ficam com 0.
+    
+    Args:
+        estoque_df: DataFrame da aba ESTOQUE (colunas lidas por posição)
+        
+    Returns:
+        DataFrame indexado por SKU com as colunas de ESTOQUE_MAP_CONFIG (inteiros)
+    """
+    series_estoque = []
+    for nome_col_est, (idx_sku_est, idx_val_est) in ESTOQUE_MAP_CONFIG.items():
+        if idx_sku_est < len(estoque_df.columns) and idx_val_est < len(estoque_df.columns):
+            skus = estoque_df.iloc[:, idx_sku_est]
+            valores = pd.to_numeric(estoque_df.iloc[:, idx_val_est], errors='coerce').fillna(0).astype(int)
+            serie = pd.Series(valores.to_numpy(), index=pd.Index(skus.to_numpy(), dtype=object), name=nome_col_est)
+            serie = serie[serie.index.notna()]
+            series_estoque.append(serie[~serie.index.duplicated(keep='first')])
         else:
-            custos_df[NOME_PADRAO_TIPO_ANUNCIO] = "Não Informado"
+            series_estoque.append(pd.Series(dtype='int64', name=nome_col_est))
+    return pd.concat(series_estoque, axis=1).fillna(0).astype(int)
 
-        # Otimização: Converter apenas as colunas necessárias
-        custos_df[COL_VALOR_PEDIDO_CUSTOS] = pd.to_numeric(custos_df[COL_VALOR_PEDIDO_CUSTOS], errors='coerce').fillna(0)
-        custos_df[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS] = pd.to_numeric(custos_df[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS], errors='coerce').fillna(0)
-        custos_df[COL_DATA_CUSTOS] = pd.to_datetime(custos_df[COL_DATA_CUSTOS], errors='coerce')
-        custos_df.dropna(subset=[COL_DATA_CUSTOS], inplace=True)
+# Função para aplicar a tabela de estoque às vendas pelos códigos categóricos
+def aplicar_indice_estoque(df, indice_estoque, col_sku, col_conta):
+    """
+    Preenche as colunas de estoque e o Estoque Full da conta de cada venda.
+    A tabela de estoque é reindexada uma vez pelas categorias de SKU e depois indexada
+    pelos códigos inteiros; a conta escolhe a coluna de Full por uma tabela de consulta.
+    
+    Args:
+        df: DataFrame de vendas com SKU e conta categóricos (alterado no lugar)
+        indice_estoque: Resultado de construir_indice_estoque
+        col_sku: Nome da coluna de SKU
+        col_conta: Nome da coluna de conta
+    """
+    colunas_estoque = list(ESTOQUE_MAP_CONFIG.keys())
+    # Uma linha por categoria de SKU + linha e coluna finais de zeros (código -1 e conta sem Full)
+    tabela = indice_estoque.reindex(df[col_sku].cat.categories)[colunas_estoque].fillna(0).to_numpy(dtype='int64')
+    tabela = np.pad(tabela, ((0, 1), (0, 1)))
+    codigos_sku = df[col_sku].cat.codes.to_numpy()
+    for j, nome_col_est in enumerate(colunas_estoque):
+        df[nome_col_est] = tabela[codigos_sku, j]
+    
+    coluna_zero = len(colunas_estoque)
+    if col_conta in df.columns:
+        contas = df[col_conta].cat.categories
+        coluna_por_conta = np.array([colunas_estoque.index(ESTOQUE_FULL_POR_CONTA[c]) if c in ESTOQUE_FULL_POR_CONTA else coluna_zero for c in contas] + [coluna_zero], dtype='int64')
+        df['Estoque Full'] = tabela[codigos_sku, coluna_por_conta[df[col_conta].cat.codes.to_numpy()]]
+    else:
+        df['Estoque Full'] = 0
 
-        if isinstance(data_inicio_analise_proc, datetime): data_inicio_analise_proc = data_inicio_analise_proc.date()
-        if isinstance(data_fim_analise_proc, datetime): data_fim_analise_proc = data_fim_analise_proc.date()
+# Colunas da aba CUSTOS usadas no processamento
+COL_SKU_CUSTOS = 'SKU PRODUTOS'; COL_DATA_CUSTOS = 'DIA DE VENDA'; COL_CONTA_CUSTOS_ORIGINAL = 'CONTAS'
+COL_PLATAFORMA_CUSTOS = 'PLATAFORMA'; COL_VALOR_PRODUTO_PLANILHA_CUSTOS = 'PREÇO UND'
+COL_ID_PRODUTO_CUSTOS = 'ID DO PRODUTO'; COL_QUANTIDADE_CUSTOS_ABA_CUSTOS = 'QUANTIDADE'
+COL_VALOR_PEDIDO_CUSTOS = 'VALOR DO PEDIDO'
+NOME_PADRAO_TIPO_ANUNCIO = 'Tipo de Anúncio' # Nome padrão para a coluna no DataFrame
+COL_TIPO_VENDA = 'TIPO DE VENDA'  # Nova coluna para identificar Marketplace, Atacado ou Showroom
+COL_CEP_CUSTOS = 'CEP'; COL_ESTADO = 'Estado'
+# Filtro do painel -> coluna do dataset (usado pelo índice de filtros em memória e pelas consultas do backend SQL)
+COLUNAS_FILTRO = {
+    "conta": COL_CONTA_CUSTOS_ORIGINAL,
+    "tipo_venda": COL_TIPO_VENDA,
+    "plataforma": COL_PLATAFORMA_CUSTOS,
+    "tipo_anuncio": NOME_PADRAO_TIPO_ANUNCIO,
+}
+# Colunas lidas quando existem na planilha (alimentam as regras de derivação; a ausência não gera aviso)
+COLUNAS_OPCIONAIS_CUSTOS = [COL_TIPO_VENDA, COL_ESTADO, COL_CEP_CUSTOS]
 
-        custos_df_datas_para_filtro = custos_df[COL_DATA_CUSTOS].dt.date
-        custos_df_filtrado_periodo = custos_df[(custos_df_datas_para_filtro >= data_inicio_analise_proc) & (custos_df_datas_para_filtro <= data_fim_analise_proc)].copy()
+# Função para definir as colunas lidas da aba CUSTOS e quais delas são lidas como texto
+def colunas_leitura_custos(col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc):
+    colunas_base_leitura = [
+        COL_SKU_CUSTOS, COL_DATA_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS,
+        COL_VALOR_PRODUTO_PLANILHA_CUSTOS, COL_ID_PRODUTO_CUSTOS,
+        COL_QUANTIDADE_CUSTOS_ABA_CUSTOS, COL_VALOR_PEDIDO_CUSTOS
+    ]
+    colunas_margem_a_ler_da_planilha = list(set([col_margem_estrategica, col_margem_real]))
+    colunas_custos_ler_final = list(dict.fromkeys(
+        colunas_base_leitura + 
+        colunas_margem_a_ler_da_planilha + 
+        [col_tipo_anuncio_ml_planilha_proc] + # Adiciona a coluna tipo anúncio
+        COLUNAS_OPCIONAIS_CUSTOS
+    ))
+    
+    dtypes_leitura = {str(col): str for col in [
+        COL_SKU_CUSTOS, COL_ID_PRODUTO_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, 
+        COL_PLATAFORMA_CUSTOS, col_tipo_anuncio_ml_planilha_proc
+    ] + COLUNAS_OPCIONAIS_CUSTOS}
+    for col_margem_str in colunas_margem_a_ler_da_planilha: dtypes_leitura[str(col_margem_str)] = str
+    return colunas_custos_ler_final, dtypes_leitura
 
-        if custos_df_filtrado_periodo.empty:
-            st.warning(f"Sem dados em 'CUSTOS' para o período ({data_inicio_analise_proc:%d/%m/%Y} a {data_fim_analise_proc:%d/%m/%Y}) no processamento inicial.")
-            return pd.DataFrame()
+# --- VALIDAÇÃO DO ESQUEMA DA PLANILHA ---
+# Colunas sem as quais o processamento não funciona e nomes alternativos aceitos no cabeçalho
+# (comparados sem acentos, maiúsculas ou espaços extras)
+COLUNAS_OBRIGATORIAS_CUSTOS = [COL_SKU_CUSTOS, COL_DATA_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL,
+                               COL_QUANTIDADE_CUSTOS_ABA_CUSTOS, COL_VALOR_PEDIDO_CUSTOS]
+NOMES_ALTERNATIVOS_CUSTOS = {
+    COL_SKU_CUSTOS: ["SKU", "SKU PRODUTO", "CODIGO SKU"],
+    COL_DATA_CUSTOS: ["DATA DA VENDA", "DATA VENDA", "DIA DA VENDA", "DATA"],
+    COL_CONTA_CUSTOS_ORIGINAL: ["CONTA", "LOJA"],
+    COL_PLATAFORMA_CUSTOS: ["MARKETPLACE", "CANAL"],
+    COL_VALOR_PRODUTO_PLANILHA_CUSTOS: ["PRECO UNITARIO", "PRECO"],
+    COL_ID_PRODUTO_CUSTOS: ["ID PRODUTO", "ID DO ANUNCIO", "ID ANUNCIO"],
+    COL_QUANTIDADE_CUSTOS_ABA_CUSTOS: ["QTD", "QTDE", "QUANTIDADE VENDIDA"],
+    COL_VALOR_PEDIDO_CUSTOS: ["VALOR PEDIDO", "VALOR TOTAL", "VALOR TOTAL DO PEDIDO"],
+}
+COLUNAS_MINIMAS_ESTOQUE = max(max(posicoes) for posicoes in ESTOQUE_MAP_CONFIG.values()) + 1
 
-        # Processar ambas as margens de uma vez para evitar reprocessamento
-        if col_margem_estrategica in custos_df_filtrado_periodo.columns:
-            custos_df_filtrado_periodo['Margem_Estrategica_Num'] = custos_df_filtrado_periodo[col_margem_estrategica].apply(converter_margem_para_numero_final)
-            custos_df_filtrado_periodo['Margem_Estrategica_Original'] = custos_df_filtrado_periodo['Margem_Estrategica_Num'].apply(formatar_margem_para_exibicao_final)
-        else:
-            custos_df_filtrado_periodo['Margem_Estrategica_Num'] = 0.0
-            custos_df_filtrado_periodo['Margem_Estrategica_Original'] = "0,00%"
-            
-        if col_margem_real in custos_df_filtrado_periodo.columns:
-            custos_df_filtrado_periodo['Margem_Real_Num'] = custos_df_filtrado_periodo[col_margem_real].apply(converter_margem_para_numero_final)
-            custos_df_filtrado_periodo['Margem_Real_Original'] = custos_df_filtrado_periodo['Margem_Real_Num'].apply(formatar_margem_para_exibicao_final)
-        else:
-            custos_df_filtrado_periodo['Margem_Real_Num'] = 0.0
-            custos_df_filtrado_periodo['Margem_Real_Original'] = "0,00%"
+
+class ErroEsquemaPlanilha(ValueError):
+    """Planilha rejeitada pela validação do cabeçalho (abas ou colunas obrigatórias ausentes)."""
+
+
+def _normalizar_nome_coluna(nome):
+    sem_acentos = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode()
+    return " ".join(sem_acentos.upper().split())
+
+# Função para validar o cabeçalho antes de ler a planilha inteira
+def verificar_esquema_planilha(conteudo_planilha, colunas_custos_ler_final):
+    """
+    Lê só o cabeçalho das abas CUSTOS e ESTOQUE e confere abas, colunas obrigatórias e o layout
+    de ESTOQUE usado por ESTOQUE_MAP_CONFIG, em milissegundos, antes da leitura completa.
+    
+    Args:
+        conteudo_planilha: bytes do arquivo .xlsx
+        colunas_custos_ler_final: Colunas esperadas na aba CUSTOS (ver colunas_leitura_custos)
         
-        # Definir a margem atual com base na seleção do usuário
-        if "Margem Estratégica (L)" in tipo_margem_selecionada_ui_proc:
-            custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Estrategica_Num']
-            custos_df_filtrado_periodo['Margem_Original'] = custos_df_filtrado_periodo['Margem_Estrategica_Original']
-        elif "Margem Real (M)" in tipo_margem_selecionada_ui_proc:
-            custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Real_Num']
-            custos_df_filtrado_periodo['Margem_Original'] = custos_df_filtrado_periodo['Margem_Real_Original']
+    Returns:
+        dict com "erros" e "avisos" (mensagens para o usuário), "mapeamento" {nome na planilha: nome padrão}
+        das colunas encontradas com outro nome e "tempo_s"
+    """
+    inicio = time.perf_counter()
+    cabecalhos = ler_cabecalhos(conteudo_planilha, ['CUSTOS', 'ESTOQUE'], abas_com_textos=['CUSTOS'])
+    erros, avisos, mapeamento = [], [], {}
+    for aba in ['CUSTOS', 'ESTOQUE']:
+        if cabecalhos[aba] is None: erros.append(f"A aba '{aba}' não foi encontrada na planilha.")
+
+    if cabecalhos['CUSTOS'] is not None:
+        nomes_planilha = [nome for nome in cabecalhos['CUSTOS'][0] if nome is not None]
+        if not nomes_planilha:
+            erros.append("A aba 'CUSTOS' não tem cabeçalho na primeira linha.")
         else:
-            custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Estrategica_Num']
-            custos_df_filtrado_periodo['Margem_Original'] = custos_df_filtrado_periodo['Margem_Estrategica_Original']
-        
-        df_final_com_estoque = custos_df_filtrado_periodo.copy() 
-        try:
-            # Otimização: Ler apenas as colunas necessárias da aba ESTOQUE
-            estoque_df = pd.read_excel(xls, sheet_name='ESTOQUE', dtype={0: str, 3:str, 6:str, 9:str}) 
-            skus_unicos_filtrados = df_final_com_estoque[COL_SKU_CUSTOS].unique()
-            estoque_map_config = {'Estoque Full VF': (0, 1), 'Estoque Full GS': (3, 4), 'Estoque Full DK': (6, 7), 'Estoque Tiny': (9, 10)}
-            for nome_col_est, (idx_sku_est, idx_val_est) in estoque_map_config.items():
-                if idx_sku_est < len(estoque_df.columns) and idx_val_est < len(estoque_df.columns):
-                    estoque_temp = estoque_df.iloc[:, [idx_sku_est, idx_val_est]].copy()
-                    estoque_temp.columns = ['_SKU_ESTOQUE_TEMP_', nome_col_est]
-                    estoque_temp.drop_duplicates(subset=['_SKU_ESTOQUE_TEMP_'], keep='first', inplace=True)
-                    estoque_temp = estoque_temp[estoque_temp['_SKU_ESTOQUE_TEMP_'].isin(skus_unicos_filtrados)]
-                    df_final_com_estoque = pd.merge(df_final_com_estoque, estoque_temp,left_on=COL_SKU_CUSTOS, right_on='_SKU_ESTOQUE_TEMP_',how='left').drop('_SKU_ESTOQUE_TEMP_', axis=1, errors='ignore')
-                    df_final_com_estoque[nome_col_est] = pd.to_numeric(df_final_com_estoque[nome_col_est], errors='coerce').fillna(0).astype(int) # Estoque como inteiro
-                else: df_final_com_estoque[nome_col_est] = 0
-        except Exception as e_merge_estoque:
-            st.warning(f"Erro ao processar Estoque: {e_merge_estoque}.")
-            for nome_col_est_fallback in estoque_map_config.keys():
-                if nome_col_est_fallback not in df_final_com_estoque.columns: df_final_com_estoque[nome_col_est_fallback] = 0
-        
-        cols_full_individuais = ['Estoque Full VF', 'Estoque Full GS', 'Estoque Full DK']
-        if COL_CONTA_CUSTOS_ORIGINAL in df_final_com_estoque.columns and all(c in df_final_com_estoque.columns for c in cols_full_individuais):
-            cond_vf = df_final_com_estoque[COL_CONTA_CUSTOS_ORIGINAL] == 'Via Flix'
-            cond_dk = df_final_com_estoque[COL_CONTA_CUSTOS_ORIGINAL] == 'Monaco' 
-            cond_gs = df_final_com_estoque[COL_CONTA_CUSTOS_ORIGINAL] == 'GS Torneira' 
-            choices_full = [ df_final_com_estoque['Estoque Full VF'], df_final_com_estoque['Estoque Full DK'], df_final_com_estoque['Estoque Full GS'] ]
-            df_final_com_estoque['Estoque Full'] = np.select([cond_vf, cond_dk, cond_gs], choices_full, default=0).astype(int)
-        elif 'Estoque Full' not in df_final_com_estoque.columns: df_final_com_estoque['Estoque Full'] = 0
-        if 'Estoque Full' in df_final_com_estoque.columns: df_final_com_estoque['Estoque Total Full'] = df_final_com_estoque['Estoque Full']
-        else: df_final_com_estoque['Estoque Total Full'] = 0
-            
-        if 'Margem_Num' in df_final_com_estoque.columns: df_final_com_estoque['Margem_Critica'] = df_final_com_estoque['Margem_Num'] < 10
-        else: df_final_com_estoque['Margem_Critica'] = False
-        if 'Estoque Tiny' in df_final_com_estoque.columns: df_final_com_estoque['Estoque_Parado_Alerta'] = df_final_com_estoque['Estoque Tiny'] > 10
-        else: df_final_com_estoque['Estoque_Parado_Alerta'] = False
-        
-        # Adicionar coluna de unidades vendidas por produto no período
-        if COL_SKU_CUSTOS in df_final_com_estoque.columns and COL_QUANTIDADE_CUSTOS_ABA_CUSTOS in df_final_com_estoque.columns:
-            # Agrupar por SKU e somar as quantidades
-            unidades_vendidas = df_final_com_estoque.groupby(COL_SKU_CUSTOS)[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS].sum().reset_index()
-            unidades_vendidas.columns = [COL_SKU_CUSTOS, 'Unidades_Vendidas_Periodo']
-            
-            # Mesclar com o DataFrame principal
-            df_final_com_estoque = pd.merge(
-                df_final_com_estoque, 
-                unidades_vendidas,
-                on=COL_SKU_CUSTOS,
-                how='left'
-            )
-            
-            # Preencher valores nulos com 0
-            df_final_com_estoque['Unidades_Vendidas_Periodo'] = df_final_com_estoque['Unidades_Vendidas_Periodo'].fillna(0).astype(int)
+            por_nome_normalizado = {}
+            for nome in nomes_planilha: por_nome_normalizado.setdefault(_normalizar_nome_coluna(nome), nome)
+            ausentes = []
+            for col in colunas_custos_ler_final:
+                if col in nomes_planilha: continue
+                candidatos = [col] + NOMES_ALTERNATIVOS_CUSTOS.get(col, [])
+                encontrado = next((por_nome_normalizado[_normalizar_nome_coluna(c)] for c in candidatos
+                                   if _normalizar_nome_coluna(c) in por_nome_normalizado), None)
+                if encontrado is not None and encontrado not in mapeamento and encontrado not in colunas_custos_ler_final:
+                    mapeamento[encontrado] = col
+                else:
+                    ausentes.append(col)
+            obrigatorias_ausentes = [col for col in ausentes if col in COLUNAS_OBRIGATORIAS_CUSTOS]
+            if obrigatorias_ausentes:
+                erros.append(f"A aba 'CUSTOS' não tem as colunas obrigatórias: {', '.join(obrigatorias_ausentes)}. "
+                             f"Colunas encontradas: {', '.join(map(str, nomes_planilha))}.")
+            opcionais_ausentes = [col for col in ausentes if col not in COLUNAS_OBRIGATORIAS_CUSTOS + COLUNAS_OPCIONAIS_CUSTOS]
+            if opcionais_ausentes:
+                avisos.append(f"Colunas não encontradas na aba 'CUSTOS' (valores padrão serão usados): {', '.join(opcionais_ausentes)}.")
+
+    if cabecalhos['ESTOQUE'] is not None and cabecalhos['ESTOQUE'][1] < COLUNAS_MINIMAS_ESTOQUE:
+        erros.append(f"A aba 'ESTOQUE' tem {cabecalhos['ESTOQUE'][1]} colunas; são esperadas pelo menos {COLUNAS_MINIMAS_ESTOQUE} "
+                     f"(pares SKU/quantidade de VF, GS, DK e Tiny nas colunas A/B, D/E, G/H e J/K).")
+    return {"erros": erros, "avisos": avisos, "mapeamento": mapeamento, "tempo_s": time.perf_counter() - inicio}
+
+# Função para ler as abas CUSTOS e ESTOQUE de uma planilha enviada
+def ler_abas_planilha(conteudo_planilha, colunas_custos_ler_final, dtypes_leitura, modo_leitura="padrao",
+                      motor_leitura=None, callback_progresso=None, callback_etapa=None):
+    """
+    Lê as abas CUSTOS e ESTOQUE (ou as recupera do cache em disco).
+    O cabeçalho é validado antes (verificar_esquema_planilha): planilhas inválidas levantam
+    ErroEsquemaPlanilha sem ler as linhas, e colunas com nome alternativo saem com o nome padrão.
+
+    callback_etapa, se informado, é chamado com o nome de cada etapa ("validação", "leitura") ao iniciá-la.
+
+    Returns:
+        tuple (custos_df, estoque_df, erro_leitura_estoque, info_leitura)
+    """
+    _iniciar_etapa(callback_etapa, "validação")
+    esquema = verificar_esquema_planilha(conteudo_planilha, colunas_custos_ler_final)
+    if esquema["erros"]: raise ErroEsquemaPlanilha(" ".join(esquema["erros"]))
+    for aviso in esquema["avisos"]: _avisar(aviso)
+    mapeamento = esquema["mapeamento"]
+    nomes_na_planilha = {padrao: nome for nome, padrao in mapeamento.items()}
+
+    # Otimização: planilhas idênticas (mesmo SHA-256) são recarregadas do cache em disco sem reler o XML
+    _iniciar_etapa(callback_etapa, "leitura")
+    chave_cache = calcular_hash_conteudo(conteudo_planilha)
+    abas_em_cache = carregar_abas_do_cache(chave_cache, colunas_custos_ler_final)
+    erro_leitura_estoque = None
+    inicio_leitura = time.perf_counter()
+    if abas_em_cache is not None:
+        custos_df, estoque_df = abas_em_cache
+        motor_usado = "cache"
+    else:
+        motor_usado = escolher_motor_leitura(motor_leitura) if modo_leitura == "padrao" else f"openpyxl ({modo_leitura})"
+        xls = pd.ExcelFile(io.BytesIO(conteudo_planilha), engine=motor_usado) if modo_leitura == "padrao" else None
+        abas_planilha = xls.sheet_names if xls is not None else listar_abas(conteudo_planilha)
+        # O esquema já confere as abas pelo XML; o leitor pode listar as abas de outra forma
+        abas_ausentes = [aba for aba in ['CUSTOS', 'ESTOQUE'] if aba not in abas_planilha]
+        if abas_ausentes:
+            raise ErroEsquemaPlanilha(" ".join(f"A aba '{aba}' não foi encontrada na planilha." for aba in abas_ausentes))
+
+        tipos_custos = {col: "texto" for col in dtypes_leitura}
+        tipos_custos.update({COL_VALOR_PEDIDO_CUSTOS: "numero", COL_QUANTIDADE_CUSTOS_ABA_CUSTOS: "numero", COL_DATA_CUSTOS: "data"})
+        if mapeamento:
+            # Lê as colunas pelo nome que têm na planilha; o nome padrão é aplicado logo após a leitura
+            colunas_custos_ler_final = [nomes_na_planilha.get(col, col) for col in colunas_custos_ler_final]
+            dtypes_leitura = {nomes_na_planilha.get(col, col): tipo for col, tipo in dtypes_leitura.items()}
+            tipos_custos = {nomes_na_planilha.get(col, col): tipo for col, tipo in tipos_custos.items()}
+        tipos_estoque = {0: "texto", 3: "texto", 6: "texto", 9: "texto"}
+        if modo_leitura == "paralelo":
+            # CUSTOS (em fatias de linhas) e ESTOQUE são lidas ao mesmo tempo em processos separados
+            abas_lidas = ler_abas_paralelo(conteudo_planilha, {
+                'CUSTOS': {"colunas": colunas_custos_ler_final, "tipos": tipos_custos},
+                'ESTOQUE': {"tipos": tipos_estoque}
+            }, callback_progresso=callback_progresso, aba_progresso='CUSTOS')
+            custos_df, estoque_df = abas_lidas['CUSTOS'], abas_lidas['ESTOQUE']
+            if isinstance(custos_df, Exception): raise custos_df
+            if isinstance(estoque_df, Exception):
+                erro_leitura_estoque = estoque_df; estoque_df = None
         else:
-            df_final_com_estoque['Unidades_Vendidas_Periodo'] = 0
-        
-        # Adicionar coluna de tipo de venda (simulação para demonstração)
-        if COL_TIPO_VENDA not in df_final_com_estoque.columns:
-            # Distribuir aleatoriamente entre as categorias para demonstração
-            # Em produção, isso seria determinado pelos dados reais
-            tipos_venda = ["Marketplaces", "Atacado", "Showroom"]
-            df_final_com_estoque[COL_TIPO_VENDA] = np.random.choice(tipos_venda, size=len(df_final_com_estoque))
-            
-            # Garantir que registros do Mercado Livre, Shopee, etc. sejam classificados como Marketplaces
-            if COL_PLATAFORMA_CUSTOS in df_final_com_estoque.columns:
-                marketplaces_conhecidos = ["Mercado Livre", "Shopee", "Amazon", "Magalu", "Americanas"]
-                mask_marketplaces = df_final_com_estoque[COL_PLATAFORMA_CUSTOS].isin(marketplaces_conhecidos)
-                df_final_com_estoque.loc[mask_marketplaces, COL_TIPO_VENDA] = "Marketplaces"
+            if modo_leitura == "streaming":
+                # Leitura em blocos com memória limitada; as colunas já saem tipadas
+                custos_df = ler_aba_streaming(conteudo_planilha, 'CUSTOS', colunas=colunas_custos_ler_final,
+                                              tipos=tipos_custos, callback_progresso=callback_progresso)
+            else:
+                custos_df = pd.read_excel(xls, sheet_name='CUSTOS', dtype=dtypes_leitura, 
+                                         usecols=lambda x: x in colunas_custos_ler_final)
+            try:
+                if modo_leitura == "streaming":
+                    estoque_df = ler_aba_streaming(conteudo_planilha, 'ESTOQUE', tipos=tipos_estoque)
+                else:
+                    estoque_df = pd.read_excel(xls, sheet_name='ESTOQUE', dtype={0: str, 3:str, 6:str, 9:str})
+            except Exception as e_leitura_estoque:
+                estoque_df = None; erro_leitura_estoque = e_leitura_estoque
+        if mapeamento:
+            custos_df = custos_df.rename(columns=mapeamento)
+            colunas_custos_ler_final = [mapeamento.get(col, col) for col in colunas_custos_ler_final]
+        if estoque_df is not None:
+            salvar_abas_no_cache(chave_cache, colunas_custos_ler_final, custos_df, estoque_df)
+    info_leitura = {"motor": motor_usado, "modo": modo_leitura, "tempo_s": time.perf_counter() - inicio_leitura,
+                    "linhas_custos": int(len(custos_df)), "chave": chave_cache,
+                    "tempo_validacao_s": esquema["tempo_s"], "colunas_renomeadas": mapeamento}
+    return custos_df, estoque_df, erro_leitura_estoque, info_leitura
+
+# Função para transformar as abas lidas no dataset do painel
+def _processar_abas(custos_df, estoque_df, erro_leitura_estoque, info_leitura, tipo_margem_selecionada_ui_proc,
+                    col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc, callback_etapa=None):
+    _iniciar_etapa(callback_etapa, "conversão", len(custos_df))
+    # Renomear coluna de tipo de anúncio para um nome padrão ANTES de qualquer filtro
+    if col_tipo_anuncio_ml_planilha_proc in custos_df.columns:
+        custos_df.rename(columns={col_tipo_anuncio_ml_planilha_proc: NOME_PADRAO_TIPO_ANUNCIO}, inplace=True)
+        custos_df[NOME_PADRAO_TIPO_ANUNCIO] = custos_df[NOME_PADRAO_TIPO_ANUNCIO].fillna("Não Informado").astype(str)
+    else:
+        custos_df[NOME_PADRAO_TIPO_ANUNCIO] = "Não Informado"
+
+    # Otimização: Converter apenas as colunas necessárias
+    custos_df[COL_VALOR_PEDIDO_CUSTOS] = pd.to_numeric(custos_df[COL_VALOR_PEDIDO_CUSTOS], errors='coerce').fillna(0)
+    custos_df[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS] = pd.to_numeric(custos_df[COL_QUANTIDADE_CUSTOS_ABA_CUSTOS], errors='coerce').fillna(0)
+    custos_df[COL_DATA_CUSTOS] = pd.to_datetime(custos_df[COL_DATA_CUSTOS], errors='coerce')
+    custos_df.dropna(subset=[COL_DATA_CUSTOS], inplace=True)
+
+    # O período de análise não faz parte do processamento: o dataset completo é ordenado por data
+    # uma única vez e cada período vira um recorte contíguo (ver filtrar_periodo_ordenado)
+    custos_df_filtrado_periodo = custos_df.sort_values(COL_DATA_CUSTOS, kind='mergesort').reset_index(drop=True)
+
+    if custos_df_filtrado_periodo.empty:
+        _avisar("Sem dados com data de venda válida na aba 'CUSTOS'.")
+        return pd.DataFrame()
+
+    _iniciar_etapa(callback_etapa, "margens", len(custos_df_filtrado_periodo))
+    # Processar ambas as margens de uma vez para evitar reprocessamento (kernel vetorizado, sem .apply por célula)
+    # Apenas os valores numéricos são guardados; o texto "15,23%" é gerado na exibição
+    if col_margem_estrategica in custos_df_filtrado_periodo.columns:
+        custos_df_filtrado_periodo['Margem_Estrategica_Num'] = converter_margem_vetorizado(custos_df_filtrado_periodo[col_margem_estrategica])
+    else:
+        custos_df_filtrado_periodo['Margem_Estrategica_Num'] = 0.0
         
-        # Adicionar coluna de estado para o mapa (simulação para demonstração)
-        if 'Estado' not in df_final_com_estoque.columns:
-            estados = ['SP', 'RJ', 'MG', 'RS', 'PR', 'SC', 'BA', 'PE', 'CE', 'GO', 'DF', 'ES', 'PA', 'AM', 'MA', 'MS', 'MT', 'PB', 'RN', 'AL', 'PI', 'SE', 'RO', 'TO', 'AC', 'AP', 'RR']
-            # Distribuição ponderada para estados com maior população
-            pesos = [25, 15, 12, 8, 7, 5, 4, 3, 3, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0.5, 0.5, 0.5]
-            pesos = [p/sum(pesos) for p in pesos]  # Normalizar pesos
-            df_final_com_estoque['Estado'] = np.random.choice(estados, size=len(df_final_com_estoque), p=pesos)
+    if col_margem_real in custos_df_filtrado_periodo.columns:
+        custos_df_filtrado_periodo['Margem_Real_Num'] = converter_margem_vetorizado(custos_df_filtrado_periodo[col_margem_real])
+    else:
+        custos_df_filtrado_periodo['Margem_Real_Num'] = 0.0
+    
+    # Definir a margem atual com base na seleção do usuário
+    if "Margem Estratégica (L)" in tipo_margem_selecionada_ui_proc:
+        custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Estrategica_Num']
+    elif "Margem Real (M)" in tipo_margem_selecionada_ui_proc:
+        custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Real_Num']
+    else:
+        custos_df_filtrado_periodo['Margem_Num'] = custos_df_filtrado_periodo['Margem_Estrategica_Num']
+    
+    _iniciar_etapa(callback_etapa, "estoque", len(custos_df_filtrado_periodo))
+    # SKU e conta viram categóricas antes do estoque: a busca de estoque é feita pelos códigos inteiros
+    df_final_com_estoque = codificar_colunas_categoricas(custos_df_filtrado_periodo, [
+        COL_SKU_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS, NOME_PADRAO_TIPO_ANUNCIO
+    ])
+    try:
+        if estoque_df is None: raise erro_leitura_estoque
+        # Uma única tabela de estoque por SKU, aplicada às vendas sem nenhum merge (nenhuma cópia do frame)
+        indice_estoque = construir_indice_estoque(estoque_df)
+        aplicar_indice_estoque(df_final_com_estoque, indice_estoque, COL_SKU_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL)
+    except Exception as e_merge_estoque:
+        _avisar(f"Erro ao processar Estoque: {e_merge_estoque}.")
+        for nome_col_est_fallback in list(ESTOQUE_MAP_CONFIG.keys()) + ['Estoque Full']:
+            if nome_col_est_fallback not in df_final_com_estoque.columns: df_final_com_estoque[nome_col_est_fallback] = 0
+    
+    if 'Estoque Full' in df_final_com_estoque.columns: df_final_com_estoque['Estoque Total Full'] = df_final_com_estoque['Estoque Full']
+    else: df_final_com_estoque['Estoque Total Full'] = 0
         
-        return df_final_com_estoque
+    if 'Margem_Num' in df_final_com_estoque.columns: df_final_com_estoque['Margem_Critica'] = df_final_com_estoque['Margem_Num'] < 10
+    else: df_final_com_estoque['Margem_Critica'] = False
+    if 'Estoque Tiny' in df_final_com_estoque.columns: df_final_com_estoque['Estoque_Parado_Alerta'] = df_final_com_estoque['Estoque Tiny'] > 10
+    else: df_final_com_estoque['Estoque_Parado_Alerta'] = False
+    
+    _iniciar_etapa(callback_etapa, "derivação", len(df_final_com_estoque))
+    # Tipo de venda e estado: valores da planilha ou, onde faltarem, a tabela de regras (regras_derivacao.json).
+    # Determinístico: a mesma planilha gera sempre o mesmo dataset
+    versao_regras_aplicadas = aplicar_regras_derivacao(df_final_com_estoque, col_conta=COL_CONTA_CUSTOS_ORIGINAL)
+    
+    # Dimensões de baixa cardinalidade viram categóricas: filtros comparam códigos inteiros e o frame encolhe
+    df_final_com_estoque = codificar_colunas_categoricas(df_final_com_estoque, [
+        COL_SKU_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL, COL_PLATAFORMA_CUSTOS,
+        NOME_PADRAO_TIPO_ANUNCIO, COL_TIPO_VENDA, 'Estado'
+    ])
+    
+    # Motor e tempo de leitura, exibidos no painel de administração. A versão do dataset combina a planilha, as regras
+    # e os parâmetros do processamento (colunas de margem e de tipo de anúncio, tipo de margem)
+    df_final_com_estoque.attrs['leitura'] = {**info_leitura, "regras": versao_regras_aplicadas,
+                                             "chave": hashlib.sha256(f"{info_leitura['chave']}|{versao_regras_aplicadas}".encode()).hexdigest()}
+    df_final_com_estoque.attrs['versao'] = versao_dataset(df_final_com_estoque.attrs['leitura']['chave'], col_margem_estrategica, col_margem_real,
+                                                          col_tipo_anuncio_ml_planilha_proc, tipo_margem_selecionada_ui_proc)
+    return df_final_com_estoque
+
+# Função que lê e processa o conteúdo de uma planilha (sem cache e sem mensagens de erro na tela)
+def processar_conteudo_planilha(conteudo_planilha, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                col_tipo_anuncio_ml_planilha_proc, modo_leitura="padrao", motor_leitura=None,
+                                callback_progresso=None, callback_etapa=None):
+    """
+    Núcleo de processar_planilha_otimizado, usado também pelas tarefas em segundo plano.
+    Erros são levantados (ErroEsquemaPlanilha para planilhas inválidas) em vez de exibidos.
+
+    Returns:
+        DataFrame processado (vazio se não houver vendas com data válida)
+    """
+    colunas_custos_ler_final, dtypes_leitura = colunas_leitura_custos(col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc)
+    abas_lidas = ler_abas_planilha(conteudo_planilha, colunas_custos_ler_final, dtypes_leitura,
+                                   modo_leitura, motor_leitura, callback_progresso, callback_etapa)
+    return _processar_abas(*abas_lidas, tipo_margem_selecionada_ui_proc, col_margem_estrategica,
+                           col_margem_real, col_tipo_anuncio_ml_planilha_proc, callback_etapa)
+
+# Função principal para processar a planilha, com otimizações de performance
+def processar_planilha_otimizado(
+    uploaded_file, 
+    tipo_margem_selecionada_ui_proc, 
+    col_margem_estrategica, # Nome do parâmetro como na chamada do app.py
+    col_margem_real,         # Nome do parâmetro como na chamada do app.py
+    col_tipo_anuncio_ml_planilha_proc, # Nome da coluna de tipo de anúncio da planilha
+    _dummy_rerun_arg=None,
+    modo_leitura="padrao", # "padrao" (pd.read_excel), "streaming" (openpyxl read_only em blocos) ou "paralelo" (abas e fatias em processos)
+    motor_leitura=None, # Motor do modo padrão: "calamine", "openpyxl" ou None (automático)
+    _callback_progresso=None, # Recebe (linhas_lidas, total_estimado, linhas_por_segundo); fora da chave do cache
+    versao_planilha=None # Hash do conteúdo, se o chamador já o tiver (evita recalcular)
+    ):
+    conteudo_planilha = uploaded_file.getvalue() if hasattr(uploaded_file, 'getvalue') else uploaded_file.read()
+    # As regras de derivação entram na chave: editar regras_derivacao.json gera um novo resultado
+    try: versao_regras_derivacao = versao_regras(carregar_regras_derivacao())
+    except ErroRegrasDerivacao as e_regras:
+        st.error(f"Regras de derivação: {e_regras}"); return None
+    with medir_carga(getattr(uploaded_file, 'name', "planilha"), modo_leitura, 1):
+        df = _processar_planilha_em_cache(
+            versao_planilha or calcular_hash_conteudo(conteudo_planilha), tipo_margem_selecionada_ui_proc, col_margem_estrategica,
+            col_margem_real, col_tipo_anuncio_ml_planilha_proc, _dummy_rerun_arg, modo_leitura, motor_leitura,
+            versao_regras_derivacao, conteudo_planilha, _callback_progresso)
+        registrar_linhas_carga(len(df) if df is not None else None)
+    return df
+
+# A chave do cache é a versão da planilha (hash) + versão das regras + parâmetros; o conteúdo (_conteudo_planilha) não é hasheado pelo Streamlit
+@st.cache_data(ttl=600, show_spinner=False)  # Cache por 10 minutos, sem mostrar spinner
+def _processar_planilha_em_cache(versao_planilha, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                 col_tipo_anuncio_ml_planilha_proc, _dummy_rerun_arg, modo_leitura, motor_leitura,
+                                 versao_regras_derivacao, _conteudo_planilha, _callback_progresso=None):
+    conteudo_planilha = _conteudo_planilha
+    try:
+        return processar_conteudo_planilha(conteudo_planilha, tipo_margem_selecionada_ui_proc, col_margem_estrategica,
+                                           col_margem_real, col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura,
+                                           _callback_progresso)
     
+    except ErroEsquemaPlanilha as e_esquema:
+        st.error(f"Planilha inválida: {e_esquema}")
+        return None
+    except ErroRegrasDerivacao as e_regras:
+        st.error(f"Regras de derivação: {e_regras}")
+        return None
     except Exception as e_geral_proc:
         st.error(f"Erro CRÍTICO no processamento: {str(e_geral_proc)}")
         st.error(traceback.format_exc())
         return None
 
-# Função para atualizar apenas a margem sem reprocessar todos os dados
+# Função executada em cada processo do lote: lê e processa uma planilha inteira
+def _processar_planilha_processo(conteudo_planilha, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                 col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura):
+    try:
+        return processar_conteudo_planilha(conteudo_planilha, tipo_margem_selecionada_ui_proc, col_margem_estrategica,
+                                           col_margem_real, col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura)
+    except Exception as e_planilha:
+        return e_planilha
+
+# Função executada em cada processo do lote: apenas lê as abas (modo histórico)
+def _ler_planilha_processo(conteudo_planilha, colunas_custos_ler_final, dtypes_leitura, modo_leitura, motor_leitura):
+    try:
+        return ler_abas_planilha(conteudo_planilha, colunas_custos_ler_final, dtypes_leitura, modo_leitura, motor_leitura)
+    except Exception as e_planilha:
+        return e_planilha
+
+# Função para executar uma tarefa por planilha em um pool de processos
+def _executar_lote(funcao, argumentos_por_arquivo, max_processos=None, callback_arquivo=None):
+    """
+    Executa funcao(*argumentos) para cada planilha, em paralelo quando há mais de um processo.
+    Dentro dos processos o modo "paralelo" vira "streaming": o paralelismo já está entre os arquivos.
+
+    Returns:
+        lista com o resultado de cada planilha, na ordem recebida
+    """
+    max_processos = max_processos or PROCESSOS_LEITURA or os.cpu_count() or 1
+    n_processos = min(max_processos, len(argumentos_por_arquivo))
+    resultados, concluidos = [None] * len(argumentos_por_arquivo), 0
+    if n_processos <= 1:
+        # Sem ganho com processos: processa no próprio processo (avisos aparecem direto na tela)
+        for i, argumentos in enumerate(argumentos_por_arquivo):
+            resultados[i] = funcao(*argumentos); concluidos += 1
+            if callback_arquivo: callback_arquivo(concluidos, len(argumentos_por_arquivo))
+        return resultados
+    argumentos_por_arquivo = [argumentos[:-2] + ("streaming" if argumentos[-2] == "paralelo" else argumentos[-2], argumentos[-1])
+                              for argumentos in argumentos_por_arquivo]
+    with ProcessPoolExecutor(max_workers=n_processos) as executor:
+        futuros = {executor.submit(funcao, *argumentos): i for i, argumentos in enumerate(argumentos_por_arquivo)}
+        try:
+            for futuro in as_completed(futuros):
+                try: resultados[futuros[futuro]] = futuro.result()
+                except Exception as e_processo: resultados[futuros[futuro]] = e_processo
+                concluidos += 1
+                if callback_arquivo: callback_arquivo(concluidos, len(argumentos_por_arquivo))
+        except BaseException:
+            # O callback pode interromper o lote (ex.: tarefa cancelada): planilhas ainda na fila não são iniciadas
+            executor.shutdown(wait=False, cancel_futures=True); raise
+    return resultados
+
+# Função para juntar datasets processados separadamente (um por planilha)
+def concatenar_datasets(dfs):
+    """
+    Concatena datasets processados e mantém as colunas categóricas como categóricas, com um
+    único dicionário ordenado (union_categoricals) em vez de voltar para texto no pd.concat.
+    O resultado é reordenado por data, como o dataset de uma planilha só.
+
+    Args:
+        dfs: Lista de DataFrames processados (None e vazios são ignorados)
+
+    Returns:
+        DataFrame concatenado, ordenado por data
+    """
+    dfs = [df for df in dfs if df is not None and not df.empty]
+    if not dfs: return pd.DataFrame()
+    if len(dfs) == 1: return dfs[0]
+    colunas = list(dict.fromkeys(col for df in dfs for col in df.columns))
+    colunas_categoricas = [col for col in colunas
+                           if any(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in dfs)]
+    categoricas_unidas = {
+        col: union_categoricals([
+            df[col].astype('category') if col in df.columns else pd.Categorical([None] * len(df))
+            for df in dfs
+        ], sort_categories=True)
+        for col in colunas_categoricas
+    }
+    df_unido = pd.concat([df.drop(columns=[c for c in colunas_categoricas if c in df.columns]) for df in dfs], ignore_index=True)
+    for col in colunas_categoricas: df_unido[col] = categoricas_unidas[col]
+    df_unido = df_unido[colunas]
+    if COL_DATA_CUSTOS in df_unido.columns:
+        df_unido = df_unido.sort_values(COL_DATA_CUSTOS, kind='mergesort').reset_index(drop=True)
+    return df_unido
+
+# Função que processa várias planilhas em paralelo e junta os resultados (sem cache)
+def processar_conteudos_em_lote(conteudos, nomes, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                col_tipo_anuncio_ml_planilha_proc, modo_leitura="padrao", motor_leitura=None,
+                                max_processos=None, callback_arquivo=None):
+    """
+    Núcleo de processar_planilhas_em_lote. Planilhas com erro ficam de fora e viram avisos.
+
+    Returns:
+        DataFrame com as vendas de todas as planilhas válidas ou None se nenhuma pôde ser processada
+    """
+    inicio_lote = time.perf_counter()
+    resultados = _executar_lote(_processar_planilha_processo, [
+        (conteudo, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+         col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura) for conteudo in conteudos
+    ], max_processos, callback_arquivo)
+
+    dfs_validos = []
+    for nome, resultado in zip(nomes, resultados):
+        if isinstance(resultado, Exception): _avisar(f"Erro ao processar '{nome}': {resultado}")
+        elif resultado is None or resultado.empty: _avisar(f"A planilha '{nome}' não tem vendas com data válida.")
+        else: dfs_validos.append(resultado)
+    if not dfs_validos: return None
+
+    # Ordem fixa pelo hash de cada planilha: o mesmo conjunto de arquivos gera sempre o mesmo dataset
+    dfs_validos.sort(key=lambda df: df.attrs['leitura']['chave'])
+    infos = [df.attrs['leitura'] for df in dfs_validos]
+    df_lote = concatenar_datasets(dfs_validos)
+    df_lote.attrs['leitura'] = {
+        "motor": ", ".join(sorted({info["motor"] for info in infos})), "modo": f"lote ({modo_leitura})",
+        "tempo_s": time.perf_counter() - inicio_lote, "linhas_custos": sum(info["linhas_custos"] for info in infos),
+        "chave": hashlib.sha256("|".join(info["chave"] for info in infos).encode()).hexdigest(),
+        "arquivos": len(infos)
+    }
+    df_lote.attrs['versao'] = versao_dataset(df_lote.attrs['leitura']['chave'], col_margem_estrategica, col_margem_real,
+                                             col_tipo_anuncio_ml_planilha_proc, tipo_margem_selecionada_ui_proc)
+    return df_lote
+
+# Função para processar várias planilhas (uma por conta) de uma vez
+def processar_planilhas_em_lote(
+    uploaded_files, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+    col_tipo_anuncio_ml_planilha_proc, _dummy_rerun_arg=None, modo_leitura="padrao", motor_leitura=None,
+    max_processos=None, _callback_arquivo=None, versoes_planilhas=None
+    ):
+    """
+    Processa cada planilha enviada em um processo do pool (mesmo pipeline de processar_planilha_otimizado)
+    e concatena os resultados; o tempo total tende ao da planilha mais demorada.
+    Planilhas com erro são informadas e ficam de fora do dataset.
+
+    Returns:
+        DataFrame com as vendas de todas as planilhas ou None se nenhuma pôde ser processada
+    """
+    nomes = [getattr(arquivo, 'name', f"planilha {i + 1}") for i, arquivo in enumerate(uploaded_files)]
+    conteudos = [arquivo.getvalue() if hasattr(arquivo, 'getvalue') else arquivo.read() for arquivo in uploaded_files]
+    versoes_planilhas = versoes_planilhas or [calcular_hash_conteudo(conteudo) for conteudo in conteudos]
+    with medir_carga(", ".join(nomes), f"lote ({modo_leitura})", len(conteudos)):
+        df = _processar_lote_em_cache(tuple(versoes_planilhas), tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                      col_tipo_anuncio_ml_planilha_proc, _dummy_rerun_arg, modo_leitura, motor_leitura, max_processos,
+                                      conteudos, nomes, _callback_arquivo)
+        registrar_linhas_carga(len(df) if df is not None else None)
+    return df
+
 @st.cache_data(ttl=600, show_spinner=False)
-def atualizar_margem_sem_reprocessamento(df, tipo_margem_selecionada):
+def _processar_lote_em_cache(versoes_planilhas, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                             col_tipo_anuncio_ml_planilha_proc, _dummy_rerun_arg, modo_leitura, motor_leitura, max_processos,
+                             _conteudos, _nomes, _callback_arquivo=None):
+    return processar_conteudos_em_lote(_conteudos, _nomes, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                       col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura, max_processos, _callback_arquivo)
+
+# Função que incorpora o conteúdo de uma ou mais planilhas ao histórico (sem mensagens de erro na tela)
+def incorporar_conteudos_ao_historico(conteudos, nomes, diretorio_historico, col_margem_estrategica, col_margem_real,
+                                      col_tipo_anuncio_ml_planilha_proc, modo_leitura="padrao", motor_leitura=None,
+                                      callback_progresso=None, callback_etapa=None):
+    """
+    Núcleo de incorporar_planilha_ao_historico. Erros são levantados em vez de exibidos.
+
+    Returns:
+        dict com o resumo da incorporação (ver incorporar_ao_historico)
+    """
+    colunas_custos_ler_final, dtypes_leitura = colunas_leitura_custos(col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc)
+    if len(conteudos) == 1:
+        custos_df, estoque_df, erro_leitura_estoque, _ = ler_abas_planilha(
+            conteudos[0], colunas_custos_ler_final, dtypes_leitura, modo_leitura, motor_leitura, callback_progresso, callback_etapa)
+    else:
+        _iniciar_etapa(callback_etapa, "leitura")
+        lidas = _executar_lote(_ler_planilha_processo, [
+            (conteudo, colunas_custos_ler_final, dtypes_leitura, modo_leitura, motor_leitura) for conteudo in conteudos
+        ])
+        for nome, abas_lidas in zip(nomes, lidas):
+            if isinstance(abas_lidas, Exception): raise ValueError(f"Erro ao ler '{nome}': {abas_lidas}")
+        lidas.sort(key=lambda abas_lidas: abas_lidas[3]['chave'])
+        custos_df = pd.concat([abas_lidas[0] for abas_lidas in lidas], ignore_index=True)
+        # ESTOQUE é lida por posição: as abas são empilhadas pelas posições das colunas
+        estoques = [abas_lidas[1] for abas_lidas in lidas if abas_lidas[1] is not None]
+        erros_estoque = [abas_lidas[2] for abas_lidas in lidas if abas_lidas[1] is None]
+        estoque_df = pd.concat([e.set_axis(range(e.shape[1]), axis=1) for e in estoques], ignore_index=True) if estoques and not erros_estoque else None
+        if estoque_df is not None: estoque_df.columns = list(estoques[0].columns) + list(estoque_df.columns[len(estoques[0].columns):])
+        erro_leitura_estoque = erros_estoque[0] if erros_estoque else None
+    if estoque_df is None: _avisar(f"Erro ao ler Estoque: {erro_leitura_estoque}. O estoque salvo no histórico foi mantido.")
+    _iniciar_etapa(callback_etapa, "histórico", len(custos_df))
+    return incorporar_ao_historico(custos_df, estoque_df, diretorio_historico, COL_DATA_CUSTOS, COL_CONTA_CUSTOS_ORIGINAL)
+
+# Função para incorporar uma planilha ao histórico persistente (apenas dias novos ou alterados)
+def incorporar_planilha_ao_historico(
+    uploaded_file, diretorio_historico, col_margem_estrategica, col_margem_real,
+    col_tipo_anuncio_ml_planilha_proc, modo_leitura="padrao", motor_leitura=None, _callback_progresso=None
+    ):
+    """
+    Lê a planilha enviada e grava no histórico mensal só os dias de venda novos ou alterados.
+    Com uma lista de planilhas, as abas são lidas em paralelo e incorporadas juntas (os dias são
+    substituídos por inteiro, então planilhas de contas diferentes não podem entrar uma de cada vez).
+
+    Returns:
+        dict com o resumo da incorporação (ver incorporar_ao_historico) ou None em caso de erro
+    """
+    try:
+        arquivos = uploaded_file if isinstance(uploaded_file, (list, tuple)) else [uploaded_file]
+        nomes = [getattr(arquivo, 'name', f"planilha {i + 1}") for i, arquivo in enumerate(arquivos)]
+        conteudos = [arquivo.getvalue() if hasattr(arquivo, 'getvalue') else arquivo.read() for arquivo in arquivos]
+        return incorporar_conteudos_ao_historico(conteudos, nomes, diretorio_historico, col_margem_estrategica, col_margem_real,
+                                                 col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura, _callback_progresso)
+    except ErroEsquemaPlanilha as e_esquema:
+        st.error(f"Planilha inválida: {e_esquema}")
+        return None
+    except ErroRegrasDerivacao as e_regras:
+        st.error(f"Regras de derivação: {e_regras}")
+        return None
+    except Exception as e_historico:
+        st.error(f"Erro ao incorporar a planilha ao histórico: {str(e_historico)}")
+        st.error(traceback.format_exc())
+        return None
+
+# Função que monta o dataset a partir do histórico (sem cache e sem mensagens de erro na tela)
+def processar_conteudo_historico(diretorio_historico, versao_historico, tipo_margem_selecionada_ui_proc,
+                                 col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc, callback_etapa=None):
+    """
+    Núcleo de processar_historico_vendas.
+
+    Returns:
+        DataFrame processado ou None se o histórico estiver vazio
+    """
+    _iniciar_etapa(callback_etapa, "leitura do histórico")
+    inicio_leitura = time.perf_counter()
+    abas_historico = carregar_historico(diretorio_historico)
+    if abas_historico is None:
+        _avisar("O histórico de vendas está vazio."); return None
+    custos_df, estoque_df = abas_historico
+    erro_leitura_estoque = None if estoque_df is not None else ValueError("nenhum estoque salvo no histórico")
+    info_leitura = {"motor": "histórico", "modo": "historico", "tempo_s": time.perf_counter() - inicio_leitura,
+                    "linhas_custos": int(len(custos_df)), "chave": versao_historico}
+    return _processar_abas(custos_df, estoque_df, erro_leitura_estoque, info_leitura, tipo_margem_selecionada_ui_proc,
+                           col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc, callback_etapa)
+
+# Função para montar o dataset do painel a partir do histórico persistente
+def processar_historico_vendas(
+    diretorio_historico, versao_historico, tipo_margem_selecionada_ui_proc,
+    col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc
+    ):
+    """
+    Processa as vendas acumuladas no histórico como se fossem uma única planilha.
+    As versões do histórico e das regras de derivação entram na chave do cache, então cada
+    incorporação (ou edição das regras) gera um novo resultado.
+    """
+    try: versao_regras_derivacao = versao_regras(carregar_regras_derivacao())
+    except ErroRegrasDerivacao as e_regras:
+        st.error(f"Regras de derivação: {e_regras}"); return None
+    return _processar_historico_em_cache(diretorio_historico, versao_historico, versao_regras_derivacao, tipo_margem_selecionada_ui_proc,
+                                         col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _processar_historico_em_cache(diretorio_historico, versao_historico, versao_regras_derivacao, tipo_margem_selecionada_ui_proc,
+                                  col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc):
+    try:
+        with medir_carga("Histórico", "historico"):
+            df = processar_conteudo_historico(diretorio_historico, versao_historico, tipo_margem_selecionada_ui_proc,
+                                              col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc)
+            registrar_linhas_carga(len(df) if df is not None else None)
+        return df
+    except Exception as e_geral_proc:
+        st.error(f"Erro CRÍTICO no processamento do histórico: {str(e_geral_proc)}")
+        st.error(traceback.format_exc())
+        return None
+
+# Função única de carga usada pelas tarefas em segundo plano (uma planilha, lote ou histórico)
+def executar_ingestao(conteudos, nomes, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                      col_tipo_anuncio_ml_planilha_proc, usar_historico=False, diretorio_historico=None,
+                      modo_leitura="padrao", motor_leitura=None, callback_progresso=None, callback_etapa=None,
+                      callback_arquivo=None):
+    """
+    Escolhe o fluxo como o upload da tela inicial: histórico (incorpora as planilhas e lê o histórico
+    completo), várias planilhas (lote em paralelo) ou uma planilha. Erros são levantados.
+
+    Args:
+        conteudos: Bytes de cada planilha (pode ser vazio ao abrir só o histórico)
+        nomes: Nome de cada planilha, usado nos avisos
+        callback_etapa: Chamado com o nome de cada etapa ao iniciá-la
+
+    Returns:
+        tuple (DataFrame ou None, resumo da incorporação ao histórico ou None)
+    """
+    resumo_incorporacao = None
+    descricao = ("Histórico" + (f" + {', '.join(nomes)}" if nomes else "")) if usar_historico else ", ".join(nomes)
+    with medir_carga(descricao, modo_leitura, len(conteudos)):
+        if usar_historico:
+            if conteudos:
+                resumo_incorporacao = incorporar_conteudos_ao_historico(
+                    conteudos, nomes, diretorio_historico, col_margem_estrategica, col_margem_real,
+                    col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura, callback_progresso, callback_etapa)
+            df = processar_conteudo_historico(diretorio_historico, versao_historico(diretorio_historico), tipo_margem_selecionada_ui_proc,
+                                              col_margem_estrategica, col_margem_real, col_tipo_anuncio_ml_planilha_proc, callback_etapa)
+        elif len(conteudos) > 1:
+            _iniciar_etapa(callback_etapa, "leitura")
+            df = processar_conteudos_em_lote(conteudos, nomes, tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                             col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura, callback_arquivo=callback_arquivo)
+        else:
+            df = processar_conteudo_planilha(conteudos[0], tipo_margem_selecionada_ui_proc, col_margem_estrategica, col_margem_real,
+                                             col_tipo_anuncio_ml_planilha_proc, modo_leitura, motor_leitura,
+                                             callback_progresso, callback_etapa)
+        registrar_linhas_carga(len(df) if df is not None else None)
+    return df, resumo_incorporacao
+
+# Função para recortar o período de análise no dataset já ordenado por data
+def filtrar_periodo_ordenado(df, data_inicio, data_fim, col_data='DIA DE VENDA'):
+    """
+    Retorna as linhas com data entre data_inicio e data_fim (inclusive) sem varrer o DataFrame.
+    Como o processamento entrega o dataset ordenado por data, o período corresponde a um
+    intervalo contíguo localizado com duas buscas binárias (np.searchsorted).
+    
+    Args:
+        df: DataFrame processado, ordenado pela coluna de data
+        data_inicio: Data inicial do período (date ou datetime)
+        data_fim: Data final do período (date ou datetime)
+        col_data: Nome da coluna de data
+        
+    Returns:
+        DataFrame com o recorte do período (fatia, sem cópia dos dados)
+    """
+    if df is None or df.empty or col_data not in df.columns:
+        return df
+    
+    pos_inicio, pos_fim = posicoes_periodo_ordenado(df, data_inicio, data_fim, col_data)
+    return df.iloc[pos_inicio:pos_fim]
+
+# Função que localiza o intervalo de linhas do período no dataset ordenado por data
+def posicoes_periodo_ordenado(df, data_inicio, data_fim, col_data='DIA DE VENDA', indice_dias=None):
+    """
+    Args:
+        indice_dias: Resultado de indexar_dias para este dataset (opcional): as buscas binárias
+            passam a ser feitas sobre os dias distintos, não sobre as linhas
+
+    Returns:
+        tuple (pos_inicio, pos_fim): o período são as linhas df.iloc[pos_inicio:pos_fim]
+    """
+    if indice_dias is not None:
+        dias, inicios = indice_dias
+        dia_inicio = pd.Timestamp(data_inicio).to_datetime64().astype('datetime64[D]')
+        dia_fim = pd.Timestamp(data_fim).to_datetime64().astype('datetime64[D]')
+        return int(inicios[np.searchsorted(dias, dia_inicio, side='left')]), int(inicios[np.searchsorted(dias, dia_fim, side='right')])
+    if df is None or df.empty or col_data not in df.columns:
+        return 0, (0 if df is None else len(df))
+    datas = df[col_data].to_numpy()
+    inicio = pd.Timestamp(data_inicio).normalize().to_datetime64().astype(datas.dtype)
+    fim_exclusivo = (pd.Timestamp(data_fim).normalize() + pd.Timedelta(days=1)).to_datetime64().astype(datas.dtype)
+    return int(np.searchsorted(datas, inicio, side='left')), int(np.searchsorted(datas, fim_exclusivo, side='left'))
+
+# Função que calcula onde começa cada dia no dataset ordenado por data
+def indexar_dias(df, col_data='DIA DE VENDA'):
+    """
+    Deslocamentos de dia do dataset ordenado por data, calculados uma vez por versão do dataset
+    (ver IndiceFiltros): o período vira duas buscas binárias sobre os dias distintos (centenas),
+    sem nenhum objeto Python por linha.
+
+    Returns:
+        tuple (dias, inicios): dias distintos (datetime64[D], crescentes) e a primeira linha de cada
+        um; inicios tem um elemento a mais, o total de linhas (o dia i são as linhas inicios[i]:inicios[i + 1])
+    """
+    datas = df[col_data].to_numpy().astype('datetime64[D]')
+    if len(datas) and (datas[1:] < datas[:-1]).any():
+        raise ValueError(f"O dataset não está ordenado por '{col_data}'.")
+    inicios = np.flatnonzero(np.concatenate([[True], datas[1:] != datas[:-1]])) if len(datas) else np.zeros(0, dtype=np.int64)
+    return datas[inicios], np.append(inicios, len(datas))
+
+# Função para atualizar apenas a margem sem reprocessar todos os dados
+def atualizar_margem_sem_reprocessamento(df, tipo_margem_selecionada, versao=None):
     """
     Atualiza apenas as colunas de margem no DataFrame sem reprocessar todos os dados.
+    O DataFrame recebido não é alterado (pode ser a visão compartilhada do registro de datasets).
     
     Args:
         df: DataFrame com os dados já processados
         tipo_margem_selecionada: Tipo de margem selecionada pelo usuário
+        versao: Versão do dataset processado (padrão: a de df.attrs); com ela, sessões que pedem
+            a mesma margem do mesmo dataset recebem o mesmo resultado
         
     Returns:
         DataFrame com as margens atualizadas
     """
     if df is None or df.empty:
         return df
-    
-    df_atualizado = df.copy()
-    
+    # Trocas sucessivas de margem partem sempre da versão do dataset processado
+    versao = versao or df.attrs.get('versao_base') or df.attrs.get('versao')
+    if versao is None:
+        return _aplicar_margem(df, tipo_margem_selecionada)
+    return _margem_compartilhada(versao, tipo_margem_selecionada, df)
+
+# st.cache_resource, não st.cache_data: o resultado é o mesmo objeto para todas as sessões (sem cópia
+# desserializada do dataset inteiro). A chave é só (versão, tipo de margem); o DataFrame (_df) não é hasheado
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _margem_compartilhada(versao, tipo_margem_selecionada, _df):
+    return _aplicar_margem(_df, tipo_margem_selecionada)
+
+def _aplicar_margem(df, tipo_margem_selecionada):
     # Verificar se temos as colunas necessárias
-    colunas_necessarias = ['Margem_Estrategica_Num', 'Margem_Estrategica_Original', 
-                          'Margem_Real_Num', 'Margem_Real_Original']
+    colunas_necessarias = ['Margem_Estrategica_Num', 'Margem_Real_Num']
     
-    if not all(col in df_atualizado.columns for col in colunas_necessarias):
+    if not all(col in df.columns for col in colunas_necessarias):
         return df  # Retornar o DataFrame original se não tiver as colunas necessárias
     
     # Atualizar as colunas de margem com base na seleção
     if "Margem Estratégica (L)" in tipo_margem_selecionada:
-        df_atualizado['Margem_Num'] = df_atualizado['Margem_Estrategica_Num']
-        df_atualizado['Margem_Original'] = df_atualizado['Margem_Estrategica_Original']
+        margem_num = df['Margem_Estrategica_Num']
     elif "Margem Real (M)" in tipo_margem_selecionada:
-        df_atualizado['Margem_Num'] = df_atualizado['Margem_Real_Num']
-        df_atualizado['Margem_Original'] = df_atualizado['Margem_Real_Original']
-    
-    # Atualizar a coluna de margem crítica
-    if 'Margem_Num' in df_atualizado.columns:
-        df_atualizado['Margem_Critica'] = df_atualizado['Margem_Num'] < 10
+        margem_num = df['Margem_Real_Num']
+    else:
+        return df
     
+    # assign cria um novo DataFrame sem copiar as demais colunas (copy-on-write)
+    df_atualizado = df.assign(Margem_Num=margem_num, Margem_Critica=margem_num < 10)
+    df_atualizado.attrs = {**df.attrs}
+    if 'versao' in df.attrs:
+        df_atualizado.attrs['versao_base'] = df.attrs.get('versao_base', df.attrs['versao'])
+        df_atualizado.attrs['versao'] = versao_dataset(df_atualizado.attrs['versao_base'], tipo_margem_selecionada)
     return df_atualizado
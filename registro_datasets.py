@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import weakref
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# --- REGISTRO DE DATASETS COMPARTILHADOS ---
+# Cada dataset processado é gravado uma única vez em Arrow IPC (sem compressão) e aberto por
+# memory-map: as colunas numéricas do DataFrame apontam direto para as páginas do arquivo, que
+# ficam no cache de páginas do sistema e são compartilhadas. Todas as sessões que carregam a mesma
+# versão recebem o mesmo DataFrame somente leitura (o copy-on-write do pandas garante que alterações
+# de uma sessão geram colunas novas só para ela)
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    ARROW_DISPONIVEL = True
+except ImportError:
+    ARROW_DISPONIVEL = False
+
+DATASETS_DIR = os.environ.get("VIAFLIX_DATASETS_DIR", "datasets_compartilhados")
+MAX_ARQUIVOS_DATASETS = int(os.environ.get("VIAFLIX_DATASETS_MAX_ARQUIVOS", "5"))  # Arquivos mantidos em disco (os em uso nunca são apagados)
+CHAVE_ATTRS = b"viaflix_attrs"
+
+_datasets = weakref.WeakValueDictionary()  # versão -> DataFrame compartilhado, enquanto alguma sessão o usar
+_trava_datasets = threading.Lock()
+
+
+def _caminho(versao):
+    return os.path.join(DATASETS_DIR, "".join(c for c in str(versao) if c.isalnum())[:64] + ".arrow")
+
+
+def _tabela_arrow(df):
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    # Floats com NaN viram nulos no Arrow e perderiam o zero-copy na volta; gravados como valores NaN, são mapeados direto
+    for i, coluna in enumerate(df.columns):
+        if df[coluna].dtype == np.float64 and tabela.column(i).null_count:
+            tabela = tabela.set_column(i, tabela.field(i), pa.array(df[coluna].to_numpy()))
+    metadados = {**(tabela.schema.metadata or {}), CHAVE_ATTRS: json.dumps(df.attrs, default=str).encode()}
+    return tabela.replace_schema_metadata(metadados)
+
+
+def _gravar(df, caminho):
+    os.makedirs(DATASETS_DIR, exist_ok=True)
+    caminho_tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        feather.write_feather(_tabela_arrow(df), caminho_tmp, compression="uncompressed")
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp): os.remove(caminho_tmp)
+
+
+def _abrir(caminho):
+    tabela = pa.ipc.open_file(pa.memory_map(caminho)).read_all()
+    # split_blocks evita consolidar as colunas em blocos 2D, o que copiaria os dados mapeados
+    df = tabela.to_pandas(split_blocks=True)
+    attrs = (tabela.schema.metadata or {}).get(CHAVE_ATTRS)
+    if attrs: df.attrs = json.loads(attrs)
+    return df
+
+
+def _remover_antigos():
+    # Mantém os arquivos mais recentes; versões ainda abertas por alguma sessão são preservadas
+    try: nomes = [n for n in os.listdir(DATASETS_DIR) if n.endswith(".arrow")]
+    except OSError: return
+    em_uso = {os.path.basename(_caminho(versao)) for versao in list(_datasets.keys())}
+    nomes.sort(key=lambda n: os.path.getmtime(os.path.join(DATASETS_DIR, n)), reverse=True)
+    for nome in nomes[MAX_ARQUIVOS_DATASETS:]:
+        if nome in em_uso: continue
+        try: os.remove(os.path.join(DATASETS_DIR, nome))
+        except OSError: pass
+
+
+def publicar_dataset(df, versao):
+    """
+    Registra o dataset processado e devolve a visão compartilhada dele. A primeira chamada
+    de uma versão grava o arquivo Arrow; as seguintes (de qualquer sessão) recebem o mesmo DataFrame.
+    Sem pyarrow, ou se alguma coluna não puder ser gravada, o próprio df é compartilhado em memória.
+
+    Args:
+        df: DataFrame processado
+        versao: Identificador do dataset (hash da planilha + parâmetros do processamento)
+
+    Returns:
+        DataFrame somente leitura compartilhado entre as sessões
+    """
+    if df is None or not versao:
+        return df
+    with _trava_datasets:
+        compartilhado = _datasets.get(versao)
+        if compartilhado is not None:
+            return compartilhado
+        compartilhado = df
+        if ARROW_DISPONIVEL:
+            caminho = _caminho(versao)
+            try:
+                if not os.path.exists(caminho): _gravar(df, caminho)
+                else: os.utime(caminho)
+                compartilhado = _abrir(caminho)
+            except Exception:
+                compartilhado = df  # Ex.: coluna object com tipos que o Arrow não aceita
+            _remover_antigos()
+        _datasets[versao] = compartilhado
+        return compartilhado
+
+
+def listar_datasets():
+    """
+    Lista os datasets publicados para exibição no painel de administração.
+    """
+    colunas = ["Versão", "Em uso", "Linhas", "Tamanho (MB)", "Gravado em"]
+    try: nomes = sorted(n for n in os.listdir(DATASETS_DIR) if n.endswith(".arrow"))
+    except OSError: nomes = []
+    with _trava_datasets:
+        abertos = {os.path.basename(_caminho(versao)): df for versao, df in list(_datasets.items())}
+    linhas = []
+    for nome in nomes:
+        caminho = os.path.join(DATASETS_DIR, nome)
+        try: estatisticas = os.stat(caminho)
+        except OSError: continue
+        df = abertos.get(nome)
+        linhas.append({
+            "Versão": nome[:16], "Em uso": df is not None, "Linhas": len(df) if df is not None else None,
+            "Tamanho (MB)": round(estatisticas.st_size / (1024 * 1024), 1),
+            "Gravado em": datetime.fromtimestamp(estatisticas.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    return pd.DataFrame(linhas, columns=colunas)
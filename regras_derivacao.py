@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# --- REGRAS DE DERIVAÇÃO DE TIPO DE VENDA E ESTADO ---
+# Quando a planilha não traz TIPO DE VENDA ou Estado (ou traz células vazias), os valores são
+# derivados por uma tabela de regras em JSON. As regras são avaliadas sobre os valores distintos
+# de cada coluna e aplicadas às linhas pelos códigos categóricos: o mesmo arquivo gera sempre o
+# mesmo resultado, e o custo acompanha a cardinalidade, não o número de linhas
+# O arquivo padrão fica ao lado deste módulo, independente do diretório de onde o app é iniciado
+CAMINHO_REGRAS_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regras_derivacao.json")
+CAMINHO_REGRAS_DERIVACAO = os.environ.get("VIAFLIX_REGRAS_DERIVACAO", CAMINHO_REGRAS_PADRAO)
+COL_TIPO_VENDA = 'TIPO DE VENDA'
+COL_ESTADO = 'Estado'
+
+# Base de cada seção (chaves ausentes no arquivo) e regras usadas se o arquivo padrão não existir
+REGRAS_MINIMAS = {
+    "tipo_venda": {"padrao": "Marketplaces", "regras": []},
+    "estado": {"padrao": "Não Informado", "coluna_cep": "CEP", "faixas_cep": [], "por_conta": {}},
+}
+
+
+class ErroRegrasDerivacao(ValueError):
+    """Arquivo de regras configurado ausente ou inválido."""
+
+
+def normalizar_texto(valor):
+    sem_acentos = unicodedata.normalize("NFKD", str(valor)).encode("ascii", "ignore").decode()
+    return " ".join(sem_acentos.upper().split())
+
+
+def carregar_regras_derivacao(caminho=None):
+    """
+    Lê a tabela de regras (JSON). Se o arquivo padrão não existir, avisa e usa REGRAS_MINIMAS;
+    um arquivo configurado (argumento ou VIAFLIX_REGRAS_DERIVACAO) ausente, ou qualquer arquivo
+    inválido, levanta ErroRegrasDerivacao em vez de trocar as regras em silêncio.
+
+    Returns:
+        dict com as seções "tipo_venda" e "estado"
+    """
+    caminho = caminho or CAMINHO_REGRAS_DERIVACAO
+    if not os.path.exists(caminho):
+        if os.path.abspath(caminho) != CAMINHO_REGRAS_PADRAO:
+            raise ErroRegrasDerivacao(f"arquivo de regras de derivação não encontrado: {caminho}")
+        warnings.warn(f"Arquivo de regras de derivação não encontrado ({caminho}); usando as regras mínimas.")
+        return REGRAS_MINIMAS
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f: regras = json.load(f)
+    except (OSError, ValueError) as e_regras:
+        raise ErroRegrasDerivacao(f"arquivo de regras de derivação inválido ({caminho}): {e_regras}") from e_regras
+    if not isinstance(regras, dict):
+        raise ErroRegrasDerivacao(f"arquivo de regras de derivação inválido ({caminho}): o conteúdo deve ser um objeto JSON.")
+    return {secao: {**REGRAS_MINIMAS[secao], **regras.get(secao, {})} for secao in REGRAS_MINIMAS}
+
+
+def versao_regras(regras):
+    """Hash curto das regras: entra na versão do dataset, então mudar as regras invalida os resultados em cache."""
+    return hashlib.sha256(json.dumps(regras, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def _codigos_e_valores(serie):
+    # (código de cada linha, valores distintos); -1 marca vazio. Categóricas usam o próprio dicionário
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), np.asarray(serie.cat.categories, dtype=object)
+    codigos, valores = pd.factorize(serie)
+    return codigos, np.asarray(valores, dtype=object)
+
+
+def _expandir(resultado_por_valor, codigos, vazio):
+    # Leva o resultado calculado por valor distinto para as linhas (código -1 recebe `vazio`)
+    return np.append(resultado_por_valor, vazio)[codigos]
+
+
+def _regra_casa(regra, valores):
+    normalizados = [normalizar_texto(v) for v in valores]
+    casa = np.zeros(len(valores), dtype=bool)
+    if "igual" in regra:
+        alvos = {normalizar_texto(v) for v in regra["igual"]}
+        casa |= np.array([v in alvos for v in normalizados], dtype=bool)
+    if "contem" in regra:
+        trechos = [normalizar_texto(t) for t in regra["contem"]]
+        casa |= np.array([any(t in v for t in trechos) for v in normalizados], dtype=bool)
+    if "regex" in regra:
+        padrao = re.compile(regra["regex"], re.IGNORECASE)
+        casa |= np.array([padrao.search(str(v)) is not None for v in valores], dtype=bool)
+    return casa
+
+
+def _categorica(rotulos_por_codigo, codigos):
+    # Categórica com dicionário ordenado a partir de códigos em uma lista de rótulos
+    ordem = np.argsort(np.asarray(rotulos_por_codigo, dtype=object))
+    novo_codigo = np.empty(len(ordem), dtype='int64'); novo_codigo[ordem] = np.arange(len(ordem))
+    return pd.Categorical.from_codes(novo_codigo[codigos], categories=[rotulos_por_codigo[i] for i in ordem]).remove_unused_categories()
+
+
+def _preencher_vazios(df, coluna, derivada):
+    # Valores já presentes na planilha têm prioridade; as regras só preenchem o que falta
+    if coluna not in df.columns:
+        return derivada
+    existente = df[coluna].astype(object)
+    vazio = existente.isna() | (existente.astype(str).str.strip() == "")
+    if not vazio.any():
+        return df[coluna].astype('category')
+    return pd.Series(np.where(vazio.to_numpy(), np.asarray(derivada, dtype=object), existente.to_numpy()),
+                     index=df.index).astype('category')
+
+
+def derivar_tipo_venda(df, regras):
+    """
+    Calcula TIPO DE VENDA pela primeira regra que casar (na ordem do arquivo) ou pelo valor padrão.
+    Cada regra testa uma coluna com "igual", "contem" (sem acentos/maiúsculas) ou "regex".
+
+    Returns:
+        pd.Categorical com uma posição por linha de df
+    """
+    config = regras["tipo_venda"]
+    rotulos = list(dict.fromkeys([config["padrao"]] + [regra["valor"] for regra in config["regras"]]))
+    resultado = np.full(len(df), -1, dtype='int64')
+    for regra in config["regras"]:
+        if not (resultado < 0).any(): break  # Todas as linhas já classificadas
+        if regra.get("coluna") not in df.columns: continue
+        codigos, valores = _codigos_e_valores(df[regra["coluna"]])
+        casa = _expandir(_regra_casa(regra, valores), codigos, False) & (resultado < 0)
+        resultado[casa] = rotulos.index(regra["valor"])
+    resultado[resultado < 0] = 0
+    return _categorica(rotulos, resultado)
+
+
+def _uf_por_cep(valores, faixas):
+    # Prefixo de 5 dígitos do CEP (zeros à esquerda restaurados) localizado por busca binária nas faixas
+    ufs = np.full(len(valores), None, dtype=object)
+    if not faixas or not len(valores): return ufs
+    faixas = sorted((int(ini), int(fim), uf) for ini, fim, uf in faixas)
+    inicios = np.array([f[0] for f in faixas]); fins = np.array([f[1] for f in faixas])
+    siglas = np.array([f[2] for f in faixas], dtype=object)
+    # CEP numérico ("1310100.0") perde o ".0"; depois ficam só os dígitos
+    digitos = pd.Series(valores, dtype=object).astype(str).str.replace(r"\.0$", "", regex=True).str.replace(r"\D", "", regex=True)
+    validos = digitos.str.len().between(5, 8).to_numpy().copy()
+    prefixos = np.full(len(valores), -1, dtype='int64')
+    prefixos[validos] = digitos[validos].str.zfill(8).str[:5].astype('int64').to_numpy()
+    pos = np.searchsorted(inicios, prefixos, side='right') - 1
+    validos &= pos >= 0
+    validos[validos] &= prefixos[validos] <= fins[pos[validos]]
+    ufs[validos] = siglas[pos[validos]]
+    return ufs
+
+
+def derivar_estado(df, regras, col_conta='CONTAS'):
+    """
+    Calcula o Estado pelo CEP (faixas de prefixo por UF), depois pela conta ("por_conta")
+    e por fim pelo valor padrão.
+
+    Returns:
+        pd.Categorical com uma posição por linha de df
+    """
+    config = regras["estado"]
+    # Rótulos possíveis (código 0 = padrão); as linhas carregam só o código
+    rotulos = list(dict.fromkeys([config["padrao"]] + [uf for _, _, uf in config["faixas_cep"]] + list(config["por_conta"].values())))
+    codigo_rotulo = {rotulo: i for i, rotulo in enumerate(rotulos)}
+    resultado = np.full(len(df), -1, dtype='int64')
+    col_cep = config.get("coluna_cep")
+    if col_cep in df.columns:
+        codigos, valores = _codigos_e_valores(df[col_cep])
+        uf_por_valor = np.array([codigo_rotulo.get(uf, -1) for uf in _uf_por_cep(valores, config["faixas_cep"])], dtype='int64')
+        resultado = _expandir(uf_por_valor, codigos, -1)
+    if config["por_conta"] and col_conta in df.columns and (resultado < 0).any():
+        por_conta = {normalizar_texto(conta): codigo_rotulo[uf] for conta, uf in config["por_conta"].items()}
+        codigos, valores = _codigos_e_valores(df[col_conta])
+        uf_conta = _expandir(np.array([por_conta.get(normalizar_texto(v), -1) for v in valores], dtype='int64'), codigos, -1)
+        resultado = np.where(resultado < 0, uf_conta, resultado)
+    resultado[resultado < 0] = 0
+    return _categorica(rotulos, resultado)
+
+
+def aplicar_regras_derivacao(df, regras=None, col_conta='CONTAS'):
+    """
+    Preenche TIPO DE VENDA e Estado (colunas ausentes ou células vazias) pelas regras. Altera df no lugar.
+
+    Args:
+        df: DataFrame de vendas
+        regras: Regras carregadas (None lê CAMINHO_REGRAS_DERIVACAO)
+        col_conta: Coluna de conta usada pelas regras de Estado
+
+    Returns:
+        str: versão das regras aplicadas
+    """
+    regras = regras or carregar_regras_derivacao()
+    df[COL_TIPO_VENDA] = _preencher_vazios(df, COL_TIPO_VENDA, derivar_tipo_venda(df, regras))
+    df[COL_ESTADO] = _preencher_vazios(df, COL_ESTADO, derivar_estado(df, regras, col_conta))
+    return versao_regras(regras)
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+# --- TAREFAS DE CARGA EM SEGUNDO PLANO ---
+# A leitura e o processamento das planilhas rodam em um pool de threads do processo do servidor,
+# fora da execução do script do Streamlit: a sessão continua respondendo (com o dataset anterior)
+# enquanto a carga avança. As tarefas ficam em um registro por chave (hash do conteúdo + parâmetros),
+# então uploads idênticos de sessões diferentes compartilham uma única tarefa
+TAREFAS_SIMULTANEAS = int(os.environ.get("VIAFLIX_TAREFAS_SIMULTANEAS", "2"))
+RETENCAO_TAREFAS_S = int(os.environ.get("VIAFLIX_TAREFAS_RETENCAO_S", "900"))  # Tarefas encerradas ficam no registro por este tempo
+
+ESTADO_NA_FILA = "na fila"
+ESTADO_EXECUTANDO = "executando"
+ESTADO_CONCLUIDA = "concluída"
+ESTADO_FALHOU = "falhou"
+ESTADO_CANCELADA = "cancelada"
+ESTADOS_ENCERRADOS = (ESTADO_CONCLUIDA, ESTADO_FALHOU, ESTADO_CANCELADA)
+
+_executor = ThreadPoolExecutor(max_workers=TAREFAS_SIMULTANEAS, thread_name_prefix="viaflix-carga")
+_tarefas = {}
+_trava_tarefas = threading.Lock()
+
+
+class TarefaCancelada(Exception):
+    """Levantada pelos callbacks de progresso quando a tarefa foi cancelada."""
+
+
+class TarefaIngestao:
+    """
+    Estado de uma carga em segundo plano. A função da tarefa informa o avanço pelos métodos
+    registrar_*; cada chamada também é o ponto onde o cancelamento é verificado.
+    """
+
+    def __init__(self, chave, descricao, etapas):
+        self.chave = chave
+        self.descricao = descricao
+        self.etapas = list(etapas)
+        self.estado = ESTADO_NA_FILA
+        self.etapa_atual = None
+        self.eventos = []  # (segundos desde o início, etapa)
+        self.linhas = None  # (linhas lidas, total estimado) durante a leitura
+        self.arquivos = None  # (planilhas concluídas, total) no lote
+        self.resultado = None
+        self.erro = None
+        self.avisos = []
+        self.inscritos = 1
+        self.criada_em = time.time()
+        self.iniciada_em = None
+        self.encerrada_em = None
+        self._cancelada = threading.Event()
+
+    def _verificar_cancelamento(self):
+        if self._cancelada.is_set(): raise TarefaCancelada(self.descricao)
+
+    def registrar_etapa(self, etapa):
+        self._verificar_cancelamento()
+        self.etapa_atual = etapa
+        self.linhas = None
+        self.eventos.append((time.time() - (self.iniciada_em or self.criada_em), etapa))
+
+    def registrar_linhas(self, linhas_lidas, total_estimado, linhas_por_segundo=None):
+        self._verificar_cancelamento()
+        self.linhas = (linhas_lidas, total_estimado)
+
+    def registrar_arquivos(self, arquivos_concluidos, total_arquivos):
+        self._verificar_cancelamento()
+        self.arquivos = (arquivos_concluidos, total_arquivos)
+
+    def cancelar(self):
+        """
+        Retira uma sessão da tarefa; a carga só é interrompida quando nenhuma sessão a acompanha mais.
+
+        Returns:
+            bool: True se a tarefa foi de fato cancelada
+        """
+        with _trava_tarefas:
+            self.inscritos = max(self.inscritos - 1, 0)
+            if self.inscritos == 0 and self.estado not in ESTADOS_ENCERRADOS:
+                self._cancelada.set()
+                if self.estado == ESTADO_NA_FILA: self._encerrar(ESTADO_CANCELADA)
+                return True
+        return False
+
+    @property
+    def encerrada(self):
+        return self.estado in ESTADOS_ENCERRADOS
+
+    @property
+    def progresso(self):
+        """
+        Returns:
+            tuple (fração de 0 a 1, texto da etapa atual)
+        """
+        if self.estado == ESTADO_CONCLUIDA: return 1.0, "Concluído"
+        if self.estado == ESTADO_NA_FILA: return 0.0, "Aguardando na fila..."
+        if self.etapa_atual not in self.etapas: return 0.0, "Iniciando..."
+        indice = self.etapas.index(self.etapa_atual)
+        fracao_etapa, texto = 0.0, self.etapa_atual.capitalize()
+        if self.arquivos and self.arquivos[1]:
+            fracao_etapa = self.arquivos[0] / self.arquivos[1]
+            texto += f" ({self.arquivos[0]} de {self.arquivos[1]} planilhas)"
+        elif self.linhas and self.linhas[1]:
+            fracao_etapa = min(self.linhas[0] / self.linhas[1], 1.0)
+            texto += f" ({self.linhas[0]:,} linhas)".replace(",", ".")
+        return min((indice + fracao_etapa) / len(self.etapas), 1.0), texto + "..."
+
+    def _encerrar(self, estado):
+        self.estado = estado
+        self.encerrada_em = time.time()
+
+
+def _executar(tarefa, funcao):
+    if tarefa._cancelada.is_set():
+        tarefa._encerrar(ESTADO_CANCELADA); return
+    tarefa.estado = ESTADO_EXECUTANDO
+    tarefa.iniciada_em = time.time()
+    try:
+        tarefa.resultado = funcao(tarefa)
+        tarefa._encerrar(ESTADO_CONCLUIDA)
+    except TarefaCancelada:
+        tarefa._encerrar(ESTADO_CANCELADA)
+    except Exception as e_tarefa:
+        tarefa.erro = e_tarefa
+        tarefa._encerrar(ESTADO_FALHOU)
+
+
+def _remover_expiradas(agora):
+    for chave in [chave for chave, tarefa in _tarefas.items()
+                  if tarefa.encerrada and agora - tarefa.encerrada_em > RETENCAO_TAREFAS_S]:
+        del _tarefas[chave]
+
+
+def iniciar_tarefa(chave, funcao, descricao, etapas):
+    """
+    Enfileira funcao(tarefa) no pool, ou reaproveita a tarefa com a mesma chave que esteja na fila,
+    em execução ou concluída (falhas e cancelamentos são refeitos).
+
+    Args:
+        chave: Identificador da carga (hash do conteúdo + parâmetros)
+        funcao: Recebe a TarefaIngestao e retorna o resultado
+        descricao: Texto exibido no painel de administração
+        etapas: Nomes das etapas, na ordem, usados no cálculo do progresso
+
+    Returns:
+        TarefaIngestao
+    """
+    with _trava_tarefas:
+        _remover_expiradas(time.time())
+        existente = _tarefas.get(chave)
+        if existente is not None and existente.estado not in (ESTADO_FALHOU, ESTADO_CANCELADA):
+            existente.inscritos += 1
+            return existente
+        tarefa = TarefaIngestao(chave, descricao, etapas)
+        _tarefas[chave] = tarefa
+    _executor.submit(_executar, tarefa, funcao)
+    return tarefa
+
+
+def obter_tarefa(chave):
+    with _trava_tarefas:
+        return _tarefas.get(chave)
+
+
+def listar_tarefas():
+    """
+    Lista as tarefas do registro para exibição no painel de administração.
+    """
+    colunas = ["Tarefa", "Estado", "Etapa", "Sessões", "Criada em", "Duração (s)"]
+    with _trava_tarefas:
+        _remover_expiradas(time.time())
+        tarefas = sorted(_tarefas.values(), key=lambda t: t.criada_em, reverse=True)
+    agora = time.time()
+    return pd.DataFrame([{
+        "Tarefa": tarefa.descricao, "Estado": tarefa.estado, "Etapa": tarefa.etapa_atual or "-",
+        "Sessões": tarefa.inscritos,
+        "Criada em": datetime.fromtimestamp(tarefa.criada_em).strftime("%Y-%m-%d %H:%M:%S"),
+        "Duração (s)": round((tarefa.encerrada_em or agora) - (tarefa.iniciada_em or agora), 2),
+    } for tarefa in tarefas], columns=colunas)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do painel ficam na raiz do repositório (sem pacote instalável)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import banco_vendas
+import cache_planilhas
+from gerar_planilhas_sinteticas import gerar_dados_sinteticos, escrever_planilha
+from personalizar_tabela_melhorado import personalizar_tabela_por_marketplace
+from processar_planilha_otimizado_melhorado import processar_conteudo_planilha
+
+TIPOS_MARGEM = ("Margem Estratégica (L)", "Margem Real (M)")
+COLUNAS_ALERTA = ['SKU PRODUTOS', 'ID DO PRODUTO', 'CONTAS', 'PLATAFORMA', 'Margem_Num', 'Estoque Tiny', 'Estoque Total Full']
+
+
+@pytest.fixture(scope="module")
+def banco(tmp_path_factory):
+    diretorio = tmp_path_factory.mktemp("banco")
+    custos_df, estoque_df = gerar_dados_sinteticos(2000, n_skus=60, n_contas=3, dias=60, semente=5)
+    escrever_planilha(custos_df, estoque_df, str(diretorio / "vendas.xlsx"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(cache_planilhas, "CACHE_DIR", str(diretorio / "cache"))
+        df = processar_conteudo_planilha((diretorio / "vendas.xlsx").read_bytes(), TIPOS_MARGEM[0],
+                                         'MARGEM ESTRATÉGICA', 'MARGEM REAL', 'TIPO ANUNCIO ML')
+    caminho, versao = str(diretorio / "vendas.sqlite"), df.attrs['leitura']['chave']
+    banco_vendas.salvar_vendas_no_banco(df, versao, caminho)
+    ultimo_dia = df['DIA DE VENDA'].max().date()
+    filtros = [
+        {"data_inicio": ultimo_dia - pd.Timedelta(days=20), "data_fim": ultimo_dia},
+        {"data_inicio": ultimo_dia - pd.Timedelta(days=40), "data_fim": ultimo_dia, "conta": df['CONTAS'].iloc[0],
+         "tipo_venda": "Marketplaces", "plataforma": "Mercado Livre"},
+    ]
+    return versao, caminho, filtros
+
+
+def test_produtos_iguais_a_tabela_montada_das_linhas(banco):
+    versao, caminho, filtros = banco
+    for filtro in filtros:
+        for tipo_margem in TIPOS_MARGEM:
+            linhas = banco_vendas.consultar_vendas(versao, filtro, tipo_margem, caminho)
+            esperado = personalizar_tabela_por_marketplace(linhas, "Todos", tipo_margem).reset_index(drop=True)
+            produtos = banco_vendas.consultar_produtos(versao, filtro, tipo_margem, caminho)
+            obtido = personalizar_tabela_por_marketplace(produtos, "Todos", tipo_margem).reset_index(drop=True)
+            pd.testing.assert_frame_equal(obtido, esperado, check_categorical=False)
+
+
+@pytest.mark.parametrize("medida", ["pedidos", "faturamento", "valor_medio"])
+def test_agregacao_por_dimensao_igual_as_linhas(banco, medida):
+    versao, caminho, filtros = banco
+    for filtro in filtros:
+        linhas = banco_vendas.consultar_vendas(versao, filtro, TIPOS_MARGEM[0], caminho)
+        for coluna in ['CONTAS', 'PLATAFORMA', 'Estado', 'TIPO DE VENDA', 'Tipo de Anúncio']:
+            agrupado = linhas.groupby(coluna, observed=True)['VALOR DO PEDIDO']
+            esperado = {"pedidos": agrupado.size(), "faturamento": agrupado.sum(), "valor_medio": agrupado.mean()}[medida]
+            obtido = banco_vendas.consultar_por_dimensao(versao, coluna, filtro, medida, caminho)
+            assert sorted(obtido.index) == sorted(esperado.index.astype(str))
+            np.testing.assert_allclose([obtido[str(valor)] for valor in esperado.index], esperado.to_numpy())
+
+
+@pytest.mark.parametrize("tipo_alerta, coluna_alerta", [
+    ("Todos", None), ("Margens Críticas", "Margem_Critica"), ("Estoque Parado", "Estoque_Parado_Alerta")])
+def test_alertas_iguais_ao_filtro_sobre_as_linhas(banco, tipo_alerta, coluna_alerta):
+    versao, caminho, filtros = banco
+    for filtro in filtros:
+        for tipo_margem in TIPOS_MARGEM:
+            linhas = banco_vendas.consultar_vendas(versao, filtro, tipo_margem, caminho)
+            if coluna_alerta: linhas = linhas[linhas[coluna_alerta]]
+            esperado = linhas[COLUNAS_ALERTA].drop_duplicates().reset_index(drop=True)
+            obtido = banco_vendas.consultar_alertas(versao, filtro, tipo_margem, tipo_alerta, caminho=caminho)
+            pd.testing.assert_frame_equal(obtido[COLUNAS_ALERTA].reset_index(drop=True), esperado, check_categorical=False)
+
+            # Ordenação e limite no banco: a página é o começo da lista ordenada
+            pagina = banco_vendas.consultar_alertas(versao, filtro, tipo_margem, tipo_alerta, ordenar_por="Margem",
+                                                    crescente=False, limite=10, caminho=caminho)
+            assert list(pagina['Margem_Num']) == sorted(esperado['Margem_Num'], reverse=True)[:10]
+
+
+def test_versao_removida_do_banco(tmp_path, monkeypatch):
+    monkeypatch.setattr(banco_vendas, "MAX_VERSOES_BANCO", 1)
+    caminho = str(tmp_path / "vendas.sqlite")
+    df = pd.DataFrame({'DIA DE VENDA': pd.to_datetime(["2024-01-01", "2024-01-02"]), 'SKU PRODUTOS': ["A", "B"],
+                       'VALOR DO PEDIDO': [10.0, 20.0], 'Margem_Estrategica_Num': [15.0, 5.0], 'Margem_Real_Num': [12.0, 4.0]})
+    banco_vendas.salvar_vendas_no_banco(df, "antiga", caminho)
+    banco_vendas.salvar_vendas_no_banco(df, "nova", caminho)  # Passa de MAX_VERSOES_BANCO: a antiga sai do banco
+
+    assert banco_vendas.versao_no_banco("nova", caminho) and not banco_vendas.versao_no_banco("antiga", caminho)
+    assert banco_vendas.consultar_metricas("nova", {}, TIPOS_MARGEM[0], caminho)["pedidos"] == 2
+    for consulta in (lambda: banco_vendas.consultar_metricas("antiga", {}, TIPOS_MARGEM[0], caminho),
+                     lambda: banco_vendas.consultar_opcoes_filtros("antiga", caminho),
+                     lambda: banco_vendas.consultar_alertas("antiga", {}, TIPOS_MARGEM[0], caminho=caminho)):
+        with pytest.raises(banco_vendas.VersaoBancoRemovida):
+            consulta()
@@ -0,0 +1,76 @@
+import io
+
+import pandas as pd
+import pytest
+
+import cache_planilhas
+from gerar_planilhas_sinteticas import gerar_dados_sinteticos, escrever_planilha
+from historico_vendas import carregar_historico
+from processar_planilha_otimizado_melhorado import incorporar_conteudos_ao_historico
+
+COLUNAS_MARGEM = ('MARGEM ESTRATÉGICA', 'MARGEM REAL', 'TIPO ANUNCIO ML')
+
+
+def _planilha(custos_df, estoque_df, tmp_path, nome):
+    caminho = tmp_path / f"{nome}.xlsx"
+    escrever_planilha(custos_df, estoque_df, str(caminho))
+    return caminho.read_bytes()
+
+
+@pytest.fixture
+def dados(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_planilhas, "CACHE_DIR", str(tmp_path / "cache"))
+    custos_df, estoque_df = gerar_dados_sinteticos(600, n_skus=40, n_contas=2, dias=5, proporcao_sem_data=0, semente=7)
+    return custos_df, estoque_df
+
+
+def _incorporar(conteudo, diretorio):
+    return incorporar_conteudos_ao_historico([conteudo], ["planilha.xlsx"], str(diretorio), *COLUNAS_MARGEM)
+
+
+def test_planilhas_de_contas_diferentes_no_mesmo_dia_se_somam(dados, tmp_path):
+    custos_df, estoque_df = dados
+    contas = sorted(custos_df['CONTAS'].unique())
+    assert len(contas) == 2
+    por_conta = {conta: custos_df[custos_df['CONTAS'] == conta].reset_index(drop=True) for conta in contas}
+    diretorio = tmp_path / "historico"
+
+    primeira = _incorporar(_planilha(por_conta[contas[0]], estoque_df, tmp_path, "a"), diretorio)
+    segunda = _incorporar(_planilha(por_conta[contas[1]], estoque_df, tmp_path, "b"), diretorio)
+    assert primeira["dias_novos"] and not segunda["dias_novos"]  # Os mesmos dias, agora com a outra conta
+
+    historico, _ = carregar_historico(str(diretorio))
+    assert historico['CONTAS'].value_counts().to_dict() == {conta: len(df) for conta, df in por_conta.items()}
+
+    # Reenviar uma conta com um dia alterado troca só as linhas daquela conta naquele dia
+    alterada = por_conta[contas[0]].copy()
+    dia = pd.to_datetime(alterada['DIA DE VENDA']).dt.normalize()
+    primeiro_dia = dia.min()
+    alterada.loc[dia == primeiro_dia, 'QUANTIDADE'] += 1
+    resumo = _incorporar(_planilha(alterada, estoque_df, tmp_path, "a2"), diretorio)
+    assert resumo["dias_alterados"] == [f"{primeiro_dia:%Y-%m-%d}"] and resumo["linhas_gravadas"] == int((dia == primeiro_dia).sum())
+    historico, _ = carregar_historico(str(diretorio))
+    assert historico['CONTAS'].value_counts().to_dict() == {conta: len(df) for conta, df in por_conta.items()}
+    assert historico['QUANTIDADE'].sum() == custos_df['QUANTIDADE'].sum() + int((dia == primeiro_dia).sum())
+
+
+def test_colunas_vazias_do_estoque_mantem_o_estoque_salvo(dados, tmp_path):
+    custos_df, estoque_df = dados
+    diretorio = tmp_path / "historico"
+    _incorporar(_planilha(custos_df, estoque_df, tmp_path, "completa"), diretorio)
+
+    # Planilha só com o depósito VF: os outros depósitos ficam como estavam
+    so_vf = estoque_df.astype(object)
+    so_vf.iloc[:, 1] = estoque_df.iloc[:, 1] + 1
+    so_vf.iloc[:, 3:] = None
+    resumo = _incorporar(_planilha(custos_df, so_vf, tmp_path, "so_vf"), diretorio)
+    assert resumo["estoque_atualizado"] and not resumo["dias_novos"] and not resumo["dias_alterados"]
+
+    _, estoque_salvo = carregar_historico(str(diretorio))
+    def _quantidades(df, posicao): return pd.to_numeric(df.iloc[:, posicao].dropna()).tolist()
+    def _skus(df, posicao): return df.iloc[:, posicao].dropna().tolist()
+    assert _skus(estoque_salvo, 0) == _skus(estoque_df, 0)
+    assert _quantidades(estoque_salvo, 1) == [q + 1 for q in _quantidades(estoque_df, 1)]
+    for sku, qtd in ((3, 4), (6, 7), (9, 10)):
+        assert _skus(estoque_salvo, sku) == _skus(estoque_df, sku)
+        assert _quantidades(estoque_salvo, qtd) == _quantidades(estoque_df, qtd)
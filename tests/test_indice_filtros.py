@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import indice_filtros
+from gerar_planilhas_sinteticas import gerar_dados_sinteticos
+from indice_filtros import obter_recorte
+
+
+@pytest.fixture
+def dataset():
+    df, _ = gerar_dados_sinteticos(3000, n_skus=60, semente=5)
+    df['DIA DE VENDA'] = pd.to_datetime(df['DIA DE VENDA'])
+    df = df.sort_values('DIA DE VENDA', kind='mergesort').reset_index(drop=True)
+    for coluna in ('CONTAS', 'PLATAFORMA', 'TIPO ANUNCIO ML'): df[coluna] = df[coluna].astype('category')
+    df = df.rename(columns={'TIPO ANUNCIO ML': 'Tipo de Anúncio'})
+    df.attrs['versao'] = "teste-recorte"
+    return df
+
+
+def test_recorte_guarda_posicoes_e_monta_as_visoes_a_cada_acesso(dataset, monkeypatch):
+    monkeypatch.setattr(indice_filtros, "_recortes", type(indice_filtros._recortes)())
+    datas = dataset['DIA DE VENDA']
+    filtros = {"data_inicio": datas.iloc[300].date(), "data_fim": datas.iloc[2500].date(), "conta": "Monaco",
+               "tipo_venda": "Todos", "plataforma": "Mercado Livre", "tipo_anuncio": "Todos"}
+    recorte = obter_recorte(dataset, filtros)
+    assert obter_recorte(dataset, dict(filtros)) is recorte
+    assert recorte.posicoes.dtype == np.int32
+
+    periodo = dataset[(datas.dt.date >= filtros["data_inicio"]) & (datas.dt.date <= filtros["data_fim"])]
+    esperado = periodo[(periodo['CONTAS'] == "Monaco") & (periodo['PLATAFORMA'] == "Mercado Livre")]
+    pd.testing.assert_frame_equal(recorte.por_data, periodo)
+    pd.testing.assert_frame_equal(recorte.filtrado, esperado)
+    assert recorte.filtrado is not recorte.filtrado  # Take a cada acesso: nenhuma cópia fica no LRU
+
+    sem_filtros = obter_recorte(dataset, {"data_inicio": None, "data_fim": None})
+    assert sem_filtros.posicoes is None
+    pd.testing.assert_frame_equal(sem_filtros.filtrado, dataset)
@@ -0,0 +1,131 @@
+import io
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import cache_planilhas
+import leitura_planilha
+import processar_planilha_otimizado_melhorado
+from gerar_planilhas_sinteticas import gerar_dados_sinteticos, escrever_planilha
+from processar_planilha_otimizado_melhorado import (
+    ErroEsquemaPlanilha, colunas_leitura_custos, ler_abas_planilha, processar_conteudo_planilha, verificar_paridade_motores,
+)
+
+COLUNAS_MARGEM = ('MARGEM ESTRATÉGICA', 'MARGEM REAL', 'TIPO ANUNCIO ML')
+MODOS = ("padrao", "streaming", "paralelo")
+
+
+@pytest.fixture(scope="module")
+def planilha(tmp_path_factory):
+    # PREÇO UND não tem tipo declarado na leitura: preços inteiros misturados aos com centavos
+    custos_df, estoque_df = gerar_dados_sinteticos(1500, n_skus=80, semente=3)
+    precos = custos_df['PREÇO UND'].astype(object)
+    precos[::7] = [int(preco) for preco in precos[::7]]
+    custos_df['PREÇO UND'] = precos
+    caminho = tmp_path_factory.mktemp("planilhas") / "vendas.xlsx"
+    escrever_planilha(custos_df, estoque_df, str(caminho))
+    return caminho.read_bytes()
+
+
+@pytest.fixture(autouse=True)
+def fatias_pequenas(monkeypatch):
+    # Fatias pequenas para que o modo paralelo junte mais de uma fatia por aba
+    monkeypatch.setattr(leitura_planilha, "LINHAS_POR_FATIA", 400)
+
+
+def _sem_cache_em_disco(monkeypatch, diretorio):
+    # Cada modo lê um cache vazio: com o cache em disco compartilhado, os modos seguintes receberiam as abas do primeiro
+    monkeypatch.setattr(cache_planilhas, "CACHE_DIR", str(diretorio))
+
+
+def _ler(planilha, modo, monkeypatch, tmp_path, motor=None):
+    _sem_cache_em_disco(monkeypatch, tmp_path / f"{modo}-{motor}")
+    colunas, dtypes_leitura = colunas_leitura_custos(*COLUNAS_MARGEM)
+    custos_df, estoque_df, erro_estoque, info = ler_abas_planilha(planilha, colunas, dtypes_leitura, modo_leitura=modo,
+                                                                  motor_leitura=motor)
+    assert erro_estoque is None
+    if motor is not None: assert info["motor"] == motor
+    return custos_df, estoque_df
+
+
+def test_modos_de_leitura_devolvem_os_mesmos_tipos_e_valores(planilha, monkeypatch, tmp_path):
+    custos_padrao, estoque_padrao = _ler(planilha, "padrao", monkeypatch, tmp_path)
+    assert custos_padrao['PREÇO UND'].dtype == 'float64'
+    for modo in MODOS[1:]:
+        custos_df, estoque_df = _ler(planilha, modo, monkeypatch, tmp_path)
+        pd.testing.assert_series_equal(custos_df.dtypes, custos_padrao.dtypes, obj=f"tipos CUSTOS ({modo})")
+        pd.testing.assert_series_equal(estoque_df.dtypes, estoque_padrao.dtypes, obj=f"tipos ESTOQUE ({modo})")
+        pd.testing.assert_frame_equal(custos_df, custos_padrao, obj=f"CUSTOS ({modo})")
+        pd.testing.assert_frame_equal(estoque_df, estoque_padrao, check_names=False, obj=f"ESTOQUE ({modo})")
+
+
+def test_modos_de_leitura_geram_o_mesmo_dataset(planilha, monkeypatch, tmp_path):
+    processados = {}
+    for modo in MODOS:
+        _sem_cache_em_disco(monkeypatch, tmp_path / modo)
+        processados[modo] = processar_conteudo_planilha(planilha, "Margem Estratégica (L)", *COLUNAS_MARGEM, modo_leitura=modo)
+    for modo in MODOS[1:]:
+        pd.testing.assert_frame_equal(processados[modo], processados["padrao"], obj=f"dataset ({modo})")
+
+
+def test_versao_do_dataset_inclui_os_parametros_do_processamento(planilha, monkeypatch, tmp_path):
+    _sem_cache_em_disco(monkeypatch, tmp_path)
+    versoes = {processar_conteudo_planilha(planilha, "Margem Estratégica (L)", *colunas).attrs['versao']
+               for colunas in (COLUNAS_MARGEM, ('MARGEM ESTRATÉGICA', 'MARGEM ESTRATÉGICA', 'TIPO ANUNCIO ML'),
+                               ('MARGEM ESTRATÉGICA', 'MARGEM REAL', 'PLATAFORMA'))}
+    assert len(versoes) == 3
+
+
+def test_calamine_e_openpyxl_devolvem_os_mesmos_tipos_e_valores(planilha, monkeypatch, tmp_path):
+    pytest.importorskip("python_calamine")
+    custos_openpyxl, estoque_openpyxl = _ler(planilha, "padrao", monkeypatch, tmp_path, motor="openpyxl")
+    custos_calamine, estoque_calamine = _ler(planilha, "padrao", monkeypatch, tmp_path, motor="calamine")
+    pd.testing.assert_series_equal(custos_calamine.dtypes, custos_openpyxl.dtypes, obj="tipos CUSTOS (calamine)")
+    pd.testing.assert_frame_equal(custos_calamine, custos_openpyxl, obj="CUSTOS (calamine)")
+    pd.testing.assert_frame_equal(estoque_calamine, estoque_openpyxl, check_names=False, obj="ESTOQUE (calamine)")
+
+    colunas, dtypes_leitura = colunas_leitura_custos(*COLUNAS_MARGEM)
+    paridade = verificar_paridade_motores(planilha, colunas, dtypes_leitura)
+    divergentes = paridade[~(paridade["Mesmo dtype"] & paridade["Mesmos valores"])]
+    assert divergentes.empty, divergentes.to_string()
+
+
+@pytest.mark.parametrize("intervalo", [(2, 401), (401, 800), (1200, None), (1490, 1600)])
+def test_intervalo_de_linhas_sem_parser_interno_do_openpyxl(planilha, monkeypatch, intervalo):
+    def _linhas():
+        wb = openpyxl.load_workbook(io.BytesIO(planilha), read_only=True, data_only=True)
+        try: return list(leitura_planilha._iterar_linhas_intervalo(wb['CUSTOS'], *intervalo))
+        finally: wb.close()
+
+    com_parser = _linhas()
+    monkeypatch.setattr(leitura_planilha, "PARSER_OPENPYXL_DISPONIVEL", False)
+    assert _linhas() == com_parser
+
+
+def test_modo_paralelo_sem_parser_interno_do_openpyxl(planilha, monkeypatch, tmp_path):
+    custos_padrao, estoque_padrao = _ler(planilha, "padrao", monkeypatch, tmp_path)
+    monkeypatch.setattr(leitura_planilha, "PARSER_OPENPYXL_DISPONIVEL", False)
+    custos_df, estoque_df = _ler(planilha, "paralelo", monkeypatch, tmp_path)
+    pd.testing.assert_frame_equal(custos_df, custos_padrao)
+    pd.testing.assert_frame_equal(estoque_df, estoque_padrao, check_names=False)
+
+
+@pytest.mark.parametrize("modo", MODOS)
+def test_aba_ausente_levanta_erro_de_esquema(modo, monkeypatch, tmp_path):
+    custos_df, _ = gerar_dados_sinteticos(50, semente=1)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('CUSTOS')
+    ws.append(list(custos_df.columns))
+    for linha in custos_df.astype(object).where(custos_df.notna(), None).itertuples(index=False): ws.append(list(linha))
+    arquivo = io.BytesIO(); wb.save(arquivo)
+    _sem_cache_em_disco(monkeypatch, tmp_path)
+    colunas, dtypes_leitura = colunas_leitura_custos(*COLUNAS_MARGEM)
+    with pytest.raises(ErroEsquemaPlanilha, match="'ESTOQUE'"):
+        ler_abas_planilha(arquivo.getvalue(), colunas, dtypes_leitura, modo_leitura=modo)
+
+    # Mesmo que a sondagem do cabeçalho não acuse a aba ausente, a leitura não devolve um resultado parcial
+    monkeypatch.setattr(processar_planilha_otimizado_melhorado, "verificar_esquema_planilha",
+                        lambda *args: {"erros": [], "avisos": [], "mapeamento": {}})
+    with pytest.raises(ErroEsquemaPlanilha, match="'ESTOQUE'"):
+        ler_abas_planilha(arquivo.getvalue(), colunas, dtypes_leitura, modo_leitura=modo)
@@ -0,0 +1,53 @@
+import random
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from processar_planilha_otimizado_melhorado import converter_margem_para_numero_final, converter_margem_vetorizado
+
+TEXTOS_FIXOS = ["15,23%", " 15,23 % ", "0.1523", "0,1523", "abc", "#N/D", "", " ", "%", "-5,5%", "1.5", "1,5000001",
+                "-0", "0", "1e2", "1_0", "nan", "NaN", "inf", "-Infinity", "1.2.3", "12,5 %%", "--1", "+3", "R$ 10"]
+
+
+def _valor_aleatorio(rng):
+    tipo = rng.randrange(9)
+    if tipo == 0: return rng.choice(TEXTOS_FIXOS)
+    if tipo == 1:  # Texto numérico com vírgula/ponto, espaços e "%" opcionais
+        numero = f"{rng.uniform(-200, 200):.{rng.randrange(0, 5)}f}".replace(".", rng.choice([",", "."]))
+        return rng.choice(["", " "]) + numero + rng.choice(["", "%", " %", "% "])
+    if tipo == 2: return rng.randint(-200, 200)
+    if tipo == 3: return rng.choice([rng.uniform(-2, 2), rng.uniform(-300, 300), 0.0, -0.0, 1.5, -1.5, float("inf")])
+    if tipo == 4: return rng.choice([np.nan, None, pd.NA, pd.NaT])
+    if tipo == 5: return rng.choice([True, False])
+    if tipo == 6: return rng.choice([datetime(2024, 5, rng.randint(1, 28)), date(2023, 1, 2), pd.Timestamp("2024-01-01")])
+    if tipo == 7: return rng.choice([np.float64(rng.uniform(-2, 2)), np.int64(rng.randint(-5, 5))])
+    return "".join(rng.choice("0123456789,.% -abcxyz") for _ in range(rng.randrange(0, 8)))
+
+
+def _esperado_conversao(valores):
+    return np.array([converter_margem_para_numero_final(v) for v in valores], dtype='float64')
+
+
+@pytest.mark.parametrize("semente", range(20))
+def test_conversao_vetorizada_igual_a_escalar_em_colunas_mistas(semente):
+    rng = random.Random(semente)
+    valores = [_valor_aleatorio(rng) for _ in range(rng.choice([1, 10, 500]))]
+    serie = pd.Series(valores, dtype=object)
+    np.testing.assert_array_equal(converter_margem_vetorizado(serie).to_numpy(), _esperado_conversao(valores))
+
+
+@pytest.mark.parametrize("serie", [
+    pd.Series([0.1523, 15.23, -1.5, 1.5000001, 0.0, np.nan, -0.0, float("inf")]),
+    pd.Series([0, 1, -1, 2, 150], dtype='int64'),
+    pd.Series([1, None, 3], dtype='Int64'),
+    pd.Series([True, False, True]),
+    pd.Series(["15,23%", " 15,23 % ", "0.1523", "abc", "#N/D", None], dtype='str'),
+    pd.Series(pd.to_datetime(["2024-01-01", None])),
+    pd.Series([], dtype=object),
+    pd.Series([None, np.nan], dtype=object),
+])
+def test_conversao_vetorizada_igual_a_escalar_em_colunas_tipadas(serie):
+    esperado = _esperado_conversao(serie.astype(object).tolist())
+    np.testing.assert_array_equal(converter_margem_vetorizado(serie).to_numpy(), esperado)
@@ -0,0 +1,29 @@
+import pytest
+
+import regras_derivacao
+from regras_derivacao import ErroRegrasDerivacao, REGRAS_MINIMAS, carregar_regras_derivacao
+
+
+def test_arquivo_padrao_independe_do_diretorio_atual(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert carregar_regras_derivacao(regras_derivacao.CAMINHO_REGRAS_PADRAO)["tipo_venda"]["regras"]
+
+
+def test_arquivo_configurado_ausente_levanta_erro(tmp_path):
+    with pytest.raises(ErroRegrasDerivacao):
+        carregar_regras_derivacao(str(tmp_path / "regras.json"))
+
+
+@pytest.mark.parametrize("conteudo", ["{sem aspas", "[1, 2]"])
+def test_arquivo_invalido_levanta_erro(tmp_path, conteudo):
+    caminho = tmp_path / "regras.json"
+    caminho.write_text(conteudo, encoding="utf-8")
+    with pytest.raises(ErroRegrasDerivacao):
+        carregar_regras_derivacao(str(caminho))
+
+
+def test_arquivo_padrao_ausente_avisa_e_usa_regras_minimas(tmp_path, monkeypatch):
+    caminho = str(tmp_path / "regras_derivacao.json")
+    monkeypatch.setattr(regras_derivacao, "CAMINHO_REGRAS_PADRAO", caminho)
+    with pytest.warns(UserWarning):
+        assert carregar_regras_derivacao(caminho) is REGRAS_MINIMAS